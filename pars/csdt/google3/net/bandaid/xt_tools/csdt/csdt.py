@@ -4,14 +4,25 @@ __author__ = 'morda@google.com (Marcin Kaminski)'
 
 import argparse
 import curses
+import errno
+import hashlib
 import logging
 import logging.handlers
+import select
 import signal
 import sys
 import time
 
 from google3.net.bandaid.xt_tools.csdt import lib_colors
 from google3.net.bandaid.xt_tools.csdt import lib_common
+from google3.net.bandaid.xt_tools.csdt import lib_daemon
+from google3.net.bandaid.xt_tools.csdt import lib_export
+from google3.net.bandaid.xt_tools.csdt import lib_netlink
+from google3.net.bandaid.xt_tools.csdt import lib_refresh
+from google3.net.bandaid.xt_tools.csdt import lib_sensors
+from google3.net.bandaid.xt_tools.csdt import lib_stats
+from google3.net.bandaid.xt_tools.csdt import lib_tools
+from google3.net.bandaid.xt_tools.csdt import tile
 from google3.net.bandaid.xt_tools.csdt import tile_connectivity
 from google3.net.bandaid.xt_tools.csdt import tile_disks
 from google3.net.bandaid.xt_tools.csdt import tile_fans
@@ -20,22 +31,33 @@ from google3.net.bandaid.xt_tools.csdt import tile_interfaces
 from google3.net.bandaid.xt_tools.csdt import tile_memory
 from google3.net.bandaid.xt_tools.csdt import tile_psus
 
-# TODO(morda): Move all color handling code to lib_colors.py.
-# Define curses color pairs.
-_COLOR_RED_ON_BLACK = 1
-_COLOR_GREEN_ON_BLACK = 2
-_COLOR_YELLOW_ON_BLACK = 3
-_COLOR_BLUE_ON_BLACK = 4
-_COLOR_MAGENTA_ON_BLACK = 5
-_COLOR_CYAN_ON_BLACK = 6
-_COLOR_WHITE_ON_BLACK = 7
-_COLOR_BLACK_ON_GREEN = 8
-
 # Define status bar message types.
 _STATUS_BAR_HELP = 0
 _STATUS_BAR_IDLE = 1
 _STATUS_BAR_REFRESH = 2
 _STATUS_BAR_REFUSE_REFRESH = 3
+_STATUS_BAR_INITIALISING = 4
+
+# Status bar message types giving way to timed messages until those expire.
+_STATUS_BAR_BACKGROUND_MESSAGES = [
+    _STATUS_BAR_IDLE,
+    _STATUS_BAR_REFRESH,
+    _STATUS_BAR_INITIALISING,
+]
+
+# Number of seconds to show a refused refresh request message for.
+_REFUSE_REFRESH_MESSAGE_TIMEOUT = 3
+
+# Maximum number of seconds to wait before updating the status bar countdown.
+_STATUS_BAR_UPDATE_INTERVAL = 1
+
+# Number of seconds over which main loop iterations are counted.
+_LOOP_STATISTICS_INTERVAL = 60
+
+# Position and size of the collector statistics overlay, covering all tiles
+# below the machine identification.
+_STATISTICS_OVERLAY_ROW = 3
+_STATISTICS_OVERLAY_HEIGHT = 21
 
 _HELP_CONTENTS = """
 The goal of this tool is to provide you with instant feedback on
@@ -69,7 +91,7 @@ TILES_TO_REGISTER = {
         'column': 0,
         'height': 3,
         'width': 80,
-        'color_theme': _COLOR_BLACK_ON_GREEN,
+        'color_theme': lib_colors.COLOR_BLACK_ON_GREEN,
     },
 
     # Left side of the screen.
@@ -124,13 +146,38 @@ class Error(Exception):
   pass
 
 
+def _ConfigureLogging(logfile, loglevel=logging.INFO):
+  """Configure the root logger for CSDT.
+
+  Args:
+    logfile: Log file path (string).
+    loglevel: Logging verbosity (logging.LOGLEVEL).
+  """
+  formatter = logging.Formatter(
+      fmt='%(asctime)s %(levelname)-10s %(message)s',
+      datefmt='%Y-%m-%d %H:%M:%S')
+
+  # This handler is necessary since the default handler doesn't attempt to
+  # re-open a log file if it disappears due to, i.e. being rotated.
+  handler = logging.handlers.WatchedFileHandler(logfile)
+  handler.setFormatter(formatter)
+  handler.setLevel(loglevel)
+
+  logger = logging.getLogger()
+  for existing_handler in logger.handlers:
+    logger.removeHandler(existing_handler)
+  logger.addHandler(handler)
+  logger.setLevel(loglevel)
+
+
 class ConsoleDisplayTool(object):
   """Console Status Display Tool."""
 
   def __init__(self, stdscr, tty=None, allow_exit=False,
                logfile='/var/log/csdt.log', loglevel='info',
                forced_refresh_min_interval=30, skip_initial_delay=False,
-               handle_keys=False, color_mode=None):
+               handle_keys=False, color_mode=None, stats_path=None,
+               daemon_socket_path=None):
     """Initialise Console Status Display Tool.
 
     Args:
@@ -144,6 +191,10 @@ class ConsoleDisplayTool(object):
       skip_initial_delay: Skip the initial delay when testing (bool).
       handle_keys: Allow keys to be used to control CSDT (bool).
       color_mode: Color mode (one of lib_colors.COLOR_MODE_*).
+      stats_path: Path of a file to write collector statistics to every
+          minute, if any (str).
+      daemon_socket_path: Socket of the daemon to receive tile content from
+          instead of refreshing tiles, if any (str). See lib_daemon.
     """
     self.stdscr = stdscr
     self.tty = tty
@@ -151,6 +202,7 @@ class ConsoleDisplayTool(object):
     self.skip_initial_delay = skip_initial_delay
     self.forced_refresh_min_interval = forced_refresh_min_interval
     self.handle_keys = handle_keys
+    self.stats_path = stats_path
 
     if color_mode:
       self.color_mode = color_mode
@@ -160,10 +212,28 @@ class ConsoleDisplayTool(object):
     self.color_codes = lib_colors.GetColorCodes(color_mode=self.color_mode)
 
     self.status_bar = None
+    self.status_bar_message_type = None
+    self.status_bar_timeout_timestamp = 0
     self.tiles = []
+    # Renderers are sent tiles refreshed by the daemon, which monitors
+    # network configuration changes itself.
+    self.network_monitor = None
+    if daemon_socket_path:
+      self.refresh_scheduler = lib_daemon.RemoteRefreshScheduler(
+          socket_path=daemon_socket_path)
+    else:
+      self.refresh_scheduler = lib_refresh.RefreshScheduler()
+      self.network_monitor = lib_netlink.OpenRtnetlinkMonitor()
+    self.statistics_overlay = None
 
-    self._ConfigureLogging(
+    _ConfigureLogging(
         logfile=logfile, loglevel=getattr(logging, loglevel.upper()))
+    logging.info('*' * 80)
+    if self.tty:
+      logging.info('Launching Console Status Display on %s.', self.tty)
+    else:
+      logging.info('Launching Console Status Display interactively.')
+    logging.info('*' * 80)
 
     self._InitialiseScreen()
 
@@ -174,35 +244,27 @@ class ConsoleDisplayTool(object):
 
     self.forced_refresh_timestamp = int(time.time())
 
-  def _ConfigureLogging(self, logfile, loglevel=logging.INFO):
-    """Configure the root logger for CSDT.
+    # The initial delay is introduced to prevent running ipmitool and megacli
+    # commands continuously too often, if CSDT crashes for some reason and is
+    # restarted by init, since it's running on the machine's TTY console.
+    # Only tiles which are cheap to refresh are shown until it passes. The
+    # daemon has an initial delay of its own, which renderers don't repeat.
+    if self.skip_initial_delay or daemon_socket_path:
+      self.initial_delay_timestamp = time.time()
+    else:
+      self.initial_delay_timestamp = (
+          time.time() + self.forced_refresh_min_interval)
 
-    Args:
-      logfile: Log file path (string).
-      loglevel: Logging verbosity (logging.LOGLEVEL).
-    """
-    formatter = logging.Formatter(
-        fmt='%(asctime)s %(levelname)-10s %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S')
-
-    # This handler is necessary since the default handler doesn't attempt to
-    # re-open a log file if it disappears due to, i.e. being rotated.
-    handler = logging.handlers.WatchedFileHandler(logfile)
-    handler.setFormatter(formatter)
-    handler.setLevel(loglevel)
-
-    logger = logging.getLogger()
-    for existing_handler in logger.handlers:
-      logger.removeHandler(existing_handler)
-    logger.addHandler(handler)
-    logger.setLevel(loglevel)
+    self.loop_iterations = 0
+    self.loop_iterations_timestamp = time.time()
+    self.loop_iterations_per_minute = None
 
-    logging.info('*' * 80)
-    if self.tty:
-      logging.info('Launching Console Status Display on %s.', self.tty)
-    else:
-      logging.info('Launching Console Status Display interactively.')
-    logging.info('*' * 80)
+    # Damage tracking statistics of the frame currently being drawn, used to
+    # measure how much output is saved by skipping unchanged tiles.
+    self.frame_output_bytes = 0
+    self.frame_tiles_drawn = 0
+    self.frame_tiles_unchanged = 0
+    self.output_bytes = 0
 
   def _InitialiseScreen(self):
     """Initialise curses screen objects and set their properties."""
@@ -217,8 +279,11 @@ class ConsoleDisplayTool(object):
     curses.nonl()
     # Interpret escape sequences generated by keypad and function keys.
     self.stdscr.keypad(1)
-    # Make getch() wait for input without blocking indefinitely.
-    self.stdscr.timeout(1)
+    # Make getch() return immediately, input is waited for with select().
+    self.stdscr.timeout(0)
+    # getch() refreshes the main window if it has never been drawn, which
+    # would blank out any tiles drawn before the first key press.
+    self.stdscr.refresh()
 
     if self.handle_keys:
       # Allow processing signals, flow-control and character input.
@@ -227,27 +292,10 @@ class ConsoleDisplayTool(object):
       # Set terminal to raw mode; disable flow-control and signals.
       curses.raw()
 
-    # TODO(morda): Move all color handling code to lib_colors.py.
-    # Initialise colour pairs.
-    curses.init_pair(
-        _COLOR_RED_ON_BLACK, curses.COLOR_RED, curses.COLOR_BLACK)
-    curses.init_pair(
-        _COLOR_GREEN_ON_BLACK, curses.COLOR_GREEN, curses.COLOR_BLACK)
-    curses.init_pair(
-        _COLOR_YELLOW_ON_BLACK, curses.COLOR_YELLOW, curses.COLOR_BLACK)
-    curses.init_pair(
-        _COLOR_BLUE_ON_BLACK, curses.COLOR_BLUE, curses.COLOR_BLACK)
-    curses.init_pair(
-        _COLOR_MAGENTA_ON_BLACK, curses.COLOR_MAGENTA, curses.COLOR_BLACK)
-    curses.init_pair(
-        _COLOR_CYAN_ON_BLACK, curses.COLOR_CYAN, curses.COLOR_BLACK)
-    curses.init_pair(
-        _COLOR_WHITE_ON_BLACK, curses.COLOR_WHITE, curses.COLOR_BLACK)
-    curses.init_pair(
-        _COLOR_BLACK_ON_GREEN, curses.COLOR_BLACK, curses.COLOR_GREEN)
+    lib_colors.InitialiseColorPairs()
 
   def RegisterTile(self, tile, row, column, height, width,
-                   color_theme=_COLOR_WHITE_ON_BLACK):
+                   color_theme=lib_colors.COLOR_WHITE_ON_BLACK):
     """Add a tile to the list of currently registered tiles.
 
     Args:
@@ -268,12 +316,15 @@ class ConsoleDisplayTool(object):
     tile_data = {
         'tile': tile(),
         'window': curses.newwin(height, width, row, column),
+        'content_digest': None,
     }
     tile_data['window'].bkgd(' ', curses.color_pair(color_theme))
     self.tiles.append(tile_data)
+    if isinstance(self.refresh_scheduler, lib_daemon.RemoteRefreshScheduler):
+      self.refresh_scheduler.Subscribe(tile_data['tile'])
 
   def _UpdateTile(self, tile, force_refresh=False):
-    """Update the contents of a tile if required.
+    """Request a background refresh of a tile's content if required.
 
     Args:
       tile: Dictionary with the following keys:
@@ -282,33 +333,80 @@ class ConsoleDisplayTool(object):
       force_refresh: Whether to request an immediate refresh (boolean).
 
     Returns:
-      True if content of a tile was refreshed.
+      True if refresh of a tile's content was requested.
       False otherwise.
     """
     if tile['tile'].IsRefreshRequired() or force_refresh:
-      logging.debug(
-          'Updating content of \'%s\' tile.', tile['tile'].GetTileName())
+      if self.refresh_scheduler.Submit(tile['tile']):
+        logging.debug(
+            'Updating content of \'%s\' tile.', tile['tile'].GetTileName())
+        return True
+    return False
 
-      self._UpdateStatusBar(
-          message_type=_STATUS_BAR_REFRESH, message=tile['tile'].GetTileName())
-      tile['window'].erase()
+  def _DrawTile(self, tile, content):
+    """Draw refreshed content of a tile in its window.
 
-      if tile['tile'].DisplayTileName():
-        tile_name = '{c.bold}%s{c.reset}\n' % tile['tile'].GetTileName()
-        self._AddStringWithAttributes(
-            window=tile['window'],
-            string=tile_name.format(c=self.color_codes))
-        self._AddStringWithAttributes(
-            window=tile['window'],
-            row=1, column=0,
-            string=tile['tile'].GetContent())
-      else:
-        self._AddStringWithAttributes(
-            window=tile['window'],
-            string=tile['tile'].GetContent())
-      tile['tile'].UpdateRefreshTimestamp()
-      return True
-    return False
+    Args:
+      tile: Dictionary with the following keys:
+      - tile: Tile instance (tile.InformationTile).
+      - window: Curses window instance (curses.window).
+      - content_digest: Digest of the content last drawn in the window (str).
+      content: Tile content to be displayed (str).
+
+    Returns:
+      True if the window has been redrawn and needs to be refreshed.
+      False if the content hasn't changed since it was last drawn.
+    """
+    tile['tile'].UpdateRefreshTimestamp()
+
+    content_digest = hashlib.md5(content).digest()
+    if content_digest == tile['content_digest']:
+      logging.debug('Content of \'%s\' tile unchanged, not redrawing it.',
+                    tile['tile'].GetTileName())
+      self.frame_tiles_unchanged += 1
+      return False
+    tile['content_digest'] = content_digest
+    self.frame_tiles_drawn += 1
+
+    tile['window'].erase()
+
+    if tile['tile'].DisplayTileName():
+      tile_name = '{c.bold}%s{c.reset}\n' % tile['tile'].GetTileName()
+      self._AddStringWithAttributes(
+          window=tile['window'],
+          string=tile_name.format(c=self.color_codes))
+      self._AddStringWithAttributes(
+          window=tile['window'],
+          row=1, column=0,
+          string=content)
+    else:
+      self._AddStringWithAttributes(
+          window=tile['window'],
+          string=content)
+    return True
+
+  def _DrawCompletedTiles(self):
+    """Draw content of all tiles whose background refresh has completed."""
+    for result in self.refresh_scheduler.GetCompletedRefreshes():
+      for tile in self.tiles:
+        if tile['tile'] is result.tile:
+          if self._DrawTile(tile, result.content):
+            tile['window'].noutrefresh()
+          break
+
+  def _UpdateScreen(self):
+    """Send all changes of the current frame to the terminal at once."""
+    curses.doupdate()
+
+    if self.frame_tiles_drawn or self.frame_tiles_unchanged:
+      logging.debug(
+          'Frame drawn: %d tiles redrawn, %d tiles unchanged, %d bytes of '
+          'content added.', self.frame_tiles_drawn,
+          self.frame_tiles_unchanged, self.frame_output_bytes)
+    self.output_bytes += self.frame_output_bytes
+    self.frame_output_bytes = 0
+    self.frame_tiles_drawn = 0
+    self.frame_tiles_unchanged = 0
 
   def _UpdateStatusBar(self, message_type=_STATUS_BAR_REFRESH, message='',
                        timeout=None):
@@ -317,86 +415,92 @@ class ConsoleDisplayTool(object):
     Args:
       message_type: Type of message to present, one of _STATUS_BAR_* (int).
       message: Additional message content to display on the status bar (str).
-      timeout: Time, in seconds, to keep the message visible for (int).
+      timeout: Time, in seconds, to keep the message visible for. Until it
+          expires, idle and refresh progress messages aren't shown (int).
     """
     if not self.status_bar:
       self.status_bar = curses.newwin(1, 80, 24, 0)
-      self.status_bar.bkgd(' ', curses.color_pair(_COLOR_BLACK_ON_GREEN))
-      self.status_bar.erase()
-
-      # The initial delay is introduced to prevent running ipmitool and megacli
-      # commands continuously too often, if CSDT crashes for some reason and is
-      # restarted by init, since it's running on the machine's TTY console.
-      if self.skip_initial_delay:
-        timeout = 1
-      else:
-        timeout = self.forced_refresh_min_interval
+      self.status_bar.bkgd(
+          ' ', curses.color_pair(lib_colors.COLOR_BLACK_ON_GREEN))
+
+    if timeout:
+      self.status_bar_timeout_timestamp = time.time() + timeout
+    elif (message_type in _STATUS_BAR_BACKGROUND_MESSAGES and
+          self._GetSecondsUntilStatusBarTimeout()):
+      return
 
+    self.status_bar_message_type = message_type
+    self.status_bar.erase()
+
+    # Show that tiles are waiting for the initial delay to pass.
+    if message_type == _STATUS_BAR_INITIALISING:
       self._AddStringWithAttributes(
           window=self.status_bar, row=0, column=1,
           string='Initialising GGC Console...')
-    else:
-      self.status_bar.erase()
-
-      # When idle, show time until the next screen refresh.
-      if message_type == _STATUS_BAR_IDLE:
-        seconds_until_refresh = self._GetSecondsUntilRefresh()
-        minutes = int(seconds_until_refresh / 60)
-        seconds = int(seconds_until_refresh % 60)
-        if self._AllowForcedRefresh() and self.handle_keys:
-          message = (
-              'Press {c.bold}SPACE{c.reset} to refresh or wait '
-              '{c.bold}%02d:%02d{c.reset}' % (minutes, seconds))
-          self._AddStringWithAttributes(
-              window=self.status_bar, row=0, column=1,
-              string=message.format(c=self.color_codes))
-        else:
-          message = (
-              'Wait {c.bold}%02d:%02d{c.reset} for an automatic refresh' %
-              (minutes, seconds))
-          self._AddStringWithAttributes(
-              window=self.status_bar, row=0, column=1,
-              string=message.format(c=self.color_codes))
-        if self.handle_keys:
-          message = 'Press {c.bold}h{c.reset} for help'
-          self._AddStringWithAttributes(
-              window=self.status_bar, row=0, column=63,
-              string=message.format(c=self.color_codes))
-
-      # Tell user to wait longer before forcing a screen refresh.
-      elif message_type == _STATUS_BAR_REFUSE_REFRESH:
-        time_until_refresh_allowed = self.forced_refresh_min_interval - (
-            int(time.time() - self.forced_refresh_timestamp))
+
+    # When idle, show time until the next screen refresh.
+    elif message_type == _STATUS_BAR_IDLE:
+      seconds_until_refresh = self._GetSecondsUntilRefresh()
+      minutes = int(seconds_until_refresh / 60)
+      seconds = int(seconds_until_refresh % 60)
+      if self._AllowForcedRefresh() and self.handle_keys:
         message = (
-            'Please wait {c.bold}%d{c.reset} more seconds ' %
-            time_until_refresh_allowed)
+            'Press {c.bold}SPACE{c.reset} to refresh or wait '
+            '{c.bold}%02d:%02d{c.reset}' % (minutes, seconds))
         self._AddStringWithAttributes(
             window=self.status_bar, row=0, column=1,
             string=message.format(c=self.color_codes))
-
-      # Show message to exit help and go back to main screen.
-      elif message_type == _STATUS_BAR_HELP:
-        message = 'Press {c.bold}almost{c.reset} any key to go back'
+      else:
+        message = (
+            'Wait {c.bold}%02d:%02d{c.reset} for an automatic refresh' %
+            (minutes, seconds))
         self._AddStringWithAttributes(
             window=self.status_bar, row=0, column=1,
             string=message.format(c=self.color_codes))
-
-      # Show screen refresh progress.
-      elif message_type == _STATUS_BAR_REFRESH:
-        message = 'Refreshing: {c.bold}%s{c.reset}' % message
+      if self.handle_keys:
+        message = 'Press {c.bold}h{c.reset} for help'
         self._AddStringWithAttributes(
-            window=self.status_bar, row=0, column=1,
+            window=self.status_bar, row=0, column=63,
             string=message.format(c=self.color_codes))
 
-      else:
-        logging.debug('Unsupported status bar message_type passed.')
-        return
+    # Tell user to wait longer before forcing a screen refresh.
+    elif message_type == _STATUS_BAR_REFUSE_REFRESH:
+      time_until_refresh_allowed = self.forced_refresh_min_interval - (
+          int(time.time() - self.forced_refresh_timestamp))
+      message = (
+          'Please wait {c.bold}%d{c.reset} more seconds ' %
+          time_until_refresh_allowed)
+      self._AddStringWithAttributes(
+          window=self.status_bar, row=0, column=1,
+          string=message.format(c=self.color_codes))
 
-    self.status_bar.refresh()
+    # Show message to exit help and go back to main screen.
+    elif message_type == _STATUS_BAR_HELP:
+      message = 'Press {c.bold}almost{c.reset} any key to go back'
+      self._AddStringWithAttributes(
+          window=self.status_bar, row=0, column=1,
+          string=message.format(c=self.color_codes))
 
-    # If timeout is specified, make sure the message is visible for n seconds.
-    if timeout:
-      time.sleep(timeout)
+    # Show screen refresh progress.
+    elif message_type == _STATUS_BAR_REFRESH:
+      message = 'Refreshing: {c.bold}%s{c.reset}' % message
+      self._AddStringWithAttributes(
+          window=self.status_bar, row=0, column=1,
+          string=message.format(c=self.color_codes))
+
+    else:
+      logging.debug('Unsupported status bar message_type passed.')
+      return
+
+    self.status_bar.noutrefresh()
+
+  def _GetSecondsUntilStatusBarTimeout(self):
+    """Get the number of seconds a timed status bar message remains visible."""
+    return max(0, self.status_bar_timeout_timestamp - time.time())
+
+  def _IsInitialDelayOver(self):
+    """Check if tiles which are expensive to refresh may be refreshed."""
+    return time.time() >= self.initial_delay_timestamp
 
   def _RedrawScreen(self, force_refresh=False):
     """Redraw all curses screens and windows."""
@@ -407,17 +511,78 @@ class ConsoleDisplayTool(object):
       if execute_forced_refresh:
         logging.info('Requesting immediate screen refresh.')
         self.forced_refresh_timestamp = time.time()
+        lib_common.GetHostSnapshot().Invalidate()
+        lib_sensors.GetSensorSampler().Invalidate()
+        lib_tools.GetToolRegistry().Invalidate()
       else:
         logging.warning('Refusing immediate screen refresh request.')
         self._UpdateStatusBar(
-            message_type=_STATUS_BAR_REFUSE_REFRESH, timeout=3)
+            message_type=_STATUS_BAR_REFUSE_REFRESH,
+            timeout=_REFUSE_REFRESH_MESSAGE_TIMEOUT)
 
+    initial_delay_over = self._IsInitialDelayOver()
     for tile in self.tiles:
-      if self._UpdateTile(tile, force_refresh=execute_forced_refresh):
-        tile['window'].touchwin()
-        tile['window'].refresh()
+      if initial_delay_over or tile['tile'].IsCheapToRefresh():
+        self._UpdateTile(tile, force_refresh=execute_forced_refresh)
+
+    self._DrawCompletedTiles()
+
+    # Show refresh progress while any tile is still being refreshed.
+    pending_tiles = self.refresh_scheduler.GetPendingTiles()
+    if pending_tiles:
+      message = pending_tiles[0].GetTileName()
+      if len(pending_tiles) > 1:
+        message += ' (+%d more)' % (len(pending_tiles) - 1)
+      self._UpdateStatusBar(message_type=_STATUS_BAR_REFRESH, message=message)
+    elif not initial_delay_over:
+      self._UpdateStatusBar(message_type=_STATUS_BAR_INITIALISING)
+    else:
+      self._UpdateStatusBar(message_type=_STATUS_BAR_IDLE)
 
-    self._UpdateStatusBar(message_type=_STATUS_BAR_IDLE)
+    self._DrawStatisticsOverlay()
+    self._UpdateScreen()
+
+  def _DrawStatisticsOverlay(self):
+    """Draw collector statistics over the tiles, if the overlay is shown."""
+    if not self.statistics_overlay:
+      return
+    self.statistics_overlay.erase()
+    message = '{c.bold}Collector statistics{c.reset} (press d to hide)'
+    self._AddStringWithAttributes(
+        window=self.statistics_overlay, row=0, column=1,
+        string=message.format(c=self.color_codes))
+    # Statistics contain command lines, so they aren't passed to format().
+    summary = lib_stats.GetCollectorStatistics().FormatSummary()
+    self._AddStringWithAttributes(
+        window=self.statistics_overlay, row=2, column=1,
+        string='\n'.join(summary[:_STATISTICS_OVERLAY_HEIGHT - 2]))
+    # Refreshed tiles are drawn below the overlay, so it has to be redrawn.
+    self.statistics_overlay.touchwin()
+    self.statistics_overlay.noutrefresh()
+
+  def _ToggleStatisticsOverlay(self):
+    """Show or hide collector statistics over the tiles."""
+    if self.statistics_overlay:
+      logging.info('Hiding collector statistics.')
+      self.statistics_overlay = None
+      self._RestoreTiles()
+    else:
+      logging.info('Showing collector statistics.')
+      self.statistics_overlay = curses.newwin(
+          _STATISTICS_OVERLAY_HEIGHT, 80, _STATISTICS_OVERLAY_ROW, 0)
+      self.statistics_overlay.bkgd(
+          ' ', curses.color_pair(lib_colors.COLOR_WHITE_ON_BLACK))
+      self._DrawStatisticsOverlay()
+      self._UpdateScreen()
+
+  def _RestoreTiles(self):
+    """Redraw the main screen after it has been covered by other windows."""
+    self.stdscr.erase()
+    self.stdscr.noutrefresh()
+    for tile in self.tiles:
+      tile['window'].touchwin()
+      tile['window'].noutrefresh()
+    self._UpdateScreen()
 
   def _ShowHelp(self):
     """Show help and usage information."""
@@ -430,19 +595,19 @@ class ConsoleDisplayTool(object):
     self._AddStringWithAttributes(
         window=self.stdscr, row=3, column=1,
         string=_HELP_CONTENTS.format(c=self.color_codes))
-    self.stdscr.refresh()
+    self.stdscr.noutrefresh()
     self._UpdateStatusBar(message_type=_STATUS_BAR_HELP)
+    self._UpdateScreen()
     while 1:
+      self._WaitForEvents(timeout=None, wait_for_refreshes=False)
       key = self.stdscr.getch()
       # TODO(morda): Figure out why getch() always returns key code 10 (RETURN)
       # even if no key is pressed. I chose to ignore those keys for now.
       if key not in [-1, 10]:
         logging.info('Hiding help window.')
-        self.stdscr.erase()
-        self.stdscr.refresh()
-        for tile in self.tiles:
-          tile['window'].touchwin()
-          tile['window'].refresh()
+        self._RestoreTiles()
+        self._DrawStatisticsOverlay()
+        self._UpdateScreen()
         break
 
   def _HandleKey(self, key):
@@ -450,12 +615,21 @@ class ConsoleDisplayTool(object):
     try:
       logging.debug('Key pressed: %s (%s)', chr(key), key)
 
+      # Tiles are refreshed more often while a technician is at the console.
+      lib_common.RecordUserActivity()
+      if isinstance(self.refresh_scheduler,
+                    lib_daemon.RemoteRefreshScheduler):
+        self.refresh_scheduler.RecordUserActivity()
+
       if chr(key) in [' ', 'r', 'R']:
         self._RedrawScreen(force_refresh=True)
 
       if chr(key) in ['h', 'H', '?']:
         self._ShowHelp()
 
+      if chr(key) in ['d', 'D']:
+        self._ToggleStatisticsOverlay()
+
       if chr(key) in ['q', 'Q']:
         if self.allow_exit:
           self.RestoreScreenAndExit()
@@ -477,40 +651,127 @@ class ConsoleDisplayTool(object):
     """
     window.move(row, column)
 
-    lines = string.splitlines()
-    attributes = curses.A_NORMAL
-
-    for line in lines:
-      for string_token in lib_colors.GetStringTokens(line, self.color_mode):
-        if string_token == self.color_codes.bold:
-          attributes |= curses.A_BOLD
-        elif string_token == self.color_codes.red:
-          attributes |= curses.color_pair(_COLOR_RED_ON_BLACK)
-        elif string_token == self.color_codes.green:
-          attributes |= curses.color_pair(_COLOR_GREEN_ON_BLACK)
-        elif string_token == self.color_codes.yellow:
-          attributes |= curses.color_pair(_COLOR_YELLOW_ON_BLACK)
-        elif string_token == self.color_codes.blue:
-          attributes |= curses.color_pair(_COLOR_BLUE_ON_BLACK)
-        elif string_token == self.color_codes.magenta:
-          attributes |= curses.color_pair(_COLOR_MAGENTA_ON_BLACK)
-        elif string_token == self.color_codes.cyan:
-          attributes |= curses.color_pair(_COLOR_CYAN_ON_BLACK)
-        elif string_token == self.color_codes.white:
-          attributes |= curses.color_pair(_COLOR_WHITE_ON_BLACK)
-        elif string_token == self.color_codes.reset:
-          attributes = curses.A_NORMAL
-        else:
-          try:
-            window.addstr(string_token, attributes)
-          except curses.error:
-            logging.debug('Unable to add string: \'%s\'', string_token)
+    for line in lib_colors.CompileString(string, self.color_mode):
+      for text, attributes in line:
+        self.frame_output_bytes += len(text)
+        try:
+          window.addstr(text, attributes)
+        except curses.error:
+          logging.debug('Unable to add string: \'%s\'', text)
       row += 1
       try:
         window.move(row, column)
       except curses.error:
         logging.debug('Last line, not moving cursor position.')
 
+  def _WaitForEvents(self, timeout, wait_for_refreshes=True):
+    """Wait for a key press, a completed tile refresh or a timeout.
+
+    Changes of network configuration also end the wait, scheduling tiles
+    showing it to be refreshed.
+
+    Args:
+      timeout: Maximum time to wait or None to wait indefinitely (float,
+          seconds).
+      wait_for_refreshes: Whether a completed tile refresh or a network
+          configuration change ends the wait (bool).
+
+    Returns:
+      True if input from the terminal is waiting to be read.
+      False otherwise.
+    """
+    read_fds = []
+    if wait_for_refreshes:
+      read_fds.append(self.refresh_scheduler)
+      if self.network_monitor:
+        read_fds.append(self.network_monitor)
+    if self.handle_keys:
+      read_fds.append(sys.stdin)
+    try:
+      readable_fds, _, _ = select.select(read_fds, [], [], timeout)
+    except select.error as error:
+      # Signals which didn't terminate CSDT interrupt the wait.
+      if error.args[0] != errno.EINTR:
+        raise
+      return False
+    if self.network_monitor in readable_fds:
+      tile.HandleNetworkChanges(
+          self.network_monitor,
+          [registered_tile['tile'] for registered_tile in self.tiles])
+    return sys.stdin in readable_fds
+
+  def _HandlePendingKeys(self):
+    """Handle all key presses waiting to be read."""
+    while 1:
+      key = self.stdscr.getch()
+      if key == -1:
+        break
+      # TODO(morda): Figure out why getch() always returns key code 10
+      # (RETURN) even if no key is pressed. I chose to ignore those keys for
+      # now.
+      if key != 10:
+        self._HandleKey(key)
+
+  def _GetSecondsUntilNextEvent(self):
+    """Get the number of seconds the main loop may wait for events.
+
+    Returns:
+      Number of seconds (float) or None if there's nothing to wait for other
+      than key presses and completed tile refreshes.
+    """
+    deadlines = []
+
+    # The idle status bar shows a countdown which has to be kept up to date.
+    if self.status_bar_message_type == _STATUS_BAR_IDLE:
+      deadlines.append(_STATUS_BAR_UPDATE_INTERVAL)
+
+    # So does the collector statistics overlay.
+    if self.statistics_overlay:
+      deadlines.append(_STATUS_BAR_UPDATE_INTERVAL)
+
+    if self._GetSecondsUntilStatusBarTimeout():
+      deadlines.append(self._GetSecondsUntilStatusBarTimeout())
+
+    initial_delay_over = self._IsInitialDelayOver()
+    if not initial_delay_over:
+      deadlines.append(self.initial_delay_timestamp - time.time())
+
+    for tile in self.tiles:
+      if self.refresh_scheduler.IsPending(tile['tile']):
+        continue  # Refresh completion is signalled by the scheduler.
+      if initial_delay_over or tile['tile'].IsCheapToRefresh():
+        deadlines.append(tile['tile'].GetSecondsUntilRefresh())
+
+    if deadlines:
+      return max(0, min(deadlines))
+    return None
+
+  def _CountLoopIteration(self):
+    """Count main loop iterations and periodically log their rate."""
+    self.loop_iterations += 1
+    seconds_elapsed = time.time() - self.loop_iterations_timestamp
+    if seconds_elapsed >= _LOOP_STATISTICS_INTERVAL:
+      self.loop_iterations_per_minute = (
+          self.loop_iterations * 60.0 / seconds_elapsed)
+      logging.info('Main loop iterations per minute: %.1f',
+                   self.loop_iterations_per_minute)
+      logging.info('Bytes of content added to windows in the last minute: %d',
+                   self.output_bytes)
+      self.output_bytes = 0
+      if self.stats_path:
+        self._WriteStatistics()
+      self.loop_iterations = 0
+      self.loop_iterations_timestamp = time.time()
+
+  def _WriteStatistics(self):
+    """Write collector statistics to the requested file."""
+    try:
+      lib_common.WriteFileAtomically(
+          self.stats_path, lib_stats.GetCollectorStatistics().Format())
+    except (IOError, OSError) as error:
+      logging.error('Unable to write collector statistics to %s: %s',
+                    self.stats_path, error)
+
   def _GetSecondsUntilRefresh(self):
     """Get the number of seconds until the next data screen refresh."""
     return max([tile['tile'].GetSecondsUntilRefresh() for tile in self.tiles])
@@ -554,20 +815,77 @@ class ConsoleDisplayTool(object):
 
   def Run(self):
     """Run the Console Display Tool."""
-    self._UpdateStatusBar()
+    self._UpdateStatusBar(message_type=_STATUS_BAR_INITIALISING)
     while 1:
-      if self.handle_keys:
-        key = self.stdscr.getch()
-        # TODO(morda): Figure out why getch() always returns key code 10
-        # (RETURN) even if no key is pressed. I chose to ignore those keys for
-        # now.
-        if key not in [-1, 10]:
-          self._HandleKey(key)
-      else:
-        # If user input is disabled, introduce the same delay as set by
-        # self.stdscr.timeout().
-        time.sleep(0.1)
+      self._CountLoopIteration()
       self._RedrawScreen()
+      if self._WaitForEvents(timeout=self._GetSecondsUntilNextEvent()):
+        self._HandlePendingKeys()
+
+
+def _RunConsoleDisplayTool(stdscr, args):
+  """Initialise CSDT, register all tiles and run it until it exits."""
+  app = ConsoleDisplayTool(
+      stdscr,
+      tty=args.tty,
+      allow_exit=args.allow_exit,
+      logfile=args.logfile,
+      loglevel=args.loglevel,
+      forced_refresh_min_interval=int(args.forced_refresh_min_interval),
+      skip_initial_delay=args.skip_initial_delay,
+      handle_keys=args.handle_keys,
+      stats_path=args.stats,
+      daemon_socket_path=args.socket_path if args.renderer else None)
+
+  for tile_spec in TILES_TO_REGISTER.itervalues():
+    app.RegisterTile(**tile_spec)
+
+  app.Run()
+
+
+def _RunExporter(args):
+  """Refresh all tiles without a screen and publish their data.
+
+  Tile data is exported to files and, when running as the daemon, also sent
+  to renderers.
+  """
+  _ConfigureLogging(
+      logfile=args.logfile, loglevel=getattr(logging, args.loglevel.upper()))
+  logging.info('*' * 80)
+  if args.daemon:
+    logging.info('Launching Console Status Display daemon.')
+  else:
+    logging.info('Launching Console Status Display exporter.')
+  logging.info('*' * 80)
+
+  # The initial delay protects the machine from a crash looping exporter just
+  # like it does from a crash looping console.
+  if args.skip_initial_delay:
+    initial_delay = 0
+  else:
+    initial_delay = int(args.forced_refresh_min_interval)
+
+  tiles = [
+      tile_spec['tile']() for tile_spec in TILES_TO_REGISTER.itervalues()]
+  if args.daemon:
+    daemon = lib_daemon.Daemon(
+        tiles=tiles,
+        socket_path=args.socket_path,
+        forced_refresh_min_interval=int(args.forced_refresh_min_interval),
+        textfile_path=args.export_textfile,
+        json_path=args.export_json,
+        initial_delay=initial_delay)
+    try:
+      daemon.Run()
+    finally:
+      daemon.Close()
+  else:
+    exporter = lib_export.Exporter(
+        tiles=tiles,
+        textfile_path=args.export_textfile,
+        json_path=args.export_json,
+        initial_delay=initial_delay)
+    exporter.Run()
 
 
 def main(args):
@@ -577,6 +895,22 @@ def main(args):
     lib_common.InstallCsdt(args)
     lib_common.ExitCsdt(lib_common.CSDT_EXIT_NORMAL)
 
+  if args.daemon:
+    pidfile = lib_common.WritePid(
+        pidfile_path=lib_common.CSDT_DAEMON_PIDFILE_PATH)
+    try:
+      _RunExporter(args)
+    finally:
+      pidfile.close()
+
+  if args.export:
+    pidfile = lib_common.WritePid(
+        pidfile_path=lib_common.CSDT_EXPORT_PIDFILE_PATH)
+    try:
+      _RunExporter(args)
+    finally:
+      pidfile.close()
+
   # Set input and output to a physical or serial console, if requested.
   if args.tty:
     lib_common.SetInputOutputDevice(tty_device=args.tty)
@@ -584,20 +918,9 @@ def main(args):
   pidfile = lib_common.WritePid()
 
   try:
-    app = curses.wrapper(
-        ConsoleDisplayTool,
-        tty=args.tty,
-        allow_exit=args.allow_exit,
-        logfile=args.logfile,
-        loglevel=args.loglevel,
-        forced_refresh_min_interval=int(args.forced_refresh_min_interval),
-        skip_initial_delay=args.skip_initial_delay,
-        handle_keys=args.handle_keys)
-
-    for tile_spec in TILES_TO_REGISTER.itervalues():
-      app.RegisterTile(**tile_spec)
-
-    app.Run()
+    # The tool has to run within curses.wrapper(), which restores the terminal
+    # to its original mode as soon as the wrapped function returns.
+    curses.wrapper(_RunConsoleDisplayTool, args)
 
   # Exception type being caught here is intentionally broad to hide stack traces
   # and error messages from the application's user interface and write them to
@@ -635,6 +958,28 @@ if __name__ == '__main__':
   parser.add_argument(
       '--handle_keys', action='store_true',
       help='do not handle keypresses')
+  parser.add_argument(
+      '--stats', default=None,
+      help='file to write per-tile collector statistics to every minute')
+  parser.add_argument(
+      '--export', action='store_true',
+      help='run without a screen and export tile data to files instead')
+  parser.add_argument(
+      '--export_textfile', default=None,
+      help='node_exporter textfile to write in export mode')
+  parser.add_argument(
+      '--export_json', default=None,
+      help='JSON snapshot to write in export mode')
+  parser.add_argument(
+      '--daemon', action='store_true',
+      help='run without a screen and publish tile content to renderers')
+  parser.add_argument(
+      '--renderer', action='store_true',
+      help='draw tile content received from the daemon instead of refreshing '
+      'tiles')
+  parser.add_argument(
+      '--socket_path', default=lib_daemon.DEFAULT_SOCKET_PATH,
+      help='Unix socket the daemon publishes tile content on')
   parser.add_argument(
       '--install', action='store_true',
       help='add CSDT to /etc/inittab and make init process re-read it')
@@ -645,4 +990,12 @@ if __name__ == '__main__':
       '--csdt_path', default=sys.argv[0],
       help='location of the CSDT application')
 
-  main(parser.parse_args())
+  parsed_args = parser.parse_args()
+  if parsed_args.daemon and (parsed_args.renderer or parsed_args.export):
+    parser.error('--daemon can\'t be combined with --renderer or --export')
+  if parsed_args.export and not (
+      parsed_args.export_textfile or parsed_args.export_json):
+    parser.error('--export requires --export_textfile and/or --export_json')
+  if parsed_args.renderer and parsed_args.export:
+    parser.error('--renderer can\'t be combined with --export')
+  main(parsed_args)
@@ -0,0 +1,317 @@
+"""Console Status Display Tool benchmarks - measure the cost of collectors.
+
+Parsers and tiles are benchmarked with sample fixtures (see lib_fixtures),
+so no particular hardware is needed to run them.
+"""
+
+import argparse
+import logging
+import os
+import pickle
+import resource
+import time
+
+from google3.net.bandaid.xt_tools.csdt import lib_commands
+from google3.net.bandaid.xt_tools.csdt import lib_common
+from google3.net.bandaid.xt_tools.csdt import lib_disk_parser
+from google3.net.bandaid.xt_tools.csdt import lib_fixtures
+from google3.net.bandaid.xt_tools.csdt import lib_hpssacli
+from google3.net.bandaid.xt_tools.csdt import lib_interfaces
+from google3.net.bandaid.xt_tools.csdt import lib_megacli
+from google3.net.bandaid.xt_tools.csdt import lib_perccli
+from google3.net.bandaid.xt_tools.csdt import lib_sensors
+from google3.net.bandaid.xt_tools.csdt import tile_connectivity
+from google3.net.bandaid.xt_tools.csdt import tile_disks
+from google3.net.bandaid.xt_tools.csdt import tile_fans
+from google3.net.bandaid.xt_tools.csdt import tile_identification
+from google3.net.bandaid.xt_tools.csdt import tile_interfaces
+from google3.net.bandaid.xt_tools.csdt import tile_memory
+from google3.net.bandaid.xt_tools.csdt import tile_psus
+
+# Command spawned by the spawn benchmark, as run by lib_interfaces.
+_SPAWN_BENCHMARK_COMMAND = 'ip route get 8.8.8.8'
+
+# Tiles whose refresh is benchmarked.
+_BENCHMARKED_TILES = [
+    tile_identification.IdentificationTile,
+    tile_disks.DiskStatusTile,
+    tile_psus.PsuStatusTile,
+    tile_fans.FanStatusTile,
+    tile_memory.MemoryStatusTile,
+    tile_interfaces.InterfaceStatusTile,
+    tile_connectivity.ConnectivityStatusTile,
+]
+
+
+def _GetPercentile(samples, percentile):
+  """Get a percentile of samples using the nearest-rank method.
+
+  Args:
+    samples: Sorted list of samples (list of float).
+    percentile: Percentile to get, between 0 and 100 (float).
+
+  Returns:
+    Sample at the given percentile (float).
+  """
+  rank = int(round(percentile / 100.0 * (len(samples) - 1)))
+  return samples[rank]
+
+
+def _FormatLatencies(name, latencies, peak_memory_kb=None):
+  """Format a summary of latency samples.
+
+  Args:
+    name: Name of the measured operation (str).
+    latencies: Latency samples (list of float, seconds).
+    peak_memory_kb: Growth of the peak resident set size while measuring, if
+        known (int, KiB).
+
+  Returns:
+    Summary line with latencies in milliseconds (str).
+  """
+  latencies = sorted(latencies)
+  summary = '%-45s p50 %8.3f  p99 %8.3f  max %8.3f ms' % (
+      name,
+      _GetPercentile(latencies, 50) * 1000,
+      _GetPercentile(latencies, 99) * 1000,
+      latencies[-1] * 1000)
+  if peak_memory_kb is not None:
+    summary += '  peak +%6d KiB' % peak_memory_kb
+  return summary
+
+
+def _MeasureInChild(function, iterations):
+  """Measure latency and peak memory use of a function in a child process.
+
+  Running each measurement in a forked child keeps caches and memory
+  allocated by one measurement from affecting the others, and allows the
+  peak resident set size to be attributed to a single measurement.
+
+  Args:
+    function: Function to call without arguments.
+    iterations: Number of times to call the function (int).
+
+  Returns:
+    Tuple of latencies (list of float, seconds) and growth of the peak
+    resident set size (int, KiB).
+  """
+  read_fd, write_fd = os.pipe()
+  pid = os.fork()
+  if not pid:
+    os.close(read_fd)
+    exit_code = 0
+    try:
+      initial_peak_memory_kb = resource.getrusage(
+          resource.RUSAGE_SELF).ru_maxrss
+      latencies = []
+      for _ in range(iterations):
+        start_timestamp = time.time()
+        function()
+        latencies.append(time.time() - start_timestamp)
+      peak_memory_kb = resource.getrusage(
+          resource.RUSAGE_SELF).ru_maxrss - initial_peak_memory_kb
+      with os.fdopen(write_fd, 'wb') as result_file:
+        pickle.dump((latencies, peak_memory_kb), result_file)
+    # Exception type being caught here is intentionally broad, the child
+    # process must never return to the caller.
+    except Exception:  # pylint: disable=broad-except
+      logging.exception('Benchmark failed:')
+      exit_code = 1
+    os._exit(exit_code)  # pylint: disable=protected-access
+
+  os.close(write_fd)
+  with os.fdopen(read_fd, 'rb') as result_file:
+    result = result_file.read()
+  os.waitpid(pid, 0)
+  if not result:
+    raise RuntimeError('Benchmark failed, see the log above.')
+  return pickle.loads(result)
+
+
+def BenchmarkSpawn(command, iterations):
+  """Compare command latency between the available spawn methods.
+
+  Runs are interleaved between the methods, so that changes in the load of
+  the machine affect all of them alike.
+
+  Args:
+    command: Command to run (str).
+    iterations: Number of times to run the command with each method (int).
+
+  Returns:
+    Dictionary mapping lib_commands.SPAWN_* methods to latencies (list).
+  """
+  runners = {}
+  latencies = {}
+  for spawn_method in lib_commands.GetSpawnMethods():
+    runners[spawn_method] = lib_commands.CommandRunner(
+        spawn_method=spawn_method)
+    latencies[spawn_method] = []
+
+  for _ in range(iterations):
+    for spawn_method, runner in runners.items():
+      start_timestamp = time.time()
+      runner.Run(command)
+      latencies[spawn_method].append(time.time() - start_timestamp)
+  return latencies
+
+
+def _GetParserBenchmarks(fixture):
+  """Get parsers to benchmark with the sample output of a fixture.
+
+  Args:
+    fixture: lib_fixtures.Fixture instance.
+
+  Must be called with the fixture in use, see lib_fixtures.UseFixture().
+
+  Returns:
+    List of (name, function) tuples for parsers the fixture has output for.
+  """
+  benchmarks = []
+
+  megacli_output = fixture.GetCommandOutput(
+      '%s -PDList -aALL' % lib_megacli.MEGACLI64_PATHS[0])
+  if megacli_output:
+    benchmarks.append((
+        'MegaCliParseDiskList',
+        lambda: lib_disk_parser.MegaCliParseDiskList(megacli_output)))
+
+  perccli_output = fixture.GetCommandOutput(
+      '%s /call/eall/sall show all j' % lib_perccli.PERCCLI_PATHS[0])
+  if perccli_output:
+    benchmarks.append((
+        'PercCliParseDiskList',
+        lambda: lib_disk_parser.PercCliParseDiskList(perccli_output)))
+
+  hpssacli_output = fixture.GetCommandOutput(
+      '%s controller slot=1 pd all show detail' % lib_hpssacli.HPSSACLI_PATH)
+  if hpssacli_output:
+    benchmarks.append((
+        'HpParseDiskList',
+        lambda: lib_disk_parser.HpParseDiskList(hpssacli_output)))
+
+  ipmitool_output = fixture.GetCommandOutput(
+      '%s sdr elist' % lib_sensors.PATH_IPMITOOL)
+  if ipmitool_output:
+    benchmarks.append((
+        'ParseSensors',
+        lambda: lib_sensors.ParseSensors(ipmitool_output)))
+
+  # Paths are already redirected to the fixture root by UseFixture().
+  if os.path.isdir(lib_interfaces.PROC_NET_BONDING_PATH):
+    benchmarks.append((
+        'GetBondingStateFromMachine',
+        lib_interfaces.GetBondingStateFromMachine))
+
+  benchmarks.append((
+      'GetInterfaceStatisticsFromMachine',
+      lib_interfaces.GetInterfaceStatisticsFromMachine))
+  return benchmarks
+
+
+def BenchmarkParsers(fixtures, iterations):
+  """Benchmark parsers with the sample output of fixtures.
+
+  Args:
+    fixtures: List of lib_fixtures.Fixture instances.
+    iterations: Number of times to run each parser (int).
+
+  Yields:
+    Tuples of benchmark name, latencies and peak memory growth.
+  """
+  for fixture in fixtures:
+    with lib_fixtures.UseFixture(fixture):
+      for name, function in _GetParserBenchmarks(fixture):
+        latencies, peak_memory_kb = _MeasureInChild(function, iterations)
+        yield '%s %s' % (fixture.name, name), latencies, peak_memory_kb
+
+
+def BenchmarkTiles(fixtures, iterations):
+  """Benchmark refreshing the data and the content of all tiles.
+
+  Host details and sensors shared by tiles are collected again on every
+  iteration, as they would be when their cache expires.
+
+  Args:
+    fixtures: List of lib_fixtures.Fixture instances.
+    iterations: Number of times to refresh each tile (int).
+
+  Yields:
+    Tuples of benchmark name, latencies and peak memory growth.
+  """
+  for fixture in fixtures:
+    with lib_fixtures.UseFixture(fixture):
+      for tile_class in _BENCHMARKED_TILES:
+        information_tile = tile_class()
+        information_tile.runner = fixture.runner
+
+        def GetTileData(information_tile=information_tile):
+          lib_common.GetHostSnapshot().Invalidate()
+          lib_sensors.GetSensorSampler().Invalidate()
+          information_tile.RefreshCommonTileData()
+          return information_tile.GetTileData()
+
+        latencies, peak_memory_kb = _MeasureInChild(GetTileData, iterations)
+        yield ('%s %s GetTileData' % (fixture.name, tile_class.__name__),
+               latencies, peak_memory_kb)
+
+        try:
+          tile_data = GetTileData()
+        except Exception:  # pylint: disable=broad-except
+          logging.exception('Unable to get data of %s:', tile_class.__name__)
+          continue
+        latencies, peak_memory_kb = _MeasureInChild(
+            lambda: information_tile.GetTileContent(tile_data), iterations)
+        yield ('%s %s GetTileContent' % (fixture.name, tile_class.__name__),
+               latencies, peak_memory_kb)
+
+
+def main(args):
+  logging.basicConfig(level=getattr(logging, args.loglevel.upper()))
+
+  if args.benchmark in ['parsers', 'tiles']:
+    if args.fixture:
+      fixtures = [
+          fixture for fixture in lib_fixtures.GetAllFixtures()
+          if fixture.name in args.fixture]
+    else:
+      fixtures = lib_fixtures.GetAllFixtures()
+    if args.benchmark == 'parsers':
+      results = BenchmarkParsers(fixtures, iterations=args.iterations)
+    else:
+      results = BenchmarkTiles(fixtures, iterations=args.iterations)
+    for name, latencies, peak_memory_kb in results:
+      print(_FormatLatencies(name, latencies, peak_memory_kb))
+
+  if args.benchmark == 'spawn':
+    print('Running \'%s\' %d times with each spawn method.' % (
+        args.command, args.iterations))
+    latencies = BenchmarkSpawn(
+        command=args.command, iterations=args.iterations)
+    for spawn_method in lib_commands.GetSpawnMethods():
+      print(_FormatLatencies(spawn_method, latencies[spawn_method]))
+    if len(latencies) == 1:
+      print('Only the %s spawn method is available, install subprocess32 or '
+            'a C library with POSIX_SPAWN_SETSID (glibc >= 2.34).' %
+            lib_commands.SPAWN_PREEXEC)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument(
+      'benchmark', choices=['parsers', 'spawn', 'tiles'],
+      help='benchmark to run')
+  parser.add_argument(
+      '--iterations', default=200, type=int,
+      help='number of iterations of each benchmark')
+  parser.add_argument(
+      '--command', default=_SPAWN_BENCHMARK_COMMAND,
+      help='command run by the spawn benchmark')
+  parser.add_argument(
+      '--fixture', action='append',
+      help='fixture to run parser and tile benchmarks with, all by default')
+  parser.add_argument(
+      '--loglevel', default='error',
+      choices=['debug', 'error', 'warning', 'info'],
+      help='log level')
+  main(parser.parse_args())
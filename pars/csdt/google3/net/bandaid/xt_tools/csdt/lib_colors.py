@@ -1,7 +1,9 @@
 """Console Status Display Tool color handling library."""
 
 import collections
+import curses
 import re
+import threading
 
 
 COLOR_MODE_OFF = 0
@@ -12,6 +14,20 @@ RE_TOKENS_OFF = re.compile(r'({c\.[a-z]+})')
 RE_TOKENS_DEBUG = re.compile(r'(<[\*RGYBMCW0]>)')
 RE_TOKENS_ANSI = re.compile(r'(\x1b\[\d*m\x0f?)')
 
+# Curses color pairs.
+COLOR_RED_ON_BLACK = 1
+COLOR_GREEN_ON_BLACK = 2
+COLOR_YELLOW_ON_BLACK = 3
+COLOR_BLUE_ON_BLACK = 4
+COLOR_MAGENTA_ON_BLACK = 5
+COLOR_CYAN_ON_BLACK = 6
+COLOR_WHITE_ON_BLACK = 7
+COLOR_BLACK_ON_GREEN = 8
+
+# Maximum number of compiled strings kept in the cache. Tiles and the status
+# bar only show a handful of distinct strings at any time.
+COMPILED_STRING_CACHE_SIZE = 256
+
 
 ColorCodes = collections.namedtuple(
     'ColorCodes',
@@ -92,3 +108,149 @@ def GetStringTokens(string, color_mode=COLOR_MODE_ANSI):
     return [token for token in RE_TOKENS_ANSI.split(string) if token]
 
   raise ValueError('Unsupported color mode: %r' % color_mode)
+
+
+def InitialiseColorPairs():
+  """Initialise curses color pairs. Requires curses to be initialised."""
+  curses.init_pair(COLOR_RED_ON_BLACK, curses.COLOR_RED, curses.COLOR_BLACK)
+  curses.init_pair(
+      COLOR_GREEN_ON_BLACK, curses.COLOR_GREEN, curses.COLOR_BLACK)
+  curses.init_pair(
+      COLOR_YELLOW_ON_BLACK, curses.COLOR_YELLOW, curses.COLOR_BLACK)
+  curses.init_pair(COLOR_BLUE_ON_BLACK, curses.COLOR_BLUE, curses.COLOR_BLACK)
+  curses.init_pair(
+      COLOR_MAGENTA_ON_BLACK, curses.COLOR_MAGENTA, curses.COLOR_BLACK)
+  curses.init_pair(COLOR_CYAN_ON_BLACK, curses.COLOR_CYAN, curses.COLOR_BLACK)
+  curses.init_pair(
+      COLOR_WHITE_ON_BLACK, curses.COLOR_WHITE, curses.COLOR_BLACK)
+  curses.init_pair(
+      COLOR_BLACK_ON_GREEN, curses.COLOR_BLACK, curses.COLOR_GREEN)
+
+
+def _GetTokenAttributes(color_mode):
+  """Get curses attributes added by each color code token.
+
+  Args:
+    color_mode: Color mode (one of COLOR_MODE_*).
+
+  Returns:
+    Dictionary mapping color code tokens (str) to curses attributes (int).
+    The reset token maps to None.
+  """
+  color_codes = GetColorCodes(color_mode=color_mode)
+  token_attributes = {
+      color_codes.bold: curses.A_BOLD,
+      color_codes.red: curses.color_pair(COLOR_RED_ON_BLACK),
+      color_codes.green: curses.color_pair(COLOR_GREEN_ON_BLACK),
+      color_codes.yellow: curses.color_pair(COLOR_YELLOW_ON_BLACK),
+      color_codes.blue: curses.color_pair(COLOR_BLUE_ON_BLACK),
+      color_codes.magenta: curses.color_pair(COLOR_MAGENTA_ON_BLACK),
+      color_codes.cyan: curses.color_pair(COLOR_CYAN_ON_BLACK),
+      color_codes.white: curses.color_pair(COLOR_WHITE_ON_BLACK),
+      color_codes.reset: None,
+  }
+  # Color codes are empty when colors are turned off and never match a token.
+  token_attributes.pop('', None)
+  return token_attributes
+
+
+class CompiledStringCache(object):
+  """Cache of strings compiled into runs of text with curses attributes.
+
+  Splitting a string into tokens and mapping color codes to curses attributes
+  is only done the first time a string is drawn. Least recently used strings
+  are evicted once the cache is full.
+
+  Attributes:
+    hits: Number of strings found in the cache (int).
+    misses: Number of strings which had to be compiled (int).
+  """
+
+  def __init__(self, max_size=COMPILED_STRING_CACHE_SIZE):
+    """Constructs a CompiledStringCache object.
+
+    Args:
+      max_size: Maximum number of compiled strings to keep (int).
+    """
+    self.max_size = max_size
+    self.hits = 0
+    self.misses = 0
+    self._compiled_strings = collections.OrderedDict()
+    self._token_attributes = {}
+    self._lock = threading.Lock()
+
+  def _Compile(self, string, color_mode):
+    """Compile a string into lines of text runs.
+
+    Color codes are cumulative until a reset code, including across lines.
+
+    Args:
+      string: String with color codes (str).
+      color_mode: Color mode (one of COLOR_MODE_*).
+
+    Returns:
+      Tuple of lines, each being a tuple of (text, curses attributes) tuples.
+    """
+    if color_mode not in self._token_attributes:
+      self._token_attributes[color_mode] = _GetTokenAttributes(color_mode)
+    token_attributes = self._token_attributes[color_mode]
+
+    lines = []
+    attributes = curses.A_NORMAL
+    for line in string.splitlines():
+      runs = []
+      for string_token in GetStringTokens(line, color_mode):
+        if string_token not in token_attributes:
+          runs.append((string_token, attributes))
+        elif token_attributes[string_token] is None:
+          attributes = curses.A_NORMAL
+        else:
+          attributes |= token_attributes[string_token]
+      lines.append(tuple(runs))
+    return tuple(lines)
+
+  def Get(self, string, color_mode=COLOR_MODE_ANSI):
+    """Get a compiled string, compiling it if it isn't cached.
+
+    Args:
+      string: String with color codes (str).
+      color_mode: Color mode (one of COLOR_MODE_*).
+
+    Raises:
+      ValueError: If unsupported color mode is requested.
+
+    Returns:
+      Tuple of lines, each being a tuple of (text, curses attributes) tuples.
+    """
+    key = (string, color_mode)
+    with self._lock:
+      compiled_string = self._compiled_strings.pop(key, None)
+      if compiled_string is None:
+        self.misses += 1
+        compiled_string = self._Compile(string, color_mode)
+        if len(self._compiled_strings) >= self.max_size:
+          self._compiled_strings.popitem(last=False)
+      else:
+        self.hits += 1
+      # Re-insert the string to mark it as the most recently used.
+      self._compiled_strings[key] = compiled_string
+      return compiled_string
+
+
+_compiled_string_cache = CompiledStringCache()
+
+
+def CompileString(string, color_mode=COLOR_MODE_ANSI):
+  """Get a string compiled into lines of (text, curses attributes) runs.
+
+  Args:
+    string: String with color codes (str).
+    color_mode: Color mode (one of COLOR_MODE_*).
+
+  Raises:
+    ValueError: If unsupported color mode is requested.
+
+  Returns:
+    Tuple of lines, each being a tuple of (text, curses attributes) tuples.
+  """
+  return _compiled_string_cache.Get(string, color_mode=color_mode)
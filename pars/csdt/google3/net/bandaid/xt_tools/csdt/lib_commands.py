@@ -1,15 +1,29 @@
 """Console Status Display Tool command runner library."""
 
+import ctypes
 import errno
+import heapq
 import logging
 import os
+import re
+import select
 import shlex
 import signal
 import subprocess
+import sys
 import tempfile
 import threading
 import time
 
+from google3.net.bandaid.xt_tools.csdt import lib_stats
+
+# subprocess32 backports Python 3's subprocess, which can start a new session
+# in its C fork+exec implementation instead of a Python preexec_fn.
+try:
+  import subprocess32
+except ImportError:
+  subprocess32 = None
+
 
 class Error(Exception):
   pass
@@ -27,6 +41,194 @@ STDOUT_STDERR = 'STDOUT_STDERR'
 # Default command timeout.
 DEFAULT_COMMAND_TIMEOUT = 60
 
+# Default number of seconds between SIGTERM and SIGKILL for timed out commands.
+DEFAULT_KILL_TIMEOUT = 3
+
+# Methods of starting a child process in a new session:
+# - SPAWN_NATIVE: start_new_session=True, with setsid() called by subprocess's
+#   C implementation between fork and exec. No Python code runs in the child,
+#   which allows vfork()/posix_spawn() to be used and is safe with threads.
+# - SPAWN_POSIX_SPAWN: posix_spawnp() from the C library called through
+#   ctypes, with POSIX_SPAWN_SETSID. Python 2's subprocess forks and execs
+#   from Python code, and closes inherited file descriptors one by one up to
+#   the limit on open files; the C library uses vfork() and close_range().
+# - SPAWN_PREEXEC: os.setsid() called from a Python preexec_fn in the child.
+SPAWN_NATIVE = 'native'
+SPAWN_POSIX_SPAWN = 'posix_spawn'
+SPAWN_PREEXEC = 'preexec'
+
+# posix_spawn() flag starting the child in a new session, glibc >= 2.26.
+POSIX_SPAWN_SETSID = 0x80
+
+# Size reserved for posix_spawn_file_actions_t and posix_spawnattr_t, which
+# are opaque and smaller than this in all C libraries.
+_POSIX_SPAWN_STRUCT_SIZE = 1024
+
+# Number of seconds between checks whether a process has exited after closing
+# its output, or when none of its output is captured.
+_REAP_INTERVAL = 0.01
+
+
+def _LoadPosixSpawn():
+  """Load the posix_spawn() functions of the C library.
+
+  Returns:
+    The C library (ctypes.CDLL), or None if it can't start a child in a new
+    session with all other file descriptors closed, or if subprocess isn't
+    Python 2's, whose internals _PosixSpawnPopen replaces.
+  """
+  if sys.version_info >= (3,):
+    return None
+  try:
+    libc = ctypes.CDLL('libc.so.6', use_errno=True)
+    for function in [
+        libc.posix_spawnp, libc.posix_spawnattr_init,
+        libc.posix_spawnattr_setflags, libc.posix_spawnattr_destroy,
+        libc.posix_spawn_file_actions_init,
+        libc.posix_spawn_file_actions_adddup2,
+        libc.posix_spawn_file_actions_addclose,
+        libc.posix_spawn_file_actions_addclosefrom_np,
+        libc.posix_spawn_file_actions_destroy]:
+      function.restype = ctypes.c_int
+  except (OSError, AttributeError):
+    return None
+  libc.posix_spawnattr_setflags.argtypes = [ctypes.c_char_p, ctypes.c_short]
+
+  # Older C libraries reject the POSIX_SPAWN_SETSID flag.
+  attributes = ctypes.create_string_buffer(_POSIX_SPAWN_STRUCT_SIZE)
+  libc.posix_spawnattr_init(attributes)
+  try:
+    if libc.posix_spawnattr_setflags(attributes, POSIX_SPAWN_SETSID):
+      return None
+  finally:
+    libc.posix_spawnattr_destroy(attributes)
+  return libc
+
+
+_libc = _LoadPosixSpawn()
+
+
+class _PosixSpawnPopen(subprocess.Popen):
+  """subprocess.Popen starting its child in a new session with posix_spawnp().
+
+  Only replaces the fork and exec of Python 2's subprocess.Popen, everything
+  else, i.e. setting up pipes and waiting for the child, is inherited.
+  """
+
+  def _execute_child(self, args, executable, preexec_fn, close_fds,
+                     cwd, env, universal_newlines,
+                     startupinfo, creationflags, shell, to_close,
+                     p2cread, p2cwrite,
+                     c2pread, c2pwrite,
+                     errread, errwrite):
+    """Start the child, see subprocess.Popen._execute_child()."""
+    # posix_spawn() can neither run Python code nor change directory in the
+    # child, and dup2() to a standard stream may overwrite another one.
+    redirections = [(p2cread, 0), (c2pwrite, 1), (errwrite, 2)]
+    if (preexec_fn or cwd is not None or any(
+        fd is not None and fd != target and fd <= 2
+        for fd, target in redirections)):
+      return super(_PosixSpawnPopen, self)._execute_child(
+          args, executable, os.setsid, close_fds, cwd, env, universal_newlines,
+          startupinfo, creationflags, shell, to_close, p2cread, p2cwrite,
+          c2pread, c2pwrite, errread, errwrite)
+
+    if isinstance(args, basestring):
+      args = [args]
+    else:
+      args = list(args)
+    if shell:
+      args = ['/bin/sh', '-c'] + args
+      if executable:
+        args[0] = executable
+    if executable is None:
+      executable = args[0]
+    if env is None:
+      env = os.environ
+    argv = (ctypes.c_char_p * (len(args) + 1))(*(args + [None]))
+    envp = (ctypes.c_char_p * (len(env) + 1))(
+        *(['%s=%s' % item for item in env.iteritems()] + [None]))
+
+    file_actions = ctypes.create_string_buffer(_POSIX_SPAWN_STRUCT_SIZE)
+    attributes = ctypes.create_string_buffer(_POSIX_SPAWN_STRUCT_SIZE)
+    _libc.posix_spawn_file_actions_init(file_actions)
+    _libc.posix_spawnattr_init(attributes)
+    try:
+      _libc.posix_spawnattr_setflags(attributes, POSIX_SPAWN_SETSID)
+      for fd, target in redirections:
+        if fd is not None and fd != target:
+          _libc.posix_spawn_file_actions_adddup2(file_actions, fd, target)
+      # The original descriptors aren't needed anymore once duplicated.
+      for fd in set(fd for fd, unused_target in redirections):
+        if fd is not None and fd > 2:
+          _libc.posix_spawn_file_actions_addclose(file_actions, fd)
+      if close_fds:
+        _libc.posix_spawn_file_actions_addclosefrom_np(file_actions, 3)
+      pid = ctypes.c_int()
+      error = _libc.posix_spawnp(
+          ctypes.byref(pid), executable, file_actions, attributes, argv, envp)
+    finally:
+      _libc.posix_spawn_file_actions_destroy(file_actions)
+      _libc.posix_spawnattr_destroy(attributes)
+      # Close the child's ends of the pipes, as subprocess.Popen does.
+      for child_fd, parent_fd in [
+          (p2cread, p2cwrite), (c2pwrite, c2pread), (errwrite, errread)]:
+        if child_fd is not None and parent_fd is not None:
+          os.close(child_fd)
+          to_close.remove(child_fd)
+
+    # Failures to exec are reported by posix_spawnp(), like subprocess.Popen
+    # raising the OSError of the child.
+    if error:
+      raise OSError(error, os.strerror(error))
+    self.pid = pid.value
+    self._child_created = True
+
+
+def GetSpawnMethods():
+  """Get the methods of starting a process available, the fastest first.
+
+  Returns:
+    List of SPAWN_* methods (list).
+  """
+  spawn_methods = []
+  if sys.version_info >= (3, 2) or subprocess32:
+    spawn_methods.append(SPAWN_NATIVE)
+  if _libc:
+    spawn_methods.append(SPAWN_POSIX_SPAWN)
+  spawn_methods.append(SPAWN_PREEXEC)
+  return spawn_methods
+
+
+def PopenInNewSession(spawn_method=None, **popen_kwargs):
+  """Start a child process as the leader of a new session and process group.
+
+  This allows signalling the child process and all its children at once,
+  i.e. on timeout, and disconnects it from any controlling terminal.
+
+  Args:
+    spawn_method: One of SPAWN_* or None to use the fastest available.
+    **popen_kwargs: Keyword arguments passed to subprocess.Popen.
+
+  Raises:
+    ValueError: If an unavailable spawn method is requested.
+
+  Returns:
+    The child process (subprocess.Popen, or a subclass, or subprocess32.Popen).
+  """
+  if spawn_method is None:
+    spawn_method = GetSpawnMethods()[0]
+  if spawn_method not in GetSpawnMethods():
+    raise ValueError('Unsupported spawn method: %r' % spawn_method)
+
+  lib_stats.GetCollectorStatistics().RecordFork()
+  if spawn_method == SPAWN_NATIVE:
+    popen_module = subprocess32 or subprocess
+    return popen_module.Popen(start_new_session=True, **popen_kwargs)
+  if spawn_method == SPAWN_POSIX_SPAWN:
+    return _PosixSpawnPopen(**popen_kwargs)
+  return subprocess.Popen(preexec_fn=os.setsid, **popen_kwargs)
+
 
 class CommandRunner(object):
   """Run commands directly in the local environment via subprocess."""
@@ -43,6 +245,15 @@ class CommandRunner(object):
       self.exit_code = exit_code
       self.output = output
 
+  def __init__(self, spawn_method=None):
+    """Constructs a CommandRunner object.
+
+    Args:
+      spawn_method: Method of starting commands, one of SPAWN_* or None to use
+          the fastest available (str).
+    """
+    self.spawn_method = spawn_method
+
   def _KillProcess(self, process, kill_timeout=3):
     """Gracefully kill a given process and all its children.
 
@@ -90,15 +301,8 @@ class CommandRunner(object):
     if timeout is None:
       timeout = DEFAULT_COMMAND_TIMEOUT
 
-    def ConfigureSubprocess():
-      # Create a new session and process group and make this subprocess the
-      # new group and session leader, disconnecting any controlling terminal.
-      # This allows us to signal the subprocess and all its children on timeout.
-      os.setsid()
-
     popen_kwargs = {
         'args': shlex.split(command),
-        'preexec_fn': ConfigureSubprocess,
     }
     with tempfile.TemporaryFile() as output_file:
       with open(os.devnull, 'r+') as dev_null:
@@ -123,7 +327,11 @@ class CommandRunner(object):
             raise ValueError('Unsupported capture_output: %r' % capture_output)
 
         logging.debug('Running: %s', command)
-        process = subprocess.Popen(**popen_kwargs)
+        start_timestamp = time.time()
+        # The subprocess is made the leader of a new session and process group,
+        # so that it can be signalled along with all its children on timeout.
+        process = PopenInNewSession(
+            spawn_method=self.spawn_method, **popen_kwargs)
 
         process_thread = threading.Thread(target=process.communicate)
         process_thread.start()
@@ -131,9 +339,505 @@ class CommandRunner(object):
 
         if process_thread.is_alive():
           self._KillProcess(process=process)
+          lib_stats.GetCollectorStatistics().RecordCommand(
+              command, seconds=time.time() - start_timestamp, timed_out=True)
           raise Timeout()
 
         output_file.seek(0)
         output = output_file.read()
+        lib_stats.GetCollectorStatistics().RecordCommand(
+            command, seconds=time.time() - start_timestamp,
+            output_bytes=len(output))
 
         return CommandRunner.Result(exit_code=process.returncode, output=output)
+
+  def RunStreaming(self, command, timeout=None, capture_output=STDOUT_STDERR):
+    """Run a command locally, yielding its output line by line as it's read.
+
+    Output is parsed while the command is still running and never held in
+    memory as a whole. If the caller stops iterating early, the command is
+    killed.
+
+    Args:
+      command: The command to run (string).
+      timeout: Maximum time the command is allowed to take (float, seconds).
+      capture_output: What output to capture, see Run().
+
+    Yields:
+      Lines of output, including their line endings (string).
+
+    Raises:
+      Timeout: If process takes longer than 'timeout' to run.
+      ValueError: If invalid value specified for capture_output.
+    """
+    if timeout is None:
+      timeout = DEFAULT_COMMAND_TIMEOUT
+
+    popen_kwargs = {
+        'args': shlex.split(command),
+        'close_fds': True,
+    }
+    with open(os.devnull, 'r+') as dev_null:
+      popen_kwargs['stdin'] = dev_null
+      if capture_output == STDOUT:
+        popen_kwargs['stdout'] = subprocess.PIPE
+        popen_kwargs['stderr'] = dev_null
+      elif capture_output == STDERR:
+        popen_kwargs['stdout'] = dev_null
+        popen_kwargs['stderr'] = subprocess.PIPE
+      elif capture_output == STDOUT_STDERR:
+        popen_kwargs['stdout'] = subprocess.PIPE
+        popen_kwargs['stderr'] = subprocess.STDOUT
+      else:
+        raise ValueError('Unsupported capture_output: %r' % capture_output)
+
+      logging.debug('Running: %s', command)
+      start_timestamp = time.time()
+      process = PopenInNewSession(
+          spawn_method=self.spawn_method, **popen_kwargs)
+    pipe = process.stdout or process.stderr
+
+    # Reading blocks, so the timeout is enforced from a timer thread.
+    timed_out = threading.Event()
+
+    def KillOnTimeout():
+      timed_out.set()
+      self._KillProcess(process=process)
+
+    timer = threading.Timer(timeout, KillOnTimeout)
+    timer.daemon = True
+    timer.start()
+    output_bytes = 0
+    try:
+      for line in iter(pipe.readline, ''):
+        output_bytes += len(line)
+        yield line
+      process.wait()
+    finally:
+      timer.cancel()
+      # Wait for a timed out command to be killed, like Run() does.
+      timer.join()
+      pipe.close()
+      if process.poll() is None:
+        # The caller has stopped reading before the command has exited.
+        self._KillProcess(process=process, kill_timeout=0)
+        process.wait()
+      lib_stats.GetCollectorStatistics().RecordCommand(
+          command, seconds=time.time() - start_timestamp,
+          output_bytes=output_bytes, timed_out=timed_out.is_set())
+    if timed_out.is_set():
+      raise Timeout()
+
+
+class AsyncCommandRunner(CommandRunner):
+  """Run many commands at once from a single thread via an event loop.
+
+  Output is read from pipes straight into memory and timeouts are enforced
+  with a heap of deadlines, so no threads or temporary files are needed. Timed
+  out commands are sent SIGTERM and, if still running after kill_timeout,
+  SIGKILL, while other commands keep being serviced.
+
+  Commands are started with Start() and waited for with Wait(). Run() provides
+  the same interface as CommandRunner.Run(). An instance must only be used by
+  one thread at a time.
+  """
+
+  class PendingCommand(object):
+    """A command started by AsyncCommandRunner.
+
+    Attributes:
+      command: The command being run (string).
+      process: The child process (subprocess.Popen).
+      timed_out: Whether the command has exceeded its timeout (bool).
+      result: Result of the command once completed (CommandRunner.Result).
+      start_timestamp: Time the command has been started at (float).
+      tile_name: Name of the tile which started the command (str).
+    """
+
+    def __init__(self, command, process, output_fds):
+      self.command = command
+      self.process = process
+      self.start_timestamp = time.time()
+      self.tile_name = lib_stats.GetCurrentTileName()
+      self.timed_out = False
+      self.result = None
+      # File descriptors of pipes being read and the chunks read from them.
+      self.output_fds = output_fds
+      self.output_chunks = []
+
+    def IsCompleted(self):
+      """Check if the command has exited and all its output has been read."""
+      return self.process.returncode is not None and not self.output_fds
+
+    def GetResult(self):
+      """Get the result of a completed command.
+
+      Returns:
+        Result of the command executed (CommandRunner.Result).
+
+      Raises:
+        Timeout: If the command took longer than its timeout to run.
+        Error: If the command hasn't completed yet.
+      """
+      if not self.IsCompleted():
+        raise Error('Command is still running: %s' % self.command)
+      if self.timed_out:
+        raise Timeout()
+      return self.result
+
+  def __init__(self, kill_timeout=DEFAULT_KILL_TIMEOUT, spawn_method=None):
+    """Constructs an AsyncCommandRunner object.
+
+    Args:
+      kill_timeout: Seconds to wait after SIGTERM before sending SIGKILL to
+          timed out commands (float).
+      spawn_method: Method of starting commands, one of SPAWN_* or None to use
+          the fastest available (str).
+    """
+    super(AsyncCommandRunner, self).__init__(spawn_method=spawn_method)
+    self.kill_timeout = kill_timeout
+    self._pending_commands = []
+    # Heap of (deadline, sequence number, pending command, signal number)
+    # entries, ordered by deadline. The sequence number breaks ties.
+    self._deadlines = []
+    self._deadline_sequence = 0
+
+  def _AddDeadline(self, deadline, pending_command, signal_number):
+    """Schedule a signal to be sent to a command unless it completes first."""
+    self._deadline_sequence += 1
+    heapq.heappush(
+        self._deadlines,
+        (deadline, self._deadline_sequence, pending_command, signal_number))
+
+  def _SignalProcess(self, pending_command, signal_number):
+    """Send a signal to the process group of a command."""
+    logging.debug('Sending signal %d to PID %d.',
+                  signal_number, pending_command.process.pid)
+    try:
+      os.killpg(pending_command.process.pid, signal_number)
+    except OSError as error:
+      if error.errno == errno.ESRCH:
+        logging.debug('Process terminated before we tried to kill it.')
+      else:
+        raise  # Unexpected error while killing process.
+
+  def Start(
+      self, command, timeout=None, capture_output=STDOUT_STDERR, stdin=None,
+      stdout=None, stderr=None):
+    """Start a command without waiting for it to complete.
+
+    Args:
+      command: The command to run (string).
+      timeout: Maximum time the command is allowed to take (float, seconds).
+      capture_output: What output to capture. Must be one of:
+          - STDOUT: Return standard output
+          - STDERR: Return standard error
+          - STDOUT_STDERR: Redirect stderr to stdout and return stdout
+      stdin: Opened file descriptor. If supplied, capture_output is ignored.
+      stdout: Opened file descriptor. If supplied, capture_output is ignored.
+      stderr: Opened file descriptor. If supplied, capture_output is ignored.
+
+    Returns:
+      The started command (AsyncCommandRunner.PendingCommand).
+
+    Raises:
+      ValueError: If invalid value specified for capture_output.
+    """
+    if timeout is None:
+      timeout = DEFAULT_COMMAND_TIMEOUT
+
+    popen_kwargs = {
+        'args': shlex.split(command),
+        # Other commands in flight must not inherit the write end of our
+        # pipes, or reading their output wouldn't end until they all exit.
+        'close_fds': True,
+    }
+    with open(os.devnull, 'r+') as dev_null:
+      if stdin or stdout or stderr:
+        popen_kwargs['stdin'] = stdin
+        popen_kwargs['stdout'] = stdout
+        popen_kwargs['stderr'] = stderr
+      else:
+        popen_kwargs['stdin'] = dev_null
+        if capture_output == STDOUT:
+          popen_kwargs['stdout'] = subprocess.PIPE
+          popen_kwargs['stderr'] = dev_null
+        elif capture_output == STDERR:
+          popen_kwargs['stdout'] = dev_null
+          popen_kwargs['stderr'] = subprocess.PIPE
+        elif capture_output == STDOUT_STDERR:
+          popen_kwargs['stdout'] = subprocess.PIPE
+          popen_kwargs['stderr'] = subprocess.STDOUT
+        else:
+          raise ValueError('Unsupported capture_output: %r' % capture_output)
+
+      logging.debug('Starting: %s', command)
+      # Start a new session, so that the command and all its children can be
+      # signalled on timeout.
+      process = PopenInNewSession(
+          spawn_method=self.spawn_method, **popen_kwargs)
+
+    output_fds = [
+        pipe.fileno() for pipe in [process.stdout, process.stderr] if pipe]
+    pending_command = AsyncCommandRunner.PendingCommand(
+        command=command, process=process, output_fds=output_fds)
+    self._pending_commands.append(pending_command)
+    self._AddDeadline(time.time() + timeout, pending_command, signal.SIGTERM)
+    return pending_command
+
+  def _ProcessEvents(self, timeout):
+    """Read available output, reap exited processes and enforce deadlines.
+
+    Args:
+      timeout: Maximum time to wait for output (float, seconds).
+    """
+    poller = select.poll()
+    fd_commands = {}
+    for pending_command in self._pending_commands:
+      for fd in pending_command.output_fds:
+        poller.register(fd, select.POLLIN)
+        fd_commands[fd] = pending_command
+
+    try:
+      events = poller.poll(max(0, timeout) * 1000)
+    except select.error as error:
+      if error.args[0] != errno.EINTR:
+        raise
+      events = []
+
+    for fd, _ in events:
+      pending_command = fd_commands[fd]
+      chunk = os.read(fd, 65536)
+      if chunk:
+        pending_command.output_chunks.append(chunk)
+      else:
+        pending_command.output_fds.remove(fd)
+
+    for pending_command in list(self._pending_commands):
+      if pending_command.output_fds:
+        continue
+      if pending_command.process.poll() is None:
+        continue
+      self._pending_commands.remove(pending_command)
+      self._ClosePipes(pending_command)
+      pending_command.result = CommandRunner.Result(
+          exit_code=pending_command.process.returncode,
+          output=''.join(pending_command.output_chunks))
+      lib_stats.GetCollectorStatistics().RecordCommand(
+          pending_command.command,
+          seconds=time.time() - pending_command.start_timestamp,
+          output_bytes=len(pending_command.result.output),
+          timed_out=pending_command.timed_out,
+          tile_name=pending_command.tile_name)
+      logging.debug('Completed with exit code %d: %s',
+                    pending_command.process.returncode,
+                    pending_command.command)
+
+    while self._deadlines and self._deadlines[0][0] <= time.time():
+      _, _, pending_command, signal_number = heapq.heappop(self._deadlines)
+      if pending_command.IsCompleted():
+        continue
+      if signal_number == signal.SIGTERM:
+        logging.warning('Command timed out: %s', pending_command.command)
+        pending_command.timed_out = True
+        self._AddDeadline(
+            time.time() + self.kill_timeout, pending_command, signal.SIGKILL)
+      self._SignalProcess(pending_command, signal_number)
+      if signal_number == signal.SIGKILL:
+        # Children which left the session may still hold the pipes open. The
+        # output of a timed out command isn't used, so stop reading it.
+        self._ClosePipes(pending_command)
+
+  @staticmethod
+  def _ClosePipes(pending_command):
+    """Stop reading output of a command and close its pipes."""
+    pending_command.output_fds = []
+    for pipe in [pending_command.process.stdout,
+                 pending_command.process.stderr]:
+      if pipe:
+        pipe.close()
+
+  def _GetSecondsUntilNextEvent(self):
+    """Get the number of seconds _ProcessEvents() may wait for output."""
+    timeouts = []
+    # Discard deadlines of commands which have already completed.
+    while self._deadlines and self._deadlines[0][2].IsCompleted():
+      heapq.heappop(self._deadlines)
+    if self._deadlines:
+      timeouts.append(self._deadlines[0][0] - time.time())
+    # Processes can only be reaped by polling once their output is closed.
+    for pending_command in self._pending_commands:
+      if not pending_command.output_fds:
+        timeouts.append(_REAP_INTERVAL)
+        break
+    # Without a deadline, wait for output but still reap processes now and
+    # then rather than polling in a busy loop.
+    return min(timeouts) if timeouts else _REAP_INTERVAL
+
+  def Wait(self, pending_commands=None):
+    """Wait for commands to complete.
+
+    Timed out commands complete once their process has been killed.
+
+    Args:
+      pending_commands: List of commands to wait for or None to wait for all
+          commands started by this runner (AsyncCommandRunner.PendingCommand).
+    """
+    if pending_commands is None:
+      pending_commands = list(self._pending_commands)
+    while not all(pending_command.IsCompleted()
+                  for pending_command in pending_commands):
+      self._ProcessEvents(timeout=self._GetSecondsUntilNextEvent())
+
+  def Run(
+      self, command, timeout=None, capture_output=STDOUT_STDERR, stdin=None,
+      stdout=None, stderr=None):
+    """Run a command locally and wait for it to complete.
+
+    Args:
+      command: The command to run (string).
+      timeout: Maximum time the command is allowed to take (float, seconds).
+      capture_output: What output to capture. Must be one of:
+          - STDOUT: Return standard output
+          - STDERR: Return standard error
+          - STDOUT_STDERR: Redirect stderr to stdout and return stdout
+      stdin: Opened file descriptor. If supplied, capture_output is ignored.
+      stdout: Opened file descriptor. If supplied, capture_output is ignored.
+      stderr: Opened file descriptor. If supplied, capture_output is ignored.
+
+    Returns:
+      Result of the command executed (CommandRunner.Result).
+
+    Raises:
+      Timeout: If process takes longer than 'timeout' to run.
+      ValueError: If invalid value specified for capture_output.
+    """
+    pending_command = self.Start(
+        command, timeout=timeout, capture_output=capture_output, stdin=stdin,
+        stdout=stdout, stderr=stderr)
+    self.Wait([pending_command])
+    return pending_command.GetResult()
+
+
+class FakeCommandRunner(CommandRunner):
+  """Answer commands with predefined output instead of running them.
+
+  Commands are matched against a list of responses, the first matching one
+  is used. Responses may also run the command for real, i.e. to read files
+  from a fake root directory. It implements the interfaces of both
+  CommandRunner and AsyncCommandRunner.
+
+  Attributes:
+    commands: Commands run so far (list of str).
+  """
+
+  class Response(object):
+    """A response to commands matching a pattern.
+
+    Attributes:
+      pattern: Regular expression the whole command has to match (str).
+      output: Output of the command, or a function returning it, which is
+          passed the match object of the pattern (str or callable).
+      exit_code: Exit code of the command (int).
+      timeout: Whether the command times out instead (bool).
+      passthrough: Whether to run the command for real instead (bool).
+    """
+
+    def __init__(self, pattern, output='', exit_code=0, timeout=False,
+                 passthrough=False):
+      self.pattern = re.compile(pattern + r'\Z')
+      self.output = output
+      self.exit_code = exit_code
+      self.timeout = timeout
+      self.passthrough = passthrough
+
+  class CompletedCommand(object):
+    """A command run by FakeCommandRunner.Start()."""
+
+    def __init__(self, command, result=None, timed_out=False):
+      self.command = command
+      self.result = result
+      self.timed_out = timed_out
+
+    def IsCompleted(self):
+      return True
+
+    def GetResult(self):
+      if self.timed_out:
+        raise Timeout()
+      return self.result
+
+  def __init__(self, responses=None):
+    """Constructs a FakeCommandRunner object.
+
+    Args:
+      responses: List of FakeCommandRunner.Response instances.
+    """
+    super(FakeCommandRunner, self).__init__()
+    self.responses = list(responses or [])
+    self.commands = []
+    self._passthrough_runner = CommandRunner()
+
+  def AddResponse(self, pattern, output='', exit_code=0, timeout=False,
+                  passthrough=False):
+    """Add a response, used if no previously added response matches."""
+    self.responses.append(FakeCommandRunner.Response(
+        pattern, output=output, exit_code=exit_code, timeout=timeout,
+        passthrough=passthrough))
+
+  def Run(
+      self, command, timeout=None, capture_output=STDOUT_STDERR, stdin=None,
+      stdout=None, stderr=None):
+    """Replay the response to a command.
+
+    Args:
+      command: The command to run (string).
+      timeout: Maximum time the command is allowed to take (float, seconds).
+      capture_output: What output to capture, see CommandRunner.Run().
+      stdin: Ignored unless the command is run for real.
+      stdout: Ignored unless the command is run for real.
+      stderr: Ignored unless the command is run for real.
+
+    Returns:
+      Result of the command (CommandRunner.Result). Commands without a
+      matching response exit with code 127 and no output.
+
+    Raises:
+      Timeout: If the response to the command is a timeout.
+    """
+    self.commands.append(command)
+    for response in self.responses:
+      match = response.pattern.match(command)
+      if not match:
+        continue
+      if response.timeout:
+        raise Timeout()
+      if response.passthrough:
+        return self._passthrough_runner.Run(
+            command, timeout=timeout, capture_output=capture_output,
+            stdin=stdin, stdout=stdout, stderr=stderr)
+      output = response.output
+      if callable(output):
+        output = output(match)
+      return CommandRunner.Result(exit_code=response.exit_code, output=output)
+
+    logging.warning('No response to command: %s', command)
+    return CommandRunner.Result(exit_code=127, output='')
+
+  def RunStreaming(self, command, timeout=None, capture_output=STDOUT_STDERR):
+    """Replay the response to a command line by line, see Run()."""
+    result = self.Run(
+        command, timeout=timeout, capture_output=capture_output)
+    return iter(result.output.splitlines(True))
+
+  def Start(self, command, **kwargs):
+    """Replay the response to a command, see AsyncCommandRunner.Start()."""
+    try:
+      return FakeCommandRunner.CompletedCommand(
+          command, result=self.Run(command, **kwargs))
+    except Timeout:
+      return FakeCommandRunner.CompletedCommand(command, timed_out=True)
+
+  def Wait(self, pending_commands=None):
+    """All commands are completed by Start(), there's nothing to wait for."""
+    pass
@@ -8,8 +8,12 @@ import os
 import re
 import shutil
 import sys
+import tempfile
+import threading
+import time
 
 from google3.net.bandaid.xt_tools.csdt import lib_commands
+from google3.net.bandaid.xt_tools.csdt import lib_netlink
 
 CSDT_EXIT_NORMAL = 0
 CSDT_EXIT_EXCEPTION = 1
@@ -17,10 +21,23 @@ CSDT_EXIT_ALREADY_RUNNING = 2
 CSDT_EXIT_PIDFILE_OPEN_ERROR = 3
 CSDT_EXIT_INITTAB_NOT_FIXED = 4
 CSDT_PIDFILE_PATH = '/var/run/csdt.pid'
+CSDT_EXPORT_PIDFILE_PATH = '/var/run/csdt_export.pid'
+CSDT_DAEMON_PIDFILE_PATH = '/var/run/csdt_daemon.pid'
 
 RE_IPV4_ADDRESS = r'([0-9]{1,3}\.){3}[0-9]{1,3}'
 RE_IPV6_ADDRESS = r'[0-9a-fA-F:]{3,}'
 
+# Locations of host details, which may point to a fake root for testing.
+DMI_ID_PATH = '/sys/class/dmi/id'
+PROC_UPTIME_PATH = '/proc/uptime'
+
+# Number of seconds host details collected by HostSnapshot remain valid.
+HOST_SNAPSHOT_TTL = 30
+
+# Number of seconds a technician is considered to be at the console after the
+# last key press.
+USER_ACTIVITY_TIMEOUT = 600
+
 
 class Error(Exception):
   pass
@@ -38,14 +55,18 @@ def ExitCsdt(exit_code, message=None):
   sys.exit(exit_code)
 
 
-def GetPid():
+def GetPid(pidfile_path=None):
   """Get PID of the currently running CSDT instance.
 
+  Args:
+    pidfile_path: Path to the PID file (str).
+
   Returns:
     Process ID number (int) if CSDT is running or None otherwise.
   """
+  pidfile_path = pidfile_path if pidfile_path else CSDT_PIDFILE_PATH
   try:
-    with open(CSDT_PIDFILE_PATH, 'r') as fd:
+    with open(pidfile_path, 'r') as fd:
       try:
         # Attempt to obtain an exclusive, non-blocking lock.
         fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
@@ -122,6 +143,27 @@ def SetInputOutputDevice(tty_device):
         logging.warning('Failed to run `setterm` to disable console blanking.')
 
 
+def WriteFileAtomically(path, content, mode=0o644):
+  """Write a file, so that readers only ever see its old or new content.
+
+  Args:
+    path: Path of the file to write (str).
+    content: Content of the file (str).
+    mode: Permissions of the file (int).
+  """
+  file_descriptor, temporary_path = tempfile.mkstemp(
+      dir=os.path.dirname(os.path.abspath(path)),
+      prefix='.%s.' % os.path.basename(path))
+  try:
+    with os.fdopen(file_descriptor, 'w') as file_handle:
+      file_handle.write(content)
+    os.chmod(temporary_path, mode)
+    os.rename(temporary_path, path)
+  except (IOError, OSError):
+    os.unlink(temporary_path)
+    raise
+
+
 def InstallCsdt(csdt_args):
   """Install CSDT in /etc/inittab and ensure the current version is running.
 
@@ -151,6 +193,31 @@ def InstallCsdt(csdt_args):
   if csdt_args.handle_keys:
     csdt_command_args.append('--handle_keys')
 
+  if csdt_args.stats:
+    csdt_command_args.append('--stats %s' % csdt_args.stats)
+
+  if csdt_args.export:
+    csdt_command_args.append('--export')
+
+  if csdt_args.export_textfile:
+    csdt_command_args.append('--export_textfile %s' % csdt_args.export_textfile)
+
+  if csdt_args.export_json:
+    csdt_command_args.append('--export_json %s' % csdt_args.export_json)
+
+  # Options shared by the console and the daemon it receives tile content
+  # from, which is started by its own inittab entry below.
+  daemon_command_args = [
+      arg for arg in csdt_command_args
+      if not arg.startswith(('--tty', '--allow_exit', '--handle_keys',
+                             '--stats'))]
+  daemon_command_args.append('--daemon')
+  daemon_command_args.append('--socket_path %s' % csdt_args.socket_path)
+
+  if csdt_args.renderer:
+    csdt_command_args.append('--renderer')
+    csdt_command_args.append('--socket_path %s' % csdt_args.socket_path)
+
   csdt_command_line = ' '.join(csdt_command_args)
 
   # Inittab entry identifier. Has to be unique within the inittab file.
@@ -171,6 +238,16 @@ def InstallCsdt(csdt_args):
         expected_line=inittab_entry,
         search_pattern=r'^csdt:.*$')
 
+  if csdt_args.renderer:
+    daemon_inittab_entry = ':'.join(
+        ['csdd', '2345', 'respawn', ' '.join(daemon_command_args)])
+    print('Ensuring CSDT daemon is present in /etc/inittab.')
+    with open(csdt_args.inittab_path, 'r+') as file_handle:
+      _EnsureLineExistsInFile(
+          file_handle=file_handle,
+          expected_line=daemon_inittab_entry,
+          search_pattern=r'^csdd:.*$')
+
   # Only restart CSDT if we're modifying the real inittab.
   if csdt_args.inittab_path == '/etc/inittab':
     print('Re-reading /etc/inittab.')
@@ -267,6 +344,13 @@ def _EnsureCurrentCsdtVersionIsRunning(command_runner):
       os.kill(pid, 1)
     except OSError:
       pass
+  # Renderers reconnect to the respawned daemon on their own.
+  daemon_pid = GetPid(pidfile_path=CSDT_DAEMON_PIDFILE_PATH)
+  if daemon_pid:
+    try:
+      os.kill(daemon_pid, 1)
+    except OSError:
+      pass
 
 
 def GetHostname(command_runner):
@@ -282,7 +366,7 @@ def GetUptime():
   Returns:
     Uptime as a human-friendly string (eg: 35 days, 2:11 hours).
   """
-  with open('/proc/uptime', 'r') as f:
+  with open(PROC_UPTIME_PATH, 'r') as f:
     uptime_seconds = int(float(f.read().split()[0]))
 
     days = uptime_seconds / 86400
@@ -300,7 +384,8 @@ def GetServiceTag():
   """Get service tag of a machine."""
   service_tag = ''
   try:
-    with open('/sys/class/dmi/id/product_serial', 'r') as file_handle:
+    with open(os.path.join(DMI_ID_PATH, 'product_serial'),
+              'r') as file_handle:
       service_tag = file_handle.read().strip()
   except IOError:
     logging.error('Unable to read the service tag.')
@@ -342,7 +427,7 @@ def GetHardwareModel():
   }
   product_name = ''
   try:
-    with open('/sys/class/dmi/id/product_name', 'r') as file_handle:
+    with open(os.path.join(DMI_ID_PATH, 'product_name'), 'r') as file_handle:
       product_name = file_handle.read().strip()
   except IOError:
     logging.error('Unable to read the product name.')
@@ -410,3 +495,127 @@ def GetNetworkConfiguration(command_runner, ip_version=4):
       )
   logging.warning('Unable to parse iproute output:\n%s', result.output)
   return None
+
+
+class HostSnapshot(object):
+  """Host details shared by all tiles and collected at most once per TTL.
+
+  Attributes:
+    hostname: Short hostname of the machine (str).
+    service_tag: Service tag of the machine (str).
+    hardware_model: Hardware model of the machine (str).
+    ipv4_configuration: Result of GetNetworkConfiguration() for IPv4 (tuple or
+        None).
+    ipv6_configuration: Result of GetNetworkConfiguration() for IPv6 (tuple or
+        None).
+    collector_calls: Number of collector calls made to populate the snapshot
+        (int).
+    collector_calls_saved: Number of collector calls avoided by serving the
+        cached snapshot instead (int).
+  """
+
+  # Collectors run on every refresh: hostname, service tag, hardware model and
+  # IPv4 and IPv6 network configuration.
+  _COLLECTORS_PER_REFRESH = 5
+
+  def __init__(self, command_runner=None, ttl=HOST_SNAPSHOT_TTL,
+               use_netlink=True):
+    """Constructs a HostSnapshot object.
+
+    Args:
+      command_runner: Instance of lib_commands.CommandRunner().
+      ttl: Number of seconds collected details remain valid (int).
+      use_netlink: Whether to read network configuration over rtnetlink
+          instead of running `ip route get` (bool).
+    """
+    self.runner = command_runner or lib_commands.CommandRunner()
+    self.ttl = ttl
+    self.use_netlink = use_netlink
+    self.refresh_timestamp = 0
+
+    self.hostname = None
+    self.service_tag = None
+    self.hardware_model = None
+    self.ipv4_configuration = None
+    self.ipv6_configuration = None
+
+    self.collector_calls = 0
+    self.collector_calls_saved = 0
+
+    # Tiles may be refreshed concurrently; only one of them collects the data.
+    self._lock = threading.Lock()
+
+  def IsExpired(self):
+    """Check if the snapshot has to be collected again."""
+    return time.time() - self.refresh_timestamp >= self.ttl
+
+  def Invalidate(self):
+    """Force the snapshot to be collected again on the next Refresh()."""
+    with self._lock:
+      self.refresh_timestamp = 0
+
+  def _GetNetworkConfiguration(self, ip_version):
+    """Get the network configuration, see GetNetworkConfiguration()."""
+    if self.use_netlink:
+      try:
+        return lib_netlink.GetRtnetlinkClient().GetNetworkConfiguration(
+            ip_version=ip_version)
+      except lib_netlink.Error as e:
+        logging.warning('Falling back to iproute: %s', e)
+        self.use_netlink = False
+    return GetNetworkConfiguration(
+        command_runner=self.runner, ip_version=ip_version)
+
+  def Refresh(self):
+    """Collect host details unless the current snapshot is still valid."""
+    with self._lock:
+      if not self.IsExpired():
+        self.collector_calls_saved += self._COLLECTORS_PER_REFRESH
+        logging.debug(
+            'Using cached host snapshot, %d collector calls saved so far.',
+            self.collector_calls_saved)
+        return
+
+      logging.debug('Collecting host snapshot.')
+      self.hostname = GetHostname(command_runner=self.runner)
+      self.service_tag = GetServiceTag()
+      self.hardware_model = GetHardwareModel()
+      self.ipv4_configuration = self._GetNetworkConfiguration(ip_version=4)
+      self.ipv6_configuration = self._GetNetworkConfiguration(ip_version=6)
+      self.collector_calls += self._COLLECTORS_PER_REFRESH
+      self.refresh_timestamp = time.time()
+
+
+_host_snapshot = None
+_host_snapshot_lock = threading.Lock()
+
+
+def GetHostSnapshot():
+  """Get the HostSnapshot instance shared by all tiles."""
+  global _host_snapshot
+  with _host_snapshot_lock:
+    if _host_snapshot is None:
+      _host_snapshot = HostSnapshot()
+    return _host_snapshot
+
+
+def SetHostSnapshot(host_snapshot):
+  """Replace the HostSnapshot instance shared by all tiles, i.e. in tests."""
+  global _host_snapshot
+  with _host_snapshot_lock:
+    _host_snapshot = host_snapshot
+
+
+# Time of the last key press of a technician at the console.
+_user_activity_timestamp = 0
+
+
+def RecordUserActivity():
+  """Record a key press of a technician at the console."""
+  global _user_activity_timestamp
+  _user_activity_timestamp = time.time()
+
+
+def IsUserActive():
+  """Check if a technician has pressed a key recently."""
+  return time.time() - _user_activity_timestamp < USER_ACTIVITY_TIMEOUT
@@ -0,0 +1,446 @@
+"""Console Status Display Tool collection daemon and renderer library.
+
+A single daemon refreshes all tiles and publishes their content over a Unix
+socket. Consoles run as renderers, which only draw content received from the
+daemon, so hardware tools are run once however many consoles are attached and
+a restarted console shows the latest content immediately.
+
+Messages are JSON objects, one per line:
+  {"type": "subscribe", "tile": <name>}
+      Sent by renderers for every tile they show. The daemon replies with the
+      latest content of the tile, if it has been refreshed already.
+  {"type": "refresh", "tile": <name>}
+      Sent by renderers when a tile is due to be refreshed or a refresh has
+      been forced. The daemon refreshes the tile if it's due, or if it was
+      refreshed long enough ago while a technician is active, and replies
+      with its latest content otherwise.
+  {"type": "activity"}
+      Sent by renderers whenever a key is pressed, so that the daemon knows
+      a technician is at a console, see lib_common.IsUserActive().
+  {"type": "content", "tile": <name>, "content": <str>, "duration": <float>}
+      Sent by the daemon to all renderers whenever a tile has been refreshed.
+"""
+
+import errno
+import json
+import logging
+import os
+import select
+import socket
+import threading
+import time
+
+from google3.net.bandaid.xt_tools.csdt import lib_common
+from google3.net.bandaid.xt_tools.csdt import lib_export
+from google3.net.bandaid.xt_tools.csdt import lib_refresh
+from google3.net.bandaid.xt_tools.csdt import lib_sensors
+from google3.net.bandaid.xt_tools.csdt import lib_tools
+
+DEFAULT_SOCKET_PATH = '/var/run/csdt.sock'
+
+# Number of seconds between attempts to connect to the daemon.
+_RECONNECT_INTERVAL = 5
+
+# Maximum number of bytes of messages buffered for a single peer. Renderers
+# which don't keep up, i.e. because their console is stopped, are
+# disconnected once they fall this far behind.
+_MAX_BUFFERED_BYTES = 1024 * 1024
+
+
+class Error(Exception):
+  pass
+
+
+def _EncodeMessage(message):
+  """Encode a message to be sent over the socket (str)."""
+  return json.dumps(message) + '\n'
+
+
+def _DecodeMessage(line):
+  """Decode a message received over the socket.
+
+  Args:
+    line: Encoded message without the trailing newline (str).
+
+  Raises:
+    Error: If the message is malformed.
+
+  Returns:
+    Dictionary with str values where the JSON message had strings.
+  """
+  try:
+    message = json.loads(line)
+  except ValueError as error:
+    raise Error('Malformed message: %s' % error)
+  if not isinstance(message, dict) or 'type' not in message:
+    raise Error('Malformed message: %r' % line)
+  # Curses and the compiled string cache expect byte strings.
+  return dict(
+      (str(key), value.encode('utf-8') if isinstance(value, unicode) else value)
+      for key, value in message.iteritems())
+
+
+class Daemon(lib_export.Exporter):
+  """Refresh tiles on their schedule and publish their content to renderers.
+
+  Tile data may also be exported to files at the same time, see
+  lib_export.Exporter.
+  """
+
+  class _Client(object):
+    """A renderer connected to the daemon."""
+
+    def __init__(self, client_socket):
+      self.socket = client_socket
+      self.read_buffer = ''
+      self.write_buffer = ''
+
+    def fileno(self):
+      return self.socket.fileno()
+
+  def __init__(self, tiles, socket_path=DEFAULT_SOCKET_PATH,
+               forced_refresh_min_interval=30, **exporter_kwargs):
+    """Constructs a Daemon object.
+
+    Args:
+      tiles: Tiles to refresh and publish (list of tile.InformationTile).
+      socket_path: Path of the Unix socket to listen on (str).
+      forced_refresh_min_interval: Minimum number of seconds between refreshes
+          of a tile requested by renderers before it's due (int).
+      **exporter_kwargs: Keyword arguments passed to lib_export.Exporter.
+    """
+    super(Daemon, self).__init__(tiles, **exporter_kwargs)
+    self.socket_path = socket_path
+    self.forced_refresh_min_interval = forced_refresh_min_interval
+    # Messages with the latest content of each refreshed tile, keyed by name.
+    self.content_messages = {}
+    self._clients = []
+    self._listening_socket = self._Listen()
+
+  def _Listen(self):
+    """Create the socket renderers connect to, replacing any stale one."""
+    try:
+      os.unlink(self.socket_path)
+    except OSError as error:
+      if error.errno != errno.ENOENT:
+        raise
+    listening_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listening_socket.bind(self.socket_path)
+    os.chmod(self.socket_path, 0o600)
+    listening_socket.listen(8)
+    listening_socket.setblocking(0)
+    logging.info('Publishing tile content on %s.', self.socket_path)
+    return listening_socket
+
+  def _GetTile(self, tile_name):
+    """Get a tile by its name, or None if there's no such tile."""
+    for information_tile in self.tiles:
+      if information_tile.GetTileName() == tile_name:
+        return information_tile
+    return None
+
+  def _Accept(self):
+    """Accept a connection from a renderer."""
+    try:
+      client_socket, _ = self._listening_socket.accept()
+    except socket.error as error:
+      if error.args[0] in [errno.EAGAIN, errno.EINTR]:
+        return
+      raise
+    client_socket.setblocking(0)
+    self._clients.append(Daemon._Client(client_socket))
+    logging.info('Renderer connected, %d renderers connected.',
+                 len(self._clients))
+
+  def _Disconnect(self, client, reason):
+    """Close the connection to a renderer."""
+    if client not in self._clients:
+      return
+    self._clients.remove(client)
+    client.socket.close()
+    logging.info('Renderer disconnected (%s), %d renderers connected.',
+                 reason, len(self._clients))
+
+  def _Flush(self, client):
+    """Send as much of the buffered messages to a renderer as possible."""
+    while client.write_buffer:
+      try:
+        sent_bytes = client.socket.send(client.write_buffer)
+      except socket.error as error:
+        if error.args[0] in [errno.EAGAIN, errno.EINTR]:
+          return
+        self._Disconnect(client, reason=str(error))
+        return
+      client.write_buffer = client.write_buffer[sent_bytes:]
+
+  def _Send(self, client, message):
+    """Queue a message to be sent to a renderer."""
+    client.write_buffer += _EncodeMessage(message)
+    if len(client.write_buffer) > _MAX_BUFFERED_BYTES:
+      self._Disconnect(client, reason='not keeping up')
+      return
+    self._Flush(client)
+
+  def _Receive(self, client):
+    """Read and handle messages sent by a renderer."""
+    try:
+      data = client.socket.recv(65536)
+    except socket.error as error:
+      if error.args[0] in [errno.EAGAIN, errno.EINTR]:
+        return
+      self._Disconnect(client, reason=str(error))
+      return
+    if not data:
+      self._Disconnect(client, reason='closed by renderer')
+      return
+    client.read_buffer += data
+    if len(client.read_buffer) > _MAX_BUFFERED_BYTES:
+      self._Disconnect(client, reason='message too long')
+      return
+    while '\n' in client.read_buffer and client in self._clients:
+      line, client.read_buffer = client.read_buffer.split('\n', 1)
+      try:
+        self._HandleMessage(client, _DecodeMessage(line))
+      except Error as error:
+        self._Disconnect(client, reason=str(error))
+
+  def _HandleMessage(self, client, message):
+    """Handle a message sent by a renderer."""
+    if message['type'] == 'activity':
+      lib_common.RecordUserActivity()
+      return
+
+    tile_name = message.get('tile')
+    information_tile = self._GetTile(tile_name)
+    if not information_tile:
+      logging.warning('Renderer referred to an unknown tile: %r', tile_name)
+      return
+
+    if message['type'] == 'subscribe':
+      if tile_name in self.content_messages:
+        self._Send(client, self.content_messages[tile_name])
+    elif message['type'] == 'refresh':
+      self._HandleRefreshRequest(client, information_tile)
+    else:
+      logging.warning('Renderer sent an unknown message: %r', message)
+
+  def _HandleRefreshRequest(self, client, information_tile):
+    """Refresh a tile requested by a renderer, or send its latest content.
+
+    Args:
+      client: Renderer requesting the refresh (Daemon._Client).
+      information_tile: Tile to refresh (tile.InformationTile).
+    """
+    tile_name = information_tile.GetTileName()
+    # Content will be sent to all renderers once the refresh completes.
+    if self.refresh_scheduler.IsPending(information_tile):
+      return
+    # Expensive tiles will be refreshed once the initial delay is over.
+    if not (self._IsInitialDelayOver() or information_tile.IsCheapToRefresh()):
+      return
+
+    seconds_since_refresh = time.time() - information_tile.refresh_timestamp
+    if information_tile.IsRefreshRequired():
+      self.refresh_scheduler.Submit(information_tile)
+    # Renderers request refreshes on their own schedule, which mustn't defeat
+    # the daemon's backoff unless a technician is waiting for the result.
+    elif (lib_common.IsUserActive() and
+          seconds_since_refresh > self.forced_refresh_min_interval):
+      logging.info('Refreshing \'%s\' tile on request of a renderer.',
+                   tile_name)
+      lib_common.GetHostSnapshot().Invalidate()
+      lib_sensors.GetSensorSampler().Invalidate()
+      lib_tools.GetToolRegistry().Invalidate()
+      self.refresh_scheduler.Submit(information_tile)
+    elif tile_name in self.content_messages:
+      self._Send(client, self.content_messages[tile_name])
+
+  def _HandleCompletedRefreshes(self, completed_refreshes):
+    """Send content of refreshed tiles to all renderers and export it."""
+    for result in completed_refreshes:
+      tile_name = result.tile.GetTileName()
+      self.content_messages[tile_name] = {
+          'type': 'content',
+          'tile': tile_name,
+          'content': result.content,
+          'duration': result.duration,
+      }
+      for client in list(self._clients):
+        self._Send(client, self.content_messages[tile_name])
+    super(Daemon, self)._HandleCompletedRefreshes(completed_refreshes)
+
+  def _WaitForEvents(self, timeout):
+    """Wait for a completed refresh, renderer activity or a timeout.
+
+    Args:
+      timeout: Maximum time to wait or None to wait indefinitely (float,
+          seconds).
+    """
+    read_fds = (
+        self._GetReadFds() + [self._listening_socket] + self._clients)
+    write_fds = [client for client in self._clients if client.write_buffer]
+    try:
+      readable_fds, writable_fds, _ = select.select(
+          read_fds, write_fds, [], timeout)
+    except select.error as error:
+      # Signals which didn't terminate the daemon interrupt the wait.
+      if error.args[0] != errno.EINTR:
+        raise
+      return
+
+    self._HandleNetworkChanges(readable_fds)
+    if self._listening_socket in readable_fds:
+      self._Accept()
+    for client in writable_fds:
+      self._Flush(client)
+    for client in readable_fds:
+      if client in self._clients:
+        self._Receive(client)
+
+  def Close(self):
+    """Disconnect all renderers and remove the socket."""
+    for client in list(self._clients):
+      self._Disconnect(client, reason='daemon exiting')
+    self._listening_socket.close()
+    try:
+      os.unlink(self.socket_path)
+    except OSError:
+      pass
+
+
+class RemoteRefreshScheduler(lib_refresh.RefreshScheduler):
+  """Receive tile content from the daemon instead of refreshing tiles.
+
+  A drop-in replacement for lib_refresh.RefreshScheduler used by renderers.
+  Refreshes are requested from the daemon, which also publishes content of
+  tiles it has refreshed on its own schedule. Content of all subscribed tiles
+  is returned by GetCompletedRefreshes(), whether it has been requested or
+  not. The connection is re-established in the background whenever it's
+  lost, e.g. when the daemon is restarted.
+  """
+
+  def __init__(self, socket_path=DEFAULT_SOCKET_PATH):
+    """Constructs a RemoteRefreshScheduler object.
+
+    Args:
+      socket_path: Path of the Unix socket the daemon listens on (str).
+    """
+    super(RemoteRefreshScheduler, self).__init__(max_workers=0)
+    self.socket_path = socket_path
+    # Subscribed tiles keyed by name and the connection to the daemon, both
+    # shared with the thread receiving messages.
+    self._tiles = {}
+    self._socket = None
+    self._lock = threading.Lock()
+
+    receiver = threading.Thread(
+        target=self._RunReceiver, name='csdt-renderer-receiver')
+    receiver.daemon = True
+    receiver.start()
+
+  def _SendMessage(self, message):
+    """Send a message to the daemon, if connected."""
+    with self._lock:
+      if not self._socket:
+        return
+      try:
+        self._socket.sendall(_EncodeMessage(message))
+      except socket.error as error:
+        # The receiving thread notices the broken connection and reconnects.
+        logging.debug('Unable to send a message to the daemon: %s', error)
+
+  def _Connect(self):
+    """Connect to the daemon and subscribe to all tiles.
+
+    Returns:
+      The connected socket (socket.socket).
+    """
+    daemon_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      daemon_socket.connect(self.socket_path)
+    except socket.error:
+      daemon_socket.close()
+      raise
+    logging.info('Connected to the daemon at %s.', self.socket_path)
+    with self._lock:
+      self._socket = daemon_socket
+      tile_names = sorted(self._tiles)
+    for tile_name in tile_names:
+      self._SendMessage({'type': 'subscribe', 'tile': tile_name})
+    # Requests sent while disconnected have been lost.
+    for information_tile in self.GetPendingTiles():
+      self._SendMessage(
+          {'type': 'refresh', 'tile': information_tile.GetTileName()})
+    return daemon_socket
+
+  def _Receive(self, daemon_socket):
+    """Receive content from the daemon until the connection is closed."""
+    read_buffer = ''
+    while 1:
+      data = daemon_socket.recv(65536)
+      if not data:
+        logging.warning('Connection closed by the daemon.')
+        return
+      read_buffer += data
+      while '\n' in read_buffer:
+        line, read_buffer = read_buffer.split('\n', 1)
+        message = _DecodeMessage(line)
+        if message['type'] != 'content':
+          logging.warning('Daemon sent an unknown message: %r', message)
+          continue
+        with self._lock:
+          information_tile = self._tiles.get(message['tile'])
+        if information_tile:
+          self._results.put(
+              lib_refresh.RefreshScheduler.Result(
+                  tile=information_tile, content=message['content'],
+                  duration=message['duration']))
+          self._Notify()
+
+  def _RunReceiver(self):
+    """Receive content from the daemon, reconnecting until the process exits."""
+    while 1:
+      try:
+        daemon_socket = self._Connect()
+        try:
+          self._Receive(daemon_socket)
+        finally:
+          with self._lock:
+            self._socket = None
+          daemon_socket.close()
+      except (socket.error, Error) as error:
+        logging.warning('Unable to receive tile content from the daemon at '
+                        '%s: %s', self.socket_path, error)
+      time.sleep(_RECONNECT_INTERVAL)
+
+  def Subscribe(self, information_tile):
+    """Receive content of a tile whenever the daemon refreshes it.
+
+    Args:
+      information_tile: Tile to receive content of (tile.InformationTile).
+    """
+    tile_name = information_tile.GetTileName()
+    with self._lock:
+      self._tiles[tile_name] = information_tile
+    self._SendMessage({'type': 'subscribe', 'tile': tile_name})
+
+  def Submit(self, information_tile):
+    """Request the content of a tile to be refreshed by the daemon.
+
+    Args:
+      information_tile: Tile to refresh (tile.InformationTile).
+
+    Returns:
+      True if the refresh was requested.
+      False if the tile is already being refreshed.
+    """
+    if self.IsPending(information_tile):
+      return False
+    self._pending_tiles.append(information_tile)
+    self._SendMessage(
+        {'type': 'refresh', 'tile': information_tile.GetTileName()})
+    return True
+
+  def RecordUserActivity(self):
+    """Let the daemon know a technician is pressing keys at this console."""
+    self._SendMessage({'type': 'activity'})
@@ -0,0 +1,145 @@
+"""Console Status Display Tool disk backend selection library.
+
+Disk backends are libraries reading disk information from a family of RAID
+or SAS controllers, such as lib_megacli, lib_perccli or lib_hpssacli. Each
+backend registers itself along with PCI IDs of the controllers it supports, so
+the right backend can be picked from PCI devices present instead of trying all
+of them on every refresh.
+
+A backend is a class constructed with a command_runner keyword argument,
+whose GetDiskInformation() method returns a list of disk dictionaries (see
+lib_megacli.MegaCLI.GetDiskInformation()) and raises lib_disk_parser.Error if
+disks can't be read.
+"""
+
+import logging
+
+from google3.net.bandaid.xt_tools.csdt import lib_disk_parser
+from google3.net.bandaid.xt_tools.csdt import lib_tools
+
+# PCI vendor IDs of RAID and SAS controller manufacturers.
+PCI_VENDOR_LSI = 0x1000
+PCI_VENDOR_HP = 0x103c
+
+# Preference of backends, higher ones are tried first when several support
+# the controllers present.
+PRIORITY_DEFAULT = 0
+PRIORITY_STRUCTURED_OUTPUT = 10
+
+
+class DiskBackend(object):
+  """A registered disk backend.
+
+  Attributes:
+    name: Name of the backend shown in logs (str).
+    backend_class: Class reading disk information, see module docstring.
+    pci_ids: PCI vendor and device IDs of supported controllers (set of
+        tuples of int).
+    priority: Preference of the backend, higher ones are tried first (int).
+  """
+
+  def __init__(self, name, backend_class, pci_ids, priority):
+    self.name = name
+    self.backend_class = backend_class
+    self.pci_ids = set(pci_ids)
+    self.priority = priority
+
+
+# Registered backends, in order of preference.
+_disk_backends = []
+
+
+def RegisterDiskBackend(name, backend_class, pci_ids,
+                        priority=PRIORITY_DEFAULT):
+  """Register a disk backend.
+
+  Backends of equal priority are preferred in the order they're registered.
+
+  Args:
+    name: Name of the backend shown in logs (str).
+    backend_class: Class reading disk information, see module docstring.
+    pci_ids: PCI vendor and device IDs of supported controllers (list of
+        tuples of int).
+    priority: Preference of the backend, higher ones are tried first (int).
+  """
+  _disk_backends.append(DiskBackend(name, backend_class, pci_ids, priority))
+  _disk_backends.sort(key=lambda disk_backend: -disk_backend.priority)
+
+
+def GetDiskBackends():
+  """Get all registered disk backends, in order of preference (list)."""
+  return list(_disk_backends)
+
+
+def DetectDiskBackends():
+  """Get disk backends supporting controllers present on this machine.
+
+  Raises:
+    lib_tools.Error: If PCI devices can't be read.
+
+  Returns:
+    List of DiskBackend instances, in order of preference.
+  """
+  pci_ids = set(
+      (pci_device.vendor_id, pci_device.device_id)
+      for pci_device in lib_tools.GetToolRegistry().GetPciDevices()
+      if pci_device.class_code in [lib_tools.PCI_CLASS_RAID_CONTROLLER,
+                                   lib_tools.PCI_CLASS_SAS_CONTROLLER])
+  return [
+      disk_backend for disk_backend in _disk_backends
+      if disk_backend.pci_ids & pci_ids]
+
+
+class DiskBackendSelector(object):
+  """Read disk information with the backend which has worked last time.
+
+  Backends supporting controllers present on the machine are tried first,
+  followed by all others. Once a backend has returned disks, it's pinned and
+  no other backend is tried until it stops working.
+
+  Attributes:
+    pinned_backend: Backend which has returned disks last time, if any
+        (DiskBackend).
+  """
+
+  def __init__(self):
+    self.pinned_backend = None
+
+  def _GetBackendsToTry(self):
+    """Get backends in the order they should be tried (list)."""
+    if self.pinned_backend:
+      preferred_backends = [self.pinned_backend]
+    else:
+      try:
+        preferred_backends = DetectDiskBackends()
+      except lib_tools.Error as e:
+        logging.warning('Unable to detect disk controllers: %s', e)
+        preferred_backends = []
+    return preferred_backends + [
+        disk_backend for disk_backend in GetDiskBackends()
+        if disk_backend not in preferred_backends]
+
+  def GetDiskInformation(self, command_runner):
+    """Get disk information from the first backend returning any disks.
+
+    Args:
+      command_runner: Instance of lib_commands.CommandRunner().
+
+    Returns:
+      A list of dictionaries containing disk information, empty if no backend
+      has returned any (list).
+    """
+    for disk_backend in self._GetBackendsToTry():
+      try:
+        disks = disk_backend.backend_class(
+            command_runner=command_runner).GetDiskInformation()
+      except lib_disk_parser.Error as e:
+        logging.debug('Unable to read disks with %s: %s', disk_backend.name, e)
+        continue
+      if not disks:
+        continue
+      if disk_backend is not self.pinned_backend:
+        logging.info('Reading disks with %s.', disk_backend.name)
+        self.pinned_backend = disk_backend
+      return disks
+    return []
@@ -1,5 +1,7 @@
 """Console Status Display Tool disk parser library."""
 
+import functools
+import json
 import logging
 import re
 
@@ -14,6 +16,11 @@ class MegaCLIOutputParseError(Error):
   pass
 
 
+class PercCLIOutputParseError(Error):
+  """Error occurred while parsing PercCLI or StorCLI output."""
+  pass
+
+
 class HpssacliParseError(Error):
   """Error occurred while parsing HpssaCLI output."""
   pass
@@ -24,6 +31,177 @@ class _InvalidDiskCountOutput(MegaCLIOutputParseError):
   pass
 
 
+_SIZE_PATTERN = re.compile(
+    r'^(?P<size>[0-9]+(\.[0-9]+)?)\s+'
+    r'(?P<unit>kb|mb|gb|tb)\s+'
+    r'\[(?P<sectors>0x[0-9a-f]+) sectors\]',
+    re.IGNORECASE)
+_TEMPERATURE_PATTERN = re.compile(
+    r'(?P<temp_celsius>[0-9]+)C \([0-9]+.[0-9]+ F\)')
+
+# Physical drive states shown by PercCLI and StorCLI, and the corresponding
+# firmware states shown by MegaCLI.
+PERCCLI_DRIVE_STATES = {
+    'Onln': 'Online',
+    'Offln': 'Offline',
+    'UGood': 'Unconfigured(good)',
+    'UBad': 'Unconfigured(bad)',
+    'Rbld': 'Rebuild',
+    'Cpybck': 'Copyback',
+    'DHS': 'Hotspare',
+    'GHS': 'Hotspare',
+    'JBOD': 'JBOD',
+    'Failed': 'Failed',
+}
+# Spin states shown by PercCLI and StorCLI, and the corresponding secondary
+# firmware states shown by MegaCLI.
+PERCCLI_SPIN_STATES = {
+    'U': 'Spun Up',
+    'D': 'Spun down',
+}
+
+
+def _ParseRawSize(value, disk):
+  """Parse the raw size of a disk reported by MegaCLI, PercCLI or StorCLI.
+
+  The format is <X> GB|TB [<Y> Sectors], where Y is an hex number.
+
+  Args:
+    value: The reported raw size (str).
+    disk: Disk dictionary whose 'sectors' and 'size' keys are set if the size
+        could be parsed (dict).
+  """
+  match = _SIZE_PATTERN.match(value)
+  if match:
+    disk['sectors'] = int(match.group('sectors'), 0)
+    disk_size_gb = int(disk['sectors'] * 512 / 1000 ** 3)
+    if 0 < disk_size_gb < 1000:
+      disk['size'] = '%d GB' % disk_size_gb
+    elif disk_size_gb >= 1000:
+      disk['size'] = '%d TB' % int(disk_size_gb / 1000)
+
+
+def _ParseMegaCliInt(field, value, disk):
+  """Parses an integer value of a MegaCLI key into a disk field."""
+  disk[field] = int(value)
+
+
+def _ParseMegaCliFirmwareState(value, disk):
+  """Parses the primary and secondary firmware state of a MegaCLI disk."""
+  primary_state, _, secondary_state = value.partition(',')
+  disk['firmware_state'] = primary_state.strip()
+  disk['firmware_secondary_state'] = secondary_state.strip()
+
+
+def _ParseMegaCliInquiry(value, disk):
+  """Parses the inquiry string of a MegaCLI disk, collapsing whitespace."""
+  disk['inquiry'] = ' '.join(value.split())
+
+
+def _ParseMegaCliTemperature(value, disk):
+  """Parses the temperature of a MegaCLI disk, i.e. '30C (86.00 F)'."""
+  match = _TEMPERATURE_PATTERN.match(value)
+  if match:
+    disk['temperature'] = int(match.group('temp_celsius'))
+
+
+# Parsers of keys of MegaCLI device blocks, called with the value and the disk
+# dictionary being populated. Other keys are ignored.
+_MEGACLI_KEY_PARSERS = {
+    'Slot Number': functools.partial(_ParseMegaCliInt, 'slot'),
+    'Media Error Count': functools.partial(_ParseMegaCliInt, 'media_error'),
+    'Other Error Count': functools.partial(_ParseMegaCliInt, 'other_error'),
+    'Predictive Failure Count': functools.partial(
+        _ParseMegaCliInt, 'predictive_failure'),
+    'Firmware state': _ParseMegaCliFirmwareState,
+    'Inquiry Data': _ParseMegaCliInquiry,
+    'Raw Size': _ParseRawSize,
+    'Drive Temperature': _ParseMegaCliTemperature,
+}
+
+_MEGACLI_ADAPTER_PREFIX = 'Adapter #'
+_MEGACLI_DEVICE_KEY = 'Enclosure Device ID'
+
+
+def _ParseEnclosure(value):
+  """Parses an enclosure ID, returning None if the disk has none, i.e. 'N/A'."""
+  try:
+    return int(value)
+  except ValueError:
+    return None
+
+
+def _NewMegaCliDisk(adapter, enclosure):
+  """Gets a disk dictionary with defaults for keys missing from MegaCLI."""
+  return {
+      'adapter': adapter,
+      'enclosure': enclosure,
+      'slot': None,
+      'media_error': 0,
+      'other_error': 0,
+      'predictive_failure': 0,
+      'firmware_state': '',
+      'firmware_secondary_state': '',
+      'inquiry': '',
+      'size': '',
+      'sectors': 0,
+      'temperature': None,
+  }
+
+
+def MegaCliIterDiskList(lines):
+  """Parses MegaCLI output listing all the disk data, line by line.
+
+  Each line is looked at once and disks are yielded as soon as their device
+  block ends, so output can be parsed while MegaCLI is still writing it, see
+  lib_commands.CommandRunner.RunStreaming().
+
+  Args:
+    lines: Lines of the output from "MegaCLI -PDList -aALL" (iterable of str).
+
+  Raises:
+    MegaCLIOutputParseError: if the output doesn't list any disks.
+
+  Yields:
+    Dictionaries containing the extracted data of disks of all adapters, in
+    the order they're listed.
+  """
+  adapter = None
+  current_disk = None
+  for line in lines:
+    key, separator, value = line.partition(':')
+    key = key.strip()
+    key_parser = _MEGACLI_KEY_PARSERS.get(key)
+    if key_parser is None:
+      if key == _MEGACLI_DEVICE_KEY:
+        if current_disk is not None:
+          yield current_disk
+        current_disk = _NewMegaCliDisk(adapter, _ParseEnclosure(value))
+      elif not separator and key.startswith(_MEGACLI_ADAPTER_PREFIX):
+        if current_disk is not None:
+          yield current_disk
+          current_disk = None
+        try:
+          adapter = int(key[len(_MEGACLI_ADAPTER_PREFIX):])
+        except ValueError:
+          raise MegaCLIOutputParseError('Invalid MegaCLI adapter: %r' % key)
+      continue
+    if current_disk is None:
+      continue
+
+    value = value.strip()
+    try:
+      key_parser(value, current_disk)
+    except ValueError:
+      logging.exception(
+          'Ignoring key %r with unsupported value %r', key, value)
+
+  if current_disk is not None:
+    yield current_disk
+  elif adapter is None:
+    raise MegaCLIOutputParseError('Invalid MegaCLI Output')
+
+
 def MegaCliParseDiskList(output):
   """Parses the output from MegaCLI listing all the disk data.
 
@@ -34,83 +212,132 @@ def MegaCliParseDiskList(output):
     MegaCLIOutputParseError: if the output string could not be parsed.
 
   Returns:
-    A list of dictionaries containing the extracted data.
+    A list of dictionaries containing the extracted data of disks of all
+    adapters.
   """
-  # Lets quickly get rid of those pesky padding lines with just spaces
-  output = '\n'.join(s.strip() for s in output.splitlines() if s)
+  return list(MegaCliIterDiskList(output.splitlines()))
 
-  if 'Adapter #' not in output:
-    raise MegaCLIOutputParseError('Invalid MegaCLI Output')
-  adapters = output.split('Adapter #')[1:]
 
-  disks = []
-  size_pattern = re.compile(
-      r'^(?P<size>[0-9]+(\.[0-9]+)?)\s+'
-      r'(?P<unit>kb|mb|gb|tb)\s+'
-      r'\[(?P<sectors>0x[0-9a-f]+) sectors\]',
-      re.IGNORECASE)
-  temperature_pattern = re.compile(
-      r'(?P<temp_celsius>[0-9]+)C \([0-9]+.[0-9]+ F\)')
-
-  if 'Enclosure Device ID' not in adapters[0]:
-    raise MegaCLIOutputParseError('Invalid MegaCLI Output')
+def _ParseInt(value):
+  """Parses an integer, returning -1 if it's invalid (int)."""
+  try:
+    return int(value)
+  except ValueError:
+    return -1
 
-  devices = adapters[0].split('Enclosure Device ID')[1:]
-  for device in devices:
-    # Populate the current disk's details.
-    current_disk = {
-        'slot': None,
-        'media_error': 0,
-        'other_error': 0,
-        'predictive_failure': 0,
-        'firmware_state': '',
-        'firmware_secondary_state': '',
-        'inquiry': '',
-        'size': '',
-        'sectors': 0,
-        'temperature': None,
-    }
-    device_lines = device.splitlines()
-    for line in device_lines:
-      key, _, value = line.partition(':')
-      key = key.strip()
-      value = value.strip()
-
-      try:
-        if key == 'Slot Number':
-          current_disk['slot'] = int(value)
-        elif key == 'Media Error Count':
-          current_disk['media_error'] = int(value)
-        elif key == 'Other Error Count':
-          current_disk['other_error'] = int(value)
-        elif key == 'Predictive Failure Count':
-          current_disk['predictive_failure'] = int(value)
-        elif key == 'Firmware state':
-          primary_state, _, secondary_state = value.partition(',')
-          current_disk['firmware_state'] = primary_state.strip()
-          current_disk['firmware_secondary_state'] = secondary_state.strip()
-        elif key == 'Inquiry Data':
-          current_disk['inquiry'] = ' '.join(value.split())
-        elif key == 'Raw Size':
-          # Extract disk's sector size.
-          # The format is <X> GB|TB [<Y> Sectors], where Y is an hex number.
-          match = size_pattern.match(value)
-          if match:
-            current_disk['sectors'] = int(match.group('sectors'), 0)
-            disk_size_gb = int(current_disk['sectors'] * 512 / 1000 ** 3)
-            if 0 < disk_size_gb < 1000:
-              current_disk['size'] = '%d GB' % disk_size_gb
-            elif disk_size_gb >= 1000:
-              current_disk['size'] = '%d TB' % int(disk_size_gb / 1000)
-        elif key == 'Drive Temperature':
-          match = temperature_pattern.match(value)
-          if match:
-            current_disk['temperature'] = int(match.group('temp_celsius'))
-      except ValueError:
-        logging.exception(
-            'Ignoring key %r with unsupported value %r', key, value)
-    disks.append(current_disk)
-  return disks
+
+def _ParsePercCliDrive(adapter, drive_path, summary, details):
+  """Parses information about a single drive from PercCLI or StorCLI output.
+
+  Args:
+    adapter: Number of the controller the drive is attached to (int).
+    drive_path: Path of the drive, i.e. '/c0/e32/s0' (str).
+    summary: The drive's row of the drive table (dict).
+    details: Detailed information about the drive (dict).
+
+  Returns:
+    A dictionary containing the extracted data.
+  """
+  current_disk = {
+      'adapter': adapter,
+      'enclosure': None,
+      'slot': None,
+      'media_error': 0,
+      'other_error': 0,
+      'predictive_failure': 0,
+      'firmware_state': '',
+      'firmware_secondary_state': '',
+      'inquiry': '',
+      'size': '',
+      'sectors': 0,
+      'temperature': None,
+      'serial_number': None,
+  }
+  state = details.get('Drive %s State' % drive_path, {})
+  attributes = details.get('Drive %s Device attributes' % drive_path, {})
+  try:
+    enclosure, _, slot = summary['EID:Slt'].rpartition(':')
+    current_disk['enclosure'] = _ParseEnclosure(enclosure)
+    current_disk['slot'] = int(slot)
+    current_disk['media_error'] = int(state.get('Media Error Count', 0))
+    current_disk['other_error'] = int(state.get('Other Error Count', 0))
+    current_disk['predictive_failure'] = int(
+        state.get('Predictive Failure Count', 0))
+  except (KeyError, ValueError):
+    logging.exception('Ignoring unsupported values of drive %s', drive_path)
+
+  drive_state = summary.get('State', '')
+  current_disk['firmware_state'] = PERCCLI_DRIVE_STATES.get(
+      drive_state, drive_state)
+  current_disk['firmware_secondary_state'] = PERCCLI_SPIN_STATES.get(
+      summary.get('Sp'), '')
+  serial_number = attributes.get('SN', '').strip()
+  current_disk['serial_number'] = serial_number or None
+  # Make up an inquiry string like the one shown by MegaCLI.
+  current_disk['inquiry'] = ' '.join(' '.join([
+      attributes.get('Manufacturer Id', ''),
+      attributes.get('Model Number', summary.get('Model', '')),
+      attributes.get('Firmware Revision', '').strip() + serial_number]).split())
+  _ParseRawSize(attributes.get('Raw size', ''), current_disk)
+  match = _TEMPERATURE_PATTERN.match(
+      state.get('Drive Temperature', '').strip())
+  if match:
+    current_disk['temperature'] = int(match.group('temp_celsius'))
+  return current_disk
+
+
+def PercCliParseDiskList(output):
+  """Parses the JSON output from PercCLI or StorCLI listing all the disk data.
+
+  Disks of all controllers are returned, ordered by controller, enclosure and
+  slot. Controllers which fail to list their disks, i.e. because they have
+  none, are skipped.
+
+  Args:
+    output: a string containing the output from
+        "perccli64 /call/eall/sall show all j".
+
+  Raises:
+    PercCLIOutputParseError: if the output string could not be parsed.
+
+  Returns:
+    A list of dictionaries containing the extracted data, see
+    lib_perccli.PercCLI.GetDiskInformation().
+  """
+  try:
+    # Some versions break lines within strings, which strict mode rejects.
+    controllers = json.loads(output, strict=False)['Controllers']
+  except (ValueError, TypeError, KeyError) as e:
+    raise PercCLIOutputParseError('Invalid PercCLI Output: %s' % e)
+
+  drives = []
+  for controller in controllers:
+    try:
+      command_status = controller['Command Status']
+      adapter = int(command_status['Controller'])
+      if command_status['Status'] != 'Success':
+        logging.debug('Skipping controller %d: %s', adapter,
+                      command_status.get('Description'))
+        continue
+      response_data = controller['Response Data']
+    except (ValueError, TypeError, KeyError) as e:
+      raise PercCLIOutputParseError('Invalid PercCLI Output: %s' % e)
+
+    for key, value in response_data.items():
+      # Each drive has a table with a single row keyed by its path, along with
+      # detailed information keyed by its path and a suffix.
+      if not key.startswith('Drive /') or not isinstance(value, list):
+        continue
+      drive_path = key[len('Drive '):]
+      details = response_data.get('%s - Detailed Information' % key, {})
+      for summary in value:
+        enclosure, _, slot = summary.get('EID:Slt', '').rpartition(':')
+        drives.append((
+            (adapter, _ParseInt(enclosure), _ParseInt(slot)),
+            _ParsePercCliDrive(adapter, drive_path, summary, details)))
+
+  drives.sort(key=lambda drive: drive[0])
+  return [disk for _, disk in drives]
 
 
 def HpParseControllerList(output):
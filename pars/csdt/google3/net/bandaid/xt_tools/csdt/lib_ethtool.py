@@ -1,14 +1,21 @@
-"""Console Status Display Tool ethtool library."""
+"""Console Status Display Tool ethtool library.
+
+NIC details are read with ethtool ioctls, see lib_ethtool_ioctl. The ethtool
+binary is only run if they can't be used.
+"""
 
 import logging
 import os
 import re
 import textwrap
+import threading
 
 from google3.net.bandaid.xt_tools.csdt import lib_commands
+from google3.net.bandaid.xt_tools.csdt import lib_ethtool_ioctl
+from google3.net.bandaid.xt_tools.csdt import lib_interfaces
 
 
-_ETHTOOL_PATHS = [
+ETHTOOL_PATHS = [
     '/export/hda3/bandaid/third_party/ethtool',
     '/sbin/ethtool',
 ]
@@ -229,7 +236,7 @@ def _GetCommandOutput(command_runner, command):
 
 def _GetEthtoolPath():
   """Find the correct ethtool binary path."""
-  for path in _ETHTOOL_PATHS:
+  for path in ETHTOOL_PATHS:
     if os.path.isfile(path):
       logging.debug('Using ethtool found at %s.', path)
       return path
@@ -257,7 +264,17 @@ def GetEthtoolDetails(command_runner, ethtool_cmd, parse_spec, header_lines=0):
   return SanitizeData(data, parse_spec)
 
 
-def GetNicDetails(
+def _GetCarrierChanges(device):
+  """Get the number of carrier changes of an interface (int or None)."""
+  try:
+    with open(os.path.join(lib_interfaces.SYS_CLASS_NET_PATH, device,
+                           'carrier_changes')) as file_handle:
+      return int(file_handle.read().rstrip())
+  except IOError:
+    return None
+
+
+def GetNicDetailsWithEthtool(
     command_runner, device, ethtool_path=None, get_optics_details=False):
   """Requests ethtool outputs parsing, and sanitizing.
 
@@ -284,10 +301,131 @@ def GetNicDetails(
         command_runner, ethtool_cmd, _LIGHT_PARSE_SPEC))
 
   if 'port' in data:
+    data['carrier_changes'] = _GetCarrierChanges(device)
+
+  return data
+
+
+def GetNicDetailsWithIoctl(ethtool_socket, device, get_optics_details=False):
+  """Read NIC details with ethtool ioctls.
+
+  Args:
+    ethtool_socket: lib_ethtool_ioctl.EthtoolSocket instance.
+    device: interface name.
+    get_optics_details: collect optics related details if supported by
+                        interface (WARNING: might cause interface flap).
+
+  Returns:
+    A dict with the same keys as GetNicDetailsWithEthtool() returns, along
+    with driver details, see lib_ethtool_ioctl.EthtoolSocket.GetDriverInfo().
+    Details which can't be read are left out, just like ethtool leaves them
+    out of its output.
+  """
+  data = {}
+  try:
+    link_settings = ethtool_socket.GetLinkSettings(device)
+  except lib_ethtool_ioctl.Error as e:
+    logging.debug('Unable to get link settings of %s: %s', device, e)
+  else:
+    if link_settings['speed'] is not None:
+      data['speed'] = link_settings['speed']
+    data['port'] = lib_ethtool_ioctl.PORT_NAMES.get(
+        link_settings['port'], 'Unknown! (%d)' % link_settings['port'])
+
+  try:
+    data['link_state'] = ethtool_socket.GetLinkState(device)
+  except lib_ethtool_ioctl.Error as e:
+    logging.debug('Unable to get link state of %s: %s', device, e)
+
+  try:
+    data.update(ethtool_socket.GetDriverInfo(device))
+  except lib_ethtool_ioctl.Error as e:
+    logging.debug('Unable to get driver details of %s: %s', device, e)
+
+  if (data.get('port', '') == 'FIBRE' and data.get('link_state', False) and
+      get_optics_details):
     try:
-      with open('/sys/class/net/'+device+'/carrier_changes') as file_handle:
-        data['carrier_changes'] = int(file_handle.read().rstrip())
-    except IOError:
-      data['carrier_changes'] = None
+      data.update(lib_ethtool_ioctl.ParseModuleEeprom(
+          *ethtool_socket.GetModuleEeprom(device)))
+    except lib_ethtool_ioctl.Error as e:
+      logging.debug('Unable to get optics details of %s: %s', device, e)
+
+  if 'port' in data:
+    data['carrier_changes'] = _GetCarrierChanges(device)
 
   return data
+
+
+class NicDetailsCollector(object):
+  """Collect NIC details with ethtool ioctls, or by running ethtool.
+
+  Attributes:
+    use_ioctl: Whether ethtool ioctls are used (bool). Cleared if the socket
+        for them can't be opened.
+  """
+
+  def __init__(self, use_ioctl=True):
+    """Constructs a NicDetailsCollector object.
+
+    Args:
+      use_ioctl: Whether to use ethtool ioctls instead of running ethtool,
+          e.g. cleared when running with sample fixtures (bool).
+    """
+    self.use_ioctl = use_ioctl
+
+  def GetNicDetails(
+      self, command_runner, device, ethtool_path=None,
+      get_optics_details=False):
+    """Get NIC details, see GetNicDetails()."""
+    if self.use_ioctl:
+      try:
+        ethtool_socket = lib_ethtool_ioctl.GetEthtoolSocket()
+      except lib_ethtool_ioctl.Error as e:
+        logging.warning('Falling back to running ethtool: %s', e)
+        self.use_ioctl = False
+      else:
+        return GetNicDetailsWithIoctl(
+            ethtool_socket, device, get_optics_details=get_optics_details)
+    return GetNicDetailsWithEthtool(
+        command_runner, device, ethtool_path=ethtool_path,
+        get_optics_details=get_optics_details)
+
+
+_nic_details_collector = None
+_nic_details_collector_lock = threading.Lock()
+
+
+def GetNicDetailsCollector():
+  """Get the NicDetailsCollector instance shared by all tiles."""
+  global _nic_details_collector
+  with _nic_details_collector_lock:
+    if _nic_details_collector is None:
+      _nic_details_collector = NicDetailsCollector()
+    return _nic_details_collector
+
+
+def SetNicDetailsCollector(nic_details_collector):
+  """Replace the NicDetailsCollector instance shared by all tiles."""
+  global _nic_details_collector
+  with _nic_details_collector_lock:
+    _nic_details_collector = nic_details_collector
+
+
+def GetNicDetails(
+    command_runner, device, ethtool_path=None, get_optics_details=False):
+  """Get link, driver and optionally optics details of a NIC.
+
+  Args:
+    command_runner: lib_commands.CommandRunner instance, used if ethtool has
+        to be run.
+    device: interface name.
+    ethtool_path: ethtool binary to run, if it has to be run.
+    get_optics_details: collect optics related details if supported by
+                        interface (WARNING: might cause interface flap).
+
+  Returns:
+    A dict containing filtered and sanitized data.
+  """
+  return GetNicDetailsCollector().GetNicDetails(
+      command_runner, device, ethtool_path=ethtool_path,
+      get_optics_details=get_optics_details)
@@ -0,0 +1,509 @@
+"""Console Status Display Tool ethtool ioctl library.
+
+Link settings, driver details and transceiver module EEPROMs are read with
+SIOCETHTOOL ioctls over a single socket, instead of running ethtool for every
+interface. Module EEPROMs are decoded according to SFF-8472 (SFP) and
+SFF-8636 (QSFP), including digital optical monitoring.
+"""
+
+import array
+import errno
+import fcntl
+import math
+import socket
+import struct
+import threading
+
+SIOCETHTOOL = 0x8946
+
+# ethtool commands, see linux/ethtool.h.
+ETHTOOL_GSET = 0x1
+ETHTOOL_GDRVINFO = 0x3
+ETHTOOL_GLINK = 0xa
+ETHTOOL_GMODULEINFO = 0x42
+ETHTOOL_GMODULEEEPROM = 0x43
+ETHTOOL_GLINKSETTINGS = 0x4c
+
+# Speed reported for links whose speed isn't known, e.g. when they're down.
+SPEED_UNKNOWN = 0xffffffff
+
+# Connector types, named as printed by ethtool.
+PORT_NAMES = {
+    0x00: 'Twisted Pair',
+    0x01: 'AUI',
+    0x02: 'MII',
+    0x03: 'FIBRE',
+    0x04: 'BNC',
+    0x05: 'Direct Attach Copper',
+    0xef: 'None',
+    0xff: 'Other',
+}
+
+# Module EEPROM layouts returned by ETHTOOL_GMODULEINFO.
+ETH_MODULE_SFF_8079 = 0x1
+ETH_MODULE_SFF_8472 = 0x2
+ETH_MODULE_SFF_8636 = 0x3
+ETH_MODULE_SFF_8436 = 0x4
+
+# EEPROM lengths of SFF-8472 with the diagnostics page (A0h and A2h) and of
+# SFF-8636 with upper pages 00h to 03h.
+SFF_8472_EEPROM_LENGTH = 512
+SFF_8636_EEPROM_LENGTH = 640
+
+# Transceiver compliance codes by (byte, bit mask), as printed by ethtool.
+SFF_8472_TRANSCEIVER_TYPES = [
+    (3, 0x80, '10G Ethernet: 10G Base-ER'),
+    (3, 0x40, '10G Ethernet: 10G Base-LRM'),
+    (3, 0x20, '10G Ethernet: 10G Base-LR'),
+    (3, 0x10, '10G Ethernet: 10G Base-SR'),
+    (6, 0x08, 'Ethernet: 1000BASE-T'),
+    (6, 0x04, 'Ethernet: 1000BASE-CX'),
+    (6, 0x02, 'Ethernet: 1000BASE-LX'),
+    (6, 0x01, 'Ethernet: 1000BASE-SX'),
+]
+SFF_8636_TRANSCEIVER_TYPES = [
+    (131, 0x40, '10G Ethernet: 10G Base-LRM'),
+    (131, 0x20, '10G Ethernet: 10G Base-LR'),
+    (131, 0x10, '10G Ethernet: 10G Base-SR'),
+    (131, 0x08, '40G Ethernet: 40G Base-CR4'),
+    (131, 0x04, '40G Ethernet: 40G Base-SR4'),
+    (131, 0x02, '40G Ethernet: 40G Base-LR4'),
+    (131, 0x01, '40G Ethernet: 40G Active Cable (XLPPI)'),
+]
+# Extended compliance codes of SFF-8024, used by SFF-8636 byte 192.
+SFF_8636_EXTENDED_TRANSCEIVER_TYPES = {
+    0x01: 'Extended: 100G AOC or 25GAUI C2M AOC with worst BER of 5x10^(-5)',
+    0x02: 'Extended: 100G Base-SR4 or 25GBase-SR',
+    0x03: 'Extended: 100G Base-LR4 or 25GBase-LR',
+    0x04: 'Extended: 100G Base-ER4 or 25GBase-ER',
+    0x08: 'Extended: 100G ACC or 25GAUI C2M ACC with worst BER of 5x10^(-5)',
+    0x0b: 'Extended: 100G Base-CR4 or 25G Base-CR CA-L',
+    0x18: 'Extended: 100G AOC or 25GAUI C2M AOC with worst BER of 10^(-12)',
+    0x19: 'Extended: 100G ACC or 25GAUI C2M ACC with worst BER of 10^(-12)',
+}
+
+# Offsets of power thresholds, from the start of SFF-8472 page A2h or of
+# SFF-8636 upper page 03h, as (offset, key suffix) tuples.
+_POWER_THRESHOLDS = [
+    (0, 'high_alarm'),
+    (2, 'low_alarm'),
+    (4, 'high_warning'),
+    (6, 'low_warning'),
+]
+
+_IFREQ = struct.Struct('16sP')
+_ETHTOOL_VALUE = struct.Struct('=II')
+_ETHTOOL_CMD = struct.Struct('=IIIHBBBBBBIIHBBI8x')
+_ETHTOOL_DRVINFO = struct.Struct('=I32s32s32s32s32s12sIIIII')
+_ETHTOOL_LINK_SETTINGS = struct.Struct('=IIBBBBBBBbBBBB28x')
+_ETHTOOL_MODINFO = struct.Struct('=III32x')
+_ETHTOOL_EEPROM = struct.Struct('=IIII')
+
+_UINT16 = struct.Struct('>H')
+_INT16 = struct.Struct('>h')
+_FLOAT = struct.Struct('>f')
+
+# Maximum length of interface names, including the terminating null byte.
+_IFNAMSIZ = 16
+
+
+class Error(Exception):
+  pass
+
+
+class OperationNotSupportedError(Error):
+  """The driver of the interface doesn't support an ethtool command."""
+  pass
+
+
+def _MilliwattsToDbm(milliwatts):
+  """Convert optical power to dBm (float), or None if there's no light."""
+  if milliwatts <= 0:
+    return None
+  return 10 * math.log10(milliwatts)
+
+
+def _AddPower(data, key, milliwatts):
+  """Add optical power in mW and dBm, rounded like ethtool prints them.
+
+  Args:
+    data: Dictionary to add the power to.
+    key: Prefix of the keys to add, i.e. 'rx_power' (str).
+    milliwatts: Optical power (float, mW).
+  """
+  data[key + '_mw'] = round(milliwatts, 4)
+  dbm = _MilliwattsToDbm(milliwatts)
+  if dbm is not None:
+    data[key + '_dbm'] = round(dbm, 2)
+
+
+def _AddTemperature(data, celsius):
+  """Add module temperature, rounded like ethtool prints it."""
+  data['temperature_cel'] = round(celsius, 2)
+  data['temperature_far'] = round(celsius * 1.8 + 32, 2)
+
+
+def _GetCString(value):
+  """Get a null terminated string from a fixed size field (str)."""
+  return value.split('\0', 1)[0]
+
+
+def _GetString(eeprom, offset, length):
+  """Get a space padded ASCII string from a module EEPROM (str)."""
+  return eeprom[offset:offset + length].strip(' \0')
+
+
+def _GetTransceiverType(eeprom, transceiver_types):
+  """Get the first transceiver compliance code set in a module EEPROM.
+
+  Args:
+    eeprom: Module EEPROM contents (str).
+    transceiver_types: List of (byte, bit mask, description) tuples.
+
+  Returns:
+    Description of the compliance code (str), or None if none is set.
+  """
+  for offset, mask, description in transceiver_types:
+    if ord(eeprom[offset]) & mask:
+      return description
+  return None
+
+
+def _DecodeSff8472Diagnostics(eeprom, data):
+  """Decode digital optical monitoring of SFF-8472 page A2h.
+
+  Args:
+    eeprom: Module EEPROM contents, both pages A0h and A2h (str).
+    data: Dictionary to add the decoded values to.
+  """
+  diagnostics = eeprom[256:512]
+  externally_calibrated = bool(ord(eeprom[92]) & 0x10)
+  alarms_implemented = bool(ord(eeprom[93]) & 0x80)
+
+  if externally_calibrated:
+    temperature_slope = _UINT16.unpack_from(diagnostics, 84)[0] / 256.0
+    temperature_offset = _INT16.unpack_from(diagnostics, 86)[0]
+    tx_power_slope = _UINT16.unpack_from(diagnostics, 80)[0] / 256.0
+    tx_power_offset = _INT16.unpack_from(diagnostics, 82)[0]
+    # Coefficients of the polynomial from the 4th to the 0th power.
+    rx_power_coefficients = [
+        _FLOAT.unpack_from(diagnostics, offset)[0]
+        for offset in range(56, 76, 4)]
+  else:
+    temperature_slope, temperature_offset = 1.0, 0
+    tx_power_slope, tx_power_offset = 1.0, 0
+    rx_power_coefficients = [0.0, 0.0, 0.0, 1.0, 0.0]
+
+  def GetTemperature(offset):
+    raw_value = _INT16.unpack_from(diagnostics, offset)[0]
+    return (raw_value * temperature_slope + temperature_offset) / 256.0
+
+  # Optical power is measured in units of 0.1 uW.
+  def GetTxPower(offset):
+    raw_value = _UINT16.unpack_from(diagnostics, offset)[0]
+    return (raw_value * tx_power_slope + tx_power_offset) / 10000.0
+
+  def GetRxPower(offset):
+    raw_value = _UINT16.unpack_from(diagnostics, offset)[0]
+    value = 0.0
+    for coefficient in rx_power_coefficients:
+      value = value * raw_value + coefficient
+    return value / 10000.0
+
+  _AddTemperature(data, GetTemperature(96))
+  _AddPower(data, 'laser_tx_power', GetTxPower(102))
+  _AddPower(data, 'rx_power', GetRxPower(104))
+  if alarms_implemented:
+    for offset, suffix in _POWER_THRESHOLDS:
+      _AddPower(data, 'laser_tx_power_' + suffix, GetTxPower(24 + offset))
+      _AddPower(data, 'rx_power_' + suffix, GetRxPower(32 + offset))
+
+
+def ParseSff8472(eeprom):
+  """Decode an SFP module EEPROM according to SFF-8472.
+
+  Args:
+    eeprom: Module EEPROM contents, page A0h optionally followed by page A2h
+        (str).
+
+  Returns:
+    Dictionary with the same keys as lib_ethtool.SanitizeOpticsData() returns
+    for the output of `ethtool -m`.
+  """
+  data = {
+      'vendor_name': _GetString(eeprom, 20, 16),
+      'vendor_pn': _GetString(eeprom, 40, 16),
+      'vendor_rev': _GetString(eeprom, 56, 4),
+      'vendor_sn': _GetString(eeprom, 68, 16),
+  }
+  transceiver_type = _GetTransceiverType(eeprom, SFF_8472_TRANSCEIVER_TYPES)
+  if transceiver_type:
+    data['transceiver_type'] = transceiver_type
+  # Copper cables report their cable compliance instead of a wavelength.
+  if not ord(eeprom[8]) & 0x0c:
+    data['laser_wavelength_nm'] = _UINT16.unpack_from(eeprom, 60)[0]
+  # Digital diagnostic monitoring implemented.
+  if len(eeprom) >= SFF_8472_EEPROM_LENGTH and ord(eeprom[92]) & 0x40:
+    _DecodeSff8472Diagnostics(eeprom, data)
+  return data
+
+
+def ParseSff8636(eeprom):
+  """Decode a QSFP module EEPROM according to SFF-8636.
+
+  Optical power of the lane with the least power is reported, powers of all
+  lanes are listed separately.
+
+  Args:
+    eeprom: Module EEPROM contents, the lower page and upper page 00h
+        optionally followed by upper pages 01h to 03h (str).
+
+  Returns:
+    Dictionary with the same keys as lib_ethtool.SanitizeOpticsData() returns
+    for the output of `ethtool -m`, along with:
+      - rx_power_lanes_mw: optical power received on each lane (list).
+      - laser_tx_power_lanes_mw: optical power transmitted on each lane, if
+          the module measures it (list).
+  """
+  data = {
+      'vendor_name': _GetString(eeprom, 148, 16),
+      'vendor_pn': _GetString(eeprom, 168, 16),
+      'vendor_rev': _GetString(eeprom, 184, 2),
+      'vendor_sn': _GetString(eeprom, 196, 16),
+  }
+  transceiver_type = _GetTransceiverType(eeprom, SFF_8636_TRANSCEIVER_TYPES)
+  if not transceiver_type and ord(eeprom[131]) & 0x80:
+    transceiver_type = SFF_8636_EXTENDED_TRANSCEIVER_TYPES.get(
+        ord(eeprom[192]))
+  if transceiver_type:
+    data['transceiver_type'] = transceiver_type
+  # Copper cables report their attenuation instead of a wavelength, which is
+  # stored in units of 0.05 nm.
+  if ord(eeprom[147]) >> 4 < 0x0a:
+    data['laser_wavelength_nm'] = int(
+        round(_UINT16.unpack_from(eeprom, 186)[0] / 20.0))
+
+  _AddTemperature(data, _INT16.unpack_from(eeprom, 22)[0] / 256.0)
+
+  # Optical power is measured in units of 0.1 uW.
+  rx_powers = [
+      _UINT16.unpack_from(eeprom, offset)[0] / 10000.0
+      for offset in range(34, 42, 2)]
+  data['rx_power_lanes_mw'] = [round(power, 4) for power in rx_powers]
+  _AddPower(data, 'rx_power', min(rx_powers))
+  # Transmitted power is only measured by some modules.
+  if ord(eeprom[220]) & 0x04:
+    tx_powers = [
+        _UINT16.unpack_from(eeprom, offset)[0] / 10000.0
+        for offset in range(50, 58, 2)]
+    data['laser_tx_power_lanes_mw'] = [
+        round(power, 4) for power in tx_powers]
+    _AddPower(data, 'laser_tx_power', min(tx_powers))
+
+  # Thresholds are on upper page 03h, which flat memory modules don't have.
+  if len(eeprom) >= SFF_8636_EEPROM_LENGTH and not ord(eeprom[2]) & 0x04:
+    page_offset = 384
+    for offset, suffix in _POWER_THRESHOLDS:
+      _AddPower(
+          data, 'rx_power_' + suffix,
+          _UINT16.unpack_from(eeprom, page_offset + 0xb0 + offset)[0] /
+          10000.0)
+      if 'laser_tx_power_mw' in data:
+        _AddPower(
+            data, 'laser_tx_power_' + suffix,
+            _UINT16.unpack_from(eeprom, page_offset + 0xc0 + offset)[0] /
+            10000.0)
+  return data
+
+
+def ParseModuleEeprom(module_type, eeprom):
+  """Decode a module EEPROM according to its layout.
+
+  Args:
+    module_type: Layout of the EEPROM, one of ETH_MODULE_* (int).
+    eeprom: Module EEPROM contents (str).
+
+  Raises:
+    Error: If the layout isn't supported.
+
+  Returns:
+    Dictionary of decoded details, see ParseSff8472() and ParseSff8636().
+  """
+  if module_type in [ETH_MODULE_SFF_8079, ETH_MODULE_SFF_8472]:
+    return ParseSff8472(eeprom)
+  if module_type in [ETH_MODULE_SFF_8636, ETH_MODULE_SFF_8436]:
+    return ParseSff8636(eeprom)
+  raise Error('Unsupported module EEPROM type: 0x%x' % module_type)
+
+
+class EthtoolSocket(object):
+  """Run ethtool commands on network interfaces with SIOCETHTOOL ioctls.
+
+  A single socket is used for all interfaces. All methods are thread-safe.
+  """
+
+  def __init__(self):
+    try:
+      self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    except socket.error as e:
+      raise Error('Unable to open a socket for ethtool ioctls: %s' % e)
+
+  def Close(self):
+    self._socket.close()
+
+  def _Ioctl(self, device, request):
+    """Run an ethtool command on an interface.
+
+    Args:
+      device: Interface name (str).
+      request: Command structure, starting with the command number (str).
+
+    Raises:
+      OperationNotSupportedError: If the driver doesn't support the command.
+      Error: If the command fails.
+
+    Returns:
+      Command structure filled in by the driver (str).
+    """
+    if len(device) >= _IFNAMSIZ:
+      raise Error('Invalid interface name: %r' % device)
+    buffer_ = array.array('B', request)
+    ifreq = _IFREQ.pack(device, buffer_.buffer_info()[0])
+    try:
+      fcntl.ioctl(self._socket.fileno(), SIOCETHTOOL, ifreq)
+    except IOError as e:
+      if e.errno == errno.EOPNOTSUPP:
+        raise OperationNotSupportedError(
+            'ethtool command 0x%x not supported by %s' % (
+                struct.unpack_from('=I', request)[0], device))
+      raise Error('ethtool ioctl on %s failed: %s' % (device, e))
+    return buffer_.tostring()
+
+  def GetLinkState(self, device):
+    """Check if a link is detected on an interface (bool)."""
+    reply = self._Ioctl(device, _ETHTOOL_VALUE.pack(ETHTOOL_GLINK, 0))
+    return bool(_ETHTOOL_VALUE.unpack(reply)[1])
+
+  def GetLinkSettings(self, device):
+    """Get link settings of an interface.
+
+    Drivers which don't support ETHTOOL_GLINKSETTINGS yet are queried with
+    the legacy ETHTOOL_GSET command.
+
+    Args:
+      device: Interface name (str).
+
+    Raises:
+      Error: If link settings can't be read.
+
+    Returns:
+      Dictionary with the following keys:
+        - speed: Link speed in Mbps, or None if unknown (int).
+        - port: Connector type, one of PORT_NAMES (int).
+        - duplex: Duplex mode (int).
+        - autoneg: Whether auto-negotiation is enabled (bool).
+    """
+    try:
+      # The driver first reports the length of its link mode bitmaps, then
+      # fills in the settings once a buffer large enough for them is passed.
+      request = _ETHTOOL_LINK_SETTINGS.pack(
+          ETHTOOL_GLINKSETTINGS, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+      reply = _ETHTOOL_LINK_SETTINGS.unpack(self._Ioctl(device, request))
+      link_mode_masks_nwords = -reply[9]
+      if link_mode_masks_nwords <= 0:
+        raise Error('Unexpected link mode handshake from %s' % device)
+      request = _ETHTOOL_LINK_SETTINGS.pack(
+          ETHTOOL_GLINKSETTINGS, 0, 0, 0, 0, 0, 0, 0, 0,
+          link_mode_masks_nwords, 0, 0, 0, 0)
+      # Supported, advertised and link partner link modes.
+      request += '\0' * (3 * 4 * link_mode_masks_nwords)
+      reply = _ETHTOOL_LINK_SETTINGS.unpack_from(self._Ioctl(device, request))
+      speed, duplex, port, autoneg = reply[1], reply[2], reply[3], reply[5]
+    except OperationNotSupportedError:
+      request = _ETHTOOL_CMD.pack(
+          ETHTOOL_GSET, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+      reply = _ETHTOOL_CMD.unpack(self._Ioctl(device, request))
+      speed = reply[3] | reply[12] << 16
+      duplex, port, autoneg = reply[4], reply[5], reply[8]
+
+    # Speeds reported by down links vary between drivers.
+    if speed in [0, 0xffff, SPEED_UNKNOWN]:
+      speed = None
+    return {
+        'speed': speed,
+        'port': port,
+        'duplex': duplex,
+        'autoneg': bool(autoneg),
+    }
+
+  def GetDriverInfo(self, device):
+    """Get driver details of an interface.
+
+    Args:
+      device: Interface name (str).
+
+    Raises:
+      Error: If driver details can't be read.
+
+    Returns:
+      Dictionary with the following keys (str):
+        - driver: Name of the driver.
+        - driver_version: Version of the driver.
+        - firmware_version: Version of the NIC firmware.
+        - bus_info: Address of the NIC, i.e. its PCI address.
+    """
+    request = _ETHTOOL_DRVINFO.pack(
+        ETHTOOL_GDRVINFO, '', '', '', '', '', '', 0, 0, 0, 0, 0)
+    reply = _ETHTOOL_DRVINFO.unpack(self._Ioctl(device, request))
+    return {
+        'driver': _GetCString(reply[1]),
+        'driver_version': _GetCString(reply[2]),
+        'firmware_version': _GetCString(reply[3]),
+        'bus_info': _GetCString(reply[4]),
+    }
+
+  def GetModuleEeprom(self, device):
+    """Read the EEPROM of the transceiver module plugged into an interface.
+
+    Only the pages needed by ParseModuleEeprom() are read.
+
+    Args:
+      device: Interface name (str).
+
+    Raises:
+      OperationNotSupportedError: If the driver can't read module EEPROMs.
+      Error: If the EEPROM can't be read, e.g. if no module is plugged in.
+
+    Returns:
+      Tuple of the EEPROM layout, one of ETH_MODULE_* (int), and its
+      contents (str).
+    """
+    request = _ETHTOOL_MODINFO.pack(ETHTOOL_GMODULEINFO, 0, 0)
+    _, module_type, eeprom_length = _ETHTOOL_MODINFO.unpack(
+        self._Ioctl(device, request))
+    if module_type in [ETH_MODULE_SFF_8079, ETH_MODULE_SFF_8472]:
+      eeprom_length = min(eeprom_length, SFF_8472_EEPROM_LENGTH)
+    else:
+      eeprom_length = min(eeprom_length, SFF_8636_EEPROM_LENGTH)
+
+    request = _ETHTOOL_EEPROM.pack(
+        ETHTOOL_GMODULEEEPROM, 0, 0, eeprom_length) + '\0' * eeprom_length
+    reply = self._Ioctl(device, request)
+    return module_type, reply[_ETHTOOL_EEPROM.size:]
+
+
+_ethtool_socket = None
+_ethtool_socket_lock = threading.Lock()
+
+
+def GetEthtoolSocket():
+  """Get the EthtoolSocket instance shared by all tiles.
+
+  Raises:
+    Error: If the socket can't be opened.
+  """
+  global _ethtool_socket
+  with _ethtool_socket_lock:
+    if _ethtool_socket is None:
+      _ethtool_socket = EthtoolSocket()
+    return _ethtool_socket
@@ -0,0 +1,334 @@
+"""Console Status Display Tool headless data export library."""
+
+import errno
+import json
+import logging
+import select
+import time
+
+from google3.net.bandaid.xt_tools.csdt import lib_colors
+from google3.net.bandaid.xt_tools.csdt import lib_common
+from google3.net.bandaid.xt_tools.csdt import lib_netlink
+from google3.net.bandaid.xt_tools.csdt import lib_refresh
+from google3.net.bandaid.xt_tools.csdt import lib_stats
+from google3.net.bandaid.xt_tools.csdt import tile
+
+# Metric types and help texts, keyed by metric name. Metrics which aren't
+# listed here are exported as untyped.
+METRICS = {
+    'csdt_tile_up': (
+        'gauge', 'Whether the last refresh of a tile has succeeded.'),
+    'csdt_tile_refresh_timestamp_seconds': (
+        'gauge', 'Time of the last refresh of a tile.'),
+    'csdt_tile_refresh_duration_seconds': (
+        'gauge', 'Time taken by the last refresh of a tile.'),
+    'csdt_machine_info': (
+        'gauge', 'Machine identification details.'),
+    'csdt_disk_failed': (
+        'gauge', 'Whether the disk in a slot has failed.'),
+    'csdt_psu_failed': (
+        'gauge', 'Whether a power supply has failed.'),
+    'csdt_fan_failed': (
+        'gauge', 'Whether a fan has failed.'),
+    'csdt_fan_speed': (
+        'gauge', 'Fan speed reported by the BMC, in RPM or percent.'),
+    'csdt_memory_total_bytes': (
+        'gauge', 'Total amount of memory detected.'),
+    'csdt_network_link_up': (
+        'gauge', 'Whether a link is detected on a network interface.'),
+    'csdt_network_link_speed_mbps': (
+        'gauge', 'Negotiated speed of a network interface.'),
+    'csdt_network_carrier_changes_total': (
+        'counter', 'Number of carrier changes of a network interface.'),
+    'csdt_network_optics_rx_power_dbm': (
+        'gauge', 'Optical power received by a transceiver.'),
+    'csdt_network_optics_tx_power_dbm': (
+        'gauge', 'Optical power transmitted by a transceiver.'),
+    'csdt_bonding_active_capacity_mbps': (
+        'gauge', 'Total speed of the active members of a bond.'),
+    'csdt_bonding_member_active': (
+        'gauge', 'Whether an interface is an active member of a bond.'),
+    'csdt_bonding_member_link_failures_total': (
+        'counter', 'Number of link failures of a member of a bond.'),
+    'csdt_bonding_member_flapping': (
+        'gauge', 'Whether the link of a member of a bond failed recently.'),
+    'csdt_connectivity_up': (
+        'gauge', 'Whether a connectivity target responds to ping.'),
+    'csdt_connectivity_rtt_seconds': (
+        'gauge', 'Average round-trip time to a connectivity target.'),
+    'csdt_connectivity_jitter_seconds': (
+        'gauge', 'Average variation of the round-trip time to a target.'),
+    'csdt_connectivity_loss_ratio': (
+        'gauge', 'Fraction of echo requests to a target without a reply.'),
+}
+
+
+class Sample(object):
+  """A sample of a metric exported by a tile.
+
+  Attributes:
+    name: Name of the metric (str).
+    value: Value of the sample (int or float).
+    labels: Dictionary mapping label names to their values (str).
+  """
+
+  def __init__(self, name, value, labels=None):
+    self.name = name
+    self.value = value
+    self.labels = labels or {}
+
+
+def _EscapeLabelValue(value):
+  """Escape a label value for the Prometheus text format (str)."""
+  return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+          .replace('\n', '\\n'))
+
+
+def _FormatValue(value):
+  """Format a sample value for the Prometheus text format (str)."""
+  if isinstance(value, bool):
+    return str(int(value))
+  return repr(value)
+
+
+def FormatTextfile(samples):
+  """Format samples in the Prometheus text format read by node_exporter.
+
+  Args:
+    samples: List of Sample instances.
+
+  Returns:
+    Content of the textfile (str).
+  """
+  samples_by_name = {}
+  for sample in samples:
+    samples_by_name.setdefault(sample.name, []).append(sample)
+
+  lines = []
+  for name in sorted(samples_by_name):
+    metric_type, metric_help = METRICS.get(name, ('untyped', None))
+    if metric_help:
+      lines.append('# HELP %s %s' % (name, metric_help))
+    lines.append('# TYPE %s %s' % (name, metric_type))
+    for sample in samples_by_name[name]:
+      labels = ','.join(
+          '%s="%s"' % (label, _EscapeLabelValue(value))
+          for label, value in sorted(sample.labels.iteritems()))
+      if labels:
+        lines.append('%s{%s} %s' % (name, labels, _FormatValue(sample.value)))
+      else:
+        lines.append('%s %s' % (name, _FormatValue(sample.value)))
+  return '\n'.join(lines) + '\n'
+
+
+def _ConvertToJson(value):
+  """Convert values the json module can't serialise, i.e. sets."""
+  if isinstance(value, (set, frozenset)):
+    return sorted(value)
+  return str(value)
+
+
+def FormatJson(snapshot):
+  """Format a snapshot of tile data as JSON.
+
+  Statuses in tile data (see lib_status) are stripped of their color tokens.
+
+  Args:
+    snapshot: Dictionary returned by Exporter.GetSnapshot().
+
+  Returns:
+    Content of the JSON file (str).
+  """
+  json_text = json.dumps(
+      snapshot, default=_ConvertToJson, indent=2, separators=(',', ': '),
+      sort_keys=True)
+  return lib_colors.RE_TOKENS_OFF.sub('', json_text) + '\n'
+
+
+class Exporter(object):
+  """Refresh tiles on their schedule and export their data to files.
+
+  Tiles are refreshed exactly as they would be on the console, but instead of
+  being drawn, their data is written to a node_exporter textfile and/or a
+  JSON snapshot after every completed refresh. Both files are replaced
+  atomically, so readers never see partially written content.
+  """
+
+  def __init__(self, tiles, textfile_path=None, json_path=None,
+               initial_delay=0):
+    """Constructs an Exporter object.
+
+    Args:
+      tiles: Tiles to refresh and export (list of tile.InformationTile).
+      textfile_path: Path of the node_exporter textfile to write, if any
+          (str).
+      json_path: Path of the JSON snapshot to write, if any (str).
+      initial_delay: Number of seconds during which only tiles which are
+          cheap to refresh are refreshed (float).
+    """
+    self.tiles = tiles
+    self.textfile_path = textfile_path
+    self.json_path = json_path
+    self.initial_delay_timestamp = time.time() + initial_delay
+    self.refresh_scheduler = lib_refresh.RefreshScheduler()
+    self.network_monitor = lib_netlink.OpenRtnetlinkMonitor()
+
+  def _IsInitialDelayOver(self):
+    """Check if tiles which are expensive to refresh may be refreshed."""
+    return time.time() >= self.initial_delay_timestamp
+
+  def _GetRefreshableTiles(self):
+    """Get tiles which may be refreshed and aren't being refreshed already."""
+    initial_delay_over = self._IsInitialDelayOver()
+    return [
+        information_tile for information_tile in self.tiles
+        if (initial_delay_over or information_tile.IsCheapToRefresh()) and
+        not self.refresh_scheduler.IsPending(information_tile)]
+
+  def _GetSecondsUntilNextEvent(self):
+    """Get the number of seconds to wait for completed refreshes."""
+    deadlines = [
+        information_tile.GetSecondsUntilRefresh()
+        for information_tile in self._GetRefreshableTiles()]
+    if not self._IsInitialDelayOver():
+      deadlines.append(self.initial_delay_timestamp - time.time())
+    if deadlines:
+      return max(0, min(deadlines))
+    return None
+
+  def GetSamples(self):
+    """Get metric samples of all refreshed tiles.
+
+    Returns:
+      List of Sample instances.
+    """
+    samples = []
+    tile_statistics = lib_stats.GetCollectorStatistics().GetTiles()
+    for information_tile in self.tiles:
+      if not information_tile.refresh_timestamp:
+        continue
+      tile_name = information_tile.GetTileName()
+      labels = {'tile': tile_name}
+      samples.append(Sample(
+          'csdt_tile_up', information_tile.tile_data is not None, labels))
+      samples.append(Sample(
+          'csdt_tile_refresh_timestamp_seconds',
+          information_tile.refresh_timestamp, labels))
+      if tile_name in tile_statistics:
+        samples.append(Sample(
+            'csdt_tile_refresh_duration_seconds',
+            tile_statistics[tile_name].last_seconds, labels))
+      if information_tile.tile_data is None:
+        continue
+      try:
+        samples.extend(
+            information_tile.GetTileMetrics(information_tile.tile_data))
+      # Exception type being caught here is intentionally broad, so that a
+      # single tile can't prevent all the others from being exported.
+      except Exception:  # pylint: disable=broad-except
+        logging.exception('Failed to get metrics of tile: \'%s\':', tile_name)
+    return samples
+
+  def GetSnapshot(self):
+    """Get a snapshot of the data of all refreshed tiles.
+
+    Returns:
+      Dictionary serialisable to JSON, see FormatJson().
+    """
+    snapshot = {
+        'timestamp': time.time(),
+        'tiles': {},
+    }
+    for information_tile in self.tiles:
+      if not information_tile.refresh_timestamp:
+        continue
+      snapshot['tiles'][information_tile.GetTileName()] = {
+          'up': information_tile.tile_data is not None,
+          'refresh_timestamp': information_tile.refresh_timestamp,
+          'data': information_tile.tile_data,
+      }
+    return snapshot
+
+  def Export(self):
+    """Write the data of all refreshed tiles to the requested files."""
+    if self.textfile_path:
+      try:
+        lib_common.WriteFileAtomically(
+            self.textfile_path, FormatTextfile(self.GetSamples()))
+      except (IOError, OSError) as error:
+        logging.error('Unable to write textfile %s: %s',
+                      self.textfile_path, error)
+    if self.json_path:
+      try:
+        lib_common.WriteFileAtomically(
+            self.json_path, FormatJson(self.GetSnapshot()))
+      except (IOError, OSError) as error:
+        logging.error('Unable to write JSON snapshot %s: %s',
+                      self.json_path, error)
+
+  def _HandleCompletedRefreshes(self, unused_completed_refreshes):
+    """Publish tile data once refreshes have completed.
+
+    Args:
+      unused_completed_refreshes: List of lib_refresh.RefreshScheduler.Result
+          instances.
+    """
+    self.Export()
+
+  def _GetReadFds(self):
+    """Get the file objects whose input ends a wait for events."""
+    read_fds = [self.refresh_scheduler]
+    if self.network_monitor:
+      read_fds.append(self.network_monitor)
+    return read_fds
+
+  def _HandleNetworkChanges(self, readable_fds):
+    """Refresh tiles showing network configuration if it has changed."""
+    if self.network_monitor in readable_fds:
+      tile.HandleNetworkChanges(self.network_monitor, self.tiles)
+
+  def _WaitForEvents(self, timeout):
+    """Wait for a completed refresh, a network change or a timeout.
+
+    Args:
+      timeout: Maximum time to wait or None to wait indefinitely (float,
+          seconds).
+    """
+    try:
+      readable_fds, _, _ = select.select(self._GetReadFds(), [], [], timeout)
+    except select.error as error:
+      # Signals which didn't terminate the exporter interrupt the wait.
+      if error.args[0] != errno.EINTR:
+        raise
+      return
+    self._HandleNetworkChanges(readable_fds)
+
+  def RunOnce(self):
+    """Request refreshes which are due and publish any completed ones.
+
+    Returns:
+      True if any refreshes have completed.
+      False otherwise.
+    """
+    for information_tile in self._GetRefreshableTiles():
+      if information_tile.IsRefreshRequired():
+        if self.refresh_scheduler.Submit(information_tile):
+          logging.debug('Updating data of \'%s\' tile.',
+                        information_tile.GetTileName())
+
+    completed_refreshes = self.refresh_scheduler.GetCompletedRefreshes()
+    for result in completed_refreshes:
+      result.tile.UpdateRefreshTimestamp()
+    if completed_refreshes:
+      self._HandleCompletedRefreshes(completed_refreshes)
+    return bool(completed_refreshes)
+
+  def Run(self):
+    """Refresh and export tiles until the process exits."""
+    export_paths = [
+        path for path in [self.textfile_path, self.json_path] if path]
+    if export_paths:
+      logging.info('Exporting tile data to: %s', ', '.join(export_paths))
+    while 1:
+      self.RunOnce()
+      self._WaitForEvents(timeout=self._GetSecondsUntilNextEvent())
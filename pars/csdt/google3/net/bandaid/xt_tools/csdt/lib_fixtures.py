@@ -0,0 +1,530 @@
+"""Console Status Display Tool sample machine fixture library.
+
+A fixture holds the output of every command run by CSDT's collectors on a
+given machine, along with a fake root directory with the files they read from
+/proc and /sys. It allows running parsers and whole tiles without the actual
+hardware, i.e. to benchmark them.
+
+The fixtures in testdata are sample output written in the formats of the
+tools and kernel interfaces, not captures from real machines. Changes to
+parsers still need checking against real output.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import re
+
+from google3.net.bandaid.xt_tools.csdt import lib_commands
+from google3.net.bandaid.xt_tools.csdt import lib_common
+from google3.net.bandaid.xt_tools.csdt import lib_ethtool
+from google3.net.bandaid.xt_tools.csdt import lib_hpssacli
+from google3.net.bandaid.xt_tools.csdt import lib_icmp
+from google3.net.bandaid.xt_tools.csdt import lib_interfaces
+from google3.net.bandaid.xt_tools.csdt import lib_megacli
+from google3.net.bandaid.xt_tools.csdt import lib_perccli
+from google3.net.bandaid.xt_tools.csdt import lib_sensors
+from google3.net.bandaid.xt_tools.csdt import lib_tools
+from google3.net.bandaid.xt_tools.csdt import tile_memory
+
+FIXTURES_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'testdata')
+
+# Each fixture directory contains a manifest of command responses, the files
+# with their output and a fake root directory.
+FIXTURE_MANIFEST = 'commands.json'
+FIXTURE_OUTPUTS_DIRECTORY = 'outputs'
+FIXTURE_ROOT_DIRECTORY = 'root'
+
+# Fixtures whose RAID controller output is replaced with generated output for
+# synthetic chassis, by the type of the controller.
+SYNTHETIC_FIXTURE_BASES = {
+    'megacli': 'dell_r730xd',
+    'perccli': 'dell_r740xd',
+    'hpssacli': 'hp_apollo4200',
+}
+# Number of disks of synthetic chassis.
+SYNTHETIC_DISK_COUNTS = [24, 60, 90]
+# Controllers of synthetic chassis which also get a second adapter.
+SYNTHETIC_MULTI_ADAPTER_CONTROLLERS = ['megacli', 'perccli']
+
+# Number of disks per MegaCLI and PercCLI enclosure in generated output.
+_MEGACLI_DISKS_PER_ENCLOSURE = 30
+
+_MEGACLI_DISK_TEMPLATE = """Enclosure Device ID: %(enclosure)d
+Slot Number: %(slot)d
+Drive's position: DiskGroup: %(slot)d, Span: 0, Arm: 0
+Enclosure position: 1
+Device Id: %(device_id)d
+WWN: 5000C500%(device_id)08X
+Sequence Number: 2
+Media Error Count: %(media_errors)d
+Other Error Count: 0
+Predictive Failure Count: %(predictive_failures)d
+Last Predictive Failure Event Seq Number: 0
+PD Type: SAS
+
+Raw Size: 3.638 TB [0x1d1c0beb0 Sectors]
+Non Coerced Size: 3.637 TB [0x1d1b0beb0 Sectors]
+Coerced Size: 3.637 TB [0x1d1a94800 Sectors]
+Sector Size:  512
+Logical Sector Size:  512
+Physical Sector Size:  512
+Firmware state: %(firmware_state)s
+Commissioned Spare : No
+Emergency Spare : No
+Device Firmware Level: GS0F
+Shield Counter: 0
+Successful diagnostics completion on :  N/A
+SAS Address(0): 0x5000c500%(device_id)08x
+SAS Address(1): 0x0
+Connected Port Number: 0(path0)
+Inquiry Data: SEAGATE ST4000NM0023    GS0FZ1Z%(device_id)05d
+FDE Capable: Not Capable
+FDE Enable: Disable
+Secured: Unsecured
+Locked: Unlocked
+Needs EKM Attention: No
+Foreign State: None
+Device Speed: 6.0Gb/s
+Link Speed: 6.0Gb/s
+Media Type: Hard Disk Device
+Drive Temperature :%(temperature)dC (%(temperature_f).2f F)
+PI Eligibility:  No
+Drive is formatted for PI information:  No
+PI: No PI
+Port-0 :
+Port status: Active
+Port's Linkspeed: 6.0Gb/s
+Port-1 :
+Port status: Active
+Port's Linkspeed: 6.0Gb/s
+Drive has flagged a S.M.A.R.T alert : No
+
+
+
+"""
+
+_HPSSACLI_DISK_TEMPLATE = """      physicaldrive %(port)dI:1:%(bay)d
+         Port: %(port)dI
+         Box: 1
+         Bay: %(bay)d
+         Status: %(status)s
+         Drive Type: HBA Mode Drive
+         Interface Type: SAS
+         Size: 4000 GB
+         Drive exposed to OS: True
+         Logical/Physical Block Size: 512/512
+         Rotational Speed: 7200
+         Firmware Revision: HPD3
+         Serial Number: ZC10%(bay)04d
+         WWID: 5000C500%(bay)08X
+         Model: HP      MB4000JVYZQ
+         Current Temperature (C): %(temperature)d
+         Maximum Temperature (C): 41
+         PHY Count: 2
+         PHY Transfer Rate: 12.0Gbps, Unknown
+         Drive Authentication Status: OK
+         Carrier Application Version: 11
+         Carrier Bootloader Version: 6
+         Sanitize Erase Supported: False
+         Shingled Magnetic Recording Support: None
+
+"""
+
+
+class Error(Exception):
+  pass
+
+
+class Fixture(object):
+  """Sample command output and files of a machine.
+
+  Attributes:
+    name: Name of the fixture (str).
+    root_path: Path to the fake root directory (str).
+    runner: Runner answering commands with the sample output
+        (lib_commands.FakeCommandRunner).
+  """
+
+  def __init__(self, name, root_path, runner):
+    self.name = name
+    self.root_path = root_path
+    self.runner = runner
+
+  def GetPath(self, path):
+    """Get the location of an absolute path within the fake root."""
+    return os.path.join(self.root_path, path.lstrip('/'))
+
+  def GetCommandOutput(self, command):
+    """Get the sample output of a command (str)."""
+    return self.runner.Run(command).output
+
+
+def GetFixtureNames(fixtures_path=FIXTURES_PATH):
+  """Get names of all sample fixtures in testdata (list of str)."""
+  return sorted(
+      name for name in os.listdir(fixtures_path)
+      if os.path.isfile(os.path.join(fixtures_path, name, FIXTURE_MANIFEST)))
+
+
+def _GetTemplateOutput(template):
+  """Get a function expanding an output template for a matched command."""
+  return lambda match: match.expand(template)
+
+
+def LoadFixture(name, fixtures_path=FIXTURES_PATH):
+  """Load a sample fixture.
+
+  Fixtures hold representative output rather than captures from a machine,
+  i.e. dell_r740xd's PercCLI JSON and its /proc and /sys files are samples of
+  a PERC H740P chassis.
+
+  The manifest is a JSON list of responses, each with the following keys:
+    - command: Regular expression the whole command has to match (str).
+    - output: Name of the file in the outputs directory with the command's
+        output (str, optional).
+    - output_template: Output with backreferences to groups of the command
+        pattern, i.e. a disk slot (str, optional).
+    - exit_code: Exit code of the command (int, optional).
+    - timeout: Whether the command times out (bool, optional).
+    - passthrough: Whether the command is run for real, i.e. to read files
+        from the fake root (bool, optional).
+  The string '{root}' in command patterns is replaced with the path of the
+  fake root directory.
+
+  Args:
+    name: Name of the fixture (str).
+    fixtures_path: Directory containing all fixtures (str).
+
+  Raises:
+    Error: If the fixture can't be loaded.
+
+  Returns:
+    Fixture instance.
+  """
+  fixture_path = os.path.join(fixtures_path, name)
+  root_path = os.path.join(fixture_path, FIXTURE_ROOT_DIRECTORY)
+  try:
+    with open(os.path.join(fixture_path, FIXTURE_MANIFEST)) as manifest_file:
+      manifest = json.load(manifest_file)
+  except (IOError, ValueError) as error:
+    raise Error('Unable to load fixture %s: %s' % (name, error))
+
+  runner = lib_commands.FakeCommandRunner()
+  for response in manifest:
+    output = ''
+    if 'output' in response:
+      output_path = os.path.join(
+          fixture_path, FIXTURE_OUTPUTS_DIRECTORY, response['output'])
+      try:
+        with open(output_path) as output_file:
+          output = output_file.read()
+      except IOError as error:
+        raise Error('Unable to load fixture %s: %s' % (name, error))
+    elif 'output_template' in response:
+      output = _GetTemplateOutput(str(response['output_template']))
+    runner.AddResponse(
+        response['command'].replace('{root}', re.escape(root_path)),
+        output=output,
+        exit_code=response.get('exit_code', 0),
+        timeout=response.get('timeout', False),
+        passthrough=response.get('passthrough', False))
+  return Fixture(name=name, root_path=root_path, runner=runner)
+
+
+def GenerateMegaCliOutput(disk_count, adapter_count=1, failed_slots=()):
+  """Generate `MegaCli64 -PDList -aALL` output of a synthetic chassis.
+
+  Disks of each adapter are placed in enclosures of up to
+  _MEGACLI_DISKS_PER_ENCLOSURE disks.
+
+  Args:
+    disk_count: Number of disks on each adapter (int).
+    adapter_count: Number of RAID adapters (int).
+    failed_slots: Slots of failed disks on each adapter (list of int).
+
+  Returns:
+    MegaCLI output (str).
+  """
+  output = ['                                     ']
+  for adapter in range(adapter_count):
+    output.append('Adapter #%d\n' % adapter)
+    for disk in range(disk_count):
+      slot = disk % _MEGACLI_DISKS_PER_ENCLOSURE
+      temperature = 30 + disk % 8
+      fields = {
+          'enclosure': 32 + disk // _MEGACLI_DISKS_PER_ENCLOSURE,
+          'slot': slot,
+          'device_id': adapter * 1000 + disk,
+          'media_errors': 0,
+          'predictive_failures': 0,
+          'firmware_state': 'Online, Spun Up',
+          'temperature': temperature,
+          'temperature_f': temperature * 1.8 + 32,
+      }
+      if slot in failed_slots:
+        fields['media_errors'] = 12
+        fields['predictive_failures'] = 1
+        fields['firmware_state'] = 'Failed'
+      output.append(_MEGACLI_DISK_TEMPLATE % fields)
+  output.append('\nExit Code: 0x00\n')
+  return '\n'.join(output)
+
+
+def _GeneratePercCliDrive(adapter, disk, failed):
+  """Generate the table row and detailed information of a PercCLI drive.
+
+  Args:
+    adapter: Number of the controller (int).
+    disk: Number of the disk on the controller (int).
+    failed: Whether the disk has failed (bool).
+
+  Returns:
+    Tuple of the drive path, its table row and its detailed information.
+  """
+  enclosure = 32 + disk // _MEGACLI_DISKS_PER_ENCLOSURE
+  slot = disk % _MEGACLI_DISKS_PER_ENCLOSURE
+  device_id = adapter * 1000 + disk
+  temperature = 30 + disk % 8
+  drive_path = '/c%d/e%d/s%d' % (adapter, enclosure, slot)
+  summary = collections.OrderedDict([
+      ('EID:Slt', '%d:%d' % (enclosure, slot)),
+      ('DID', device_id),
+      ('State', 'UBad' if failed else 'Onln'),
+      ('DG', '-' if failed else 0),
+      ('Size', '3.637 TB'),
+      ('Intf', 'SAS'),
+      ('Med', 'HDD'),
+      ('SED', 'N'),
+      ('PI', 'N'),
+      ('SeSz', '512B'),
+      ('Model', 'ST4000NM0023    '),
+      ('Sp', 'U'),
+      ('Type', '-'),
+  ])
+  state = collections.OrderedDict([
+      ('Shield Counter', 0),
+      ('Media Error Count', 12 if failed else 0),
+      ('Other Error Count', 0),
+      ('Drive Temperature', '%3dC (%.2f F)' % (
+          temperature, temperature * 1.8 + 32)),
+      ('Predictive Failure Count', 1 if failed else 0),
+      ('S.M.A.R.T alert flagged by drive', 'Yes' if failed else 'No'),
+  ])
+  attributes = collections.OrderedDict([
+      ('SN', '        Z1Z%05d' % device_id),
+      ('Manufacturer Id', 'SEAGATE '),
+      ('Model Number', 'ST4000NM0023    '),
+      ('NAND Vendor', 'NA'),
+      ('WWN', '5000C500%08X' % device_id),
+      ('Firmware Revision', 'GS0F    '),
+      ('Raw size', '3.638 TB [0x1d1c0beb0 Sectors]'),
+      ('Coerced size', '3.637 TB [0x1d1a94800 Sectors]'),
+      ('Non Coerced size', '3.637 TB [0x1d1b0beb0 Sectors]'),
+      ('Device Speed', '6.0Gb/s'),
+      ('Link Speed', '6.0Gb/s'),
+      ('Write Cache', 'N/A'),
+      ('Logical Sector Size', '512B'),
+      ('Physical Sector Size', '512B'),
+      ('Connector Name', ''),
+  ])
+  details = collections.OrderedDict([
+      ('Drive %s State' % drive_path, state),
+      ('Drive %s Device attributes' % drive_path, attributes),
+      ('Drive %s Policies/Settings' % drive_path, collections.OrderedDict([
+          ('Drive position', 'DriveGroup:%d, Span:0, Row:0' % disk),
+          ('Enclosure position', '1'),
+          ('Connected Port Number', '0(path0) '),
+          ('Sequence Number', 2),
+          ('Commissioned Spare', 'No'),
+          ('Emergency Spare', 'No'),
+      ])),
+  ])
+  return drive_path, summary, details
+
+
+def GeneratePercCliOutput(disk_count, adapter_count=1, failed_slots=()):
+  """Generate `PercCli64 /call/eall/sall show all j` output.
+
+  Disks of each adapter are placed in enclosures of up to
+  _MEGACLI_DISKS_PER_ENCLOSURE disks.
+
+  Args:
+    disk_count: Number of disks on each adapter (int).
+    adapter_count: Number of RAID adapters (int).
+    failed_slots: Slots of failed disks on each adapter (list of int).
+
+  Returns:
+    PercCLI output (str).
+  """
+  controllers = []
+  for adapter in range(adapter_count):
+    response_data = collections.OrderedDict()
+    for disk in range(disk_count):
+      drive_path, summary, details = _GeneratePercCliDrive(
+          adapter, disk,
+          failed=disk % _MEGACLI_DISKS_PER_ENCLOSURE in failed_slots)
+      response_data['Drive %s' % drive_path] = [summary]
+      response_data['Drive %s - Detailed Information' % drive_path] = details
+    controllers.append(collections.OrderedDict([
+        ('Command Status', collections.OrderedDict([
+            ('CLI Version', '007.0127.0000.0000 Aug 25, 2019'),
+            ('Operating system', 'Linux 4.15.0'),
+            ('Controller', adapter),
+            ('Status', 'Success'),
+            ('Description', 'Show Drive Information Succeeded.'),
+        ])),
+        ('Response Data', response_data),
+    ]))
+  return json.dumps(
+      collections.OrderedDict([('Controllers', controllers)]),
+      indent=4, separators=(',', ' : ')) + '\n'
+
+
+def GenerateHpssacliOutput(disk_count, failed_bays=()):
+  """Generate `hpssacli controller slot=1 pd all show detail` output.
+
+  Args:
+    disk_count: Number of disks attached to the controller (int).
+    failed_bays: Bays of failed disks (list of int).
+
+  Returns:
+    hpssacli output (str).
+  """
+  output = [
+      '', 'Smart Array P440 in Slot 1 (HBA Mode)', '', '   HBA Drives', '']
+  for disk in range(disk_count):
+    bay = disk + 1
+    fields = {
+        'port': 1 + disk // 30,
+        'bay': bay,
+        'status': 'Failed' if bay in failed_bays else 'OK',
+        'temperature': 28 + disk % 8,
+    }
+    output.append(_HPSSACLI_DISK_TEMPLATE % fields)
+  return '\n'.join(output)
+
+
+def GetSyntheticFixture(controller, disk_count, failed_slots=(),
+                        adapter_count=1):
+  """Get a fixture of a synthetic chassis with a given number of disks.
+
+  Args:
+    controller: Type of the RAID controller, a key of SYNTHETIC_FIXTURE_BASES
+        (str).
+    disk_count: Number of disks on each adapter (int).
+    failed_slots: Slots or bays of failed disks (list of int).
+    adapter_count: Number of RAID adapters, only supported by MegaCLI and
+        PercCLI (int).
+
+  Returns:
+    Fixture instance.
+  """
+  fixture = LoadFixture(SYNTHETIC_FIXTURE_BASES[controller])
+  if adapter_count > 1:
+    fixture.name = '%s-%dx%ddisks' % (fixture.name, adapter_count, disk_count)
+  else:
+    fixture.name = '%s-%ddisks' % (fixture.name, disk_count)
+  if controller == 'megacli':
+    response = lib_commands.FakeCommandRunner.Response(
+        r'\S+ -PDList -aALL',
+        output=GenerateMegaCliOutput(
+            disk_count, adapter_count=adapter_count,
+            failed_slots=failed_slots))
+  elif controller == 'perccli':
+    response = lib_commands.FakeCommandRunner.Response(
+        r'\S+ /call/eall/sall show all j',
+        output=GeneratePercCliOutput(
+            disk_count, adapter_count=adapter_count,
+            failed_slots=failed_slots))
+  else:
+    response = lib_commands.FakeCommandRunner.Response(
+        r'\S+ controller slot=1 pd all show detail',
+        output=GenerateHpssacliOutput(disk_count, failed_bays=failed_slots))
+  # Responses are matched in order, the generated output takes precedence.
+  fixture.runner.responses.insert(0, response)
+  return fixture
+
+
+def GetAllFixtures():
+  """Get all sample fixtures followed by all synthetic ones.
+
+  None of them are captures from real machines, see LoadFixture().
+
+  Returns:
+    List of Fixture instances.
+  """
+  fixtures = [LoadFixture(name) for name in GetFixtureNames()]
+  for controller in sorted(SYNTHETIC_FIXTURE_BASES):
+    for disk_count in SYNTHETIC_DISK_COUNTS:
+      fixtures.append(GetSyntheticFixture(controller, disk_count))
+  # JBOD expansions behind a second adapter.
+  for controller in SYNTHETIC_MULTI_ADAPTER_CONTROLLERS:
+    fixtures.append(GetSyntheticFixture(
+        controller, SYNTHETIC_DISK_COUNTS[-1], adapter_count=2))
+  return fixtures
+
+
+@contextlib.contextmanager
+def UseFixture(fixture):
+  """Make all collectors use a fixture instead of the local machine.
+
+  Paths read directly by collectors, including locations of hardware tools,
+  are pointed at the fixture's fake root. State shared by tiles is replaced
+  with one using the fixture's runner. Tiles still have to be given the
+  fixture's runner. Everything is restored on exit.
+
+  Args:
+    fixture: Fixture instance.
+
+  Yields:
+    The fixture.
+  """
+  replaced_attributes = [
+      (lib_common, 'DMI_ID_PATH'),
+      (lib_common, 'PROC_UPTIME_PATH'),
+      (lib_ethtool, 'ETHTOOL_PATHS'),
+      (lib_hpssacli, 'HPSSACLI_PATH'),
+      (lib_interfaces, 'BANDAID_IMAGE_PATH'),
+      (lib_interfaces, 'PROC_NET_BONDING_PATH'),
+      (lib_interfaces, 'PROC_NET_DEV_PATH'),
+      (lib_interfaces, 'SYS_CLASS_NET_PATH'),
+      (lib_megacli, 'MEGACLI64_PATHS'),
+      (lib_megacli, 'MEGACLI_LEGACY_PATHS'),
+      (lib_megacli, 'MEGASAS_LOG_PATH'),
+      (lib_megacli, 'SMARTCTL_PATHS'),
+      (lib_perccli, 'PERCCLI_PATHS'),
+      (lib_tools, 'SYS_BUS_PCI_DEVICES_PATH'),
+      (tile_memory, 'PROC_MEMINFO_PATH'),
+  ]
+  saved_attributes = [
+      (module, attribute, getattr(module, attribute))
+      for module, attribute in replaced_attributes]
+
+  for module, attribute, value in saved_attributes:
+    if isinstance(value, list):
+      setattr(module, attribute, [fixture.GetPath(path) for path in value])
+    else:
+      setattr(module, attribute, fixture.GetPath(value))
+  lib_common.SetHostSnapshot(
+      lib_common.HostSnapshot(command_runner=fixture.runner, use_netlink=False))
+  lib_sensors.SetSensorSampler(
+      lib_sensors.SensorSampler(use_ipmi_session=False))
+  lib_ethtool.SetNicDetailsCollector(
+      lib_ethtool.NicDetailsCollector(use_ioctl=False))
+  lib_icmp.SetIcmpProber(lib_icmp.IcmpProber(use_sockets=False))
+  lib_megacli.SetSerialNumberCache(lib_megacli.SerialNumberCache())
+  lib_tools.SetToolRegistry(lib_tools.ToolRegistry())
+  try:
+    yield fixture
+  finally:
+    for module, attribute, value in saved_attributes:
+      setattr(module, attribute, value)
+    lib_common.SetHostSnapshot(None)
+    lib_sensors.SetSensorSampler(None)
+    lib_ethtool.SetNicDetailsCollector(None)
+    lib_icmp.SetIcmpProber(None)
+    lib_megacli.SetSerialNumberCache(None)
+    lib_tools.SetToolRegistry(None)
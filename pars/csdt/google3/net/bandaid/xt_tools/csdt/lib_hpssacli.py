@@ -8,11 +8,18 @@ from __future__ import print_function
 import logging
 
 from google3.net.bandaid.xt_tools.csdt import lib_commands
+from google3.net.bandaid.xt_tools.csdt import lib_disk_backends
 from google3.net.bandaid.xt_tools.csdt import lib_disk_parser
+from google3.net.bandaid.xt_tools.csdt import lib_tools
 
 
 HPSSACLI_PATH = '/export/hda3/bandaid/tools/hpssacli'
 
+# PCI vendor and device IDs of Smart Array controllers supported by hpssacli.
+HPSSACLI_PCI_IDS = [
+    (lib_disk_backends.PCI_VENDOR_HP, 0x3239),
+]
+
 
 class Error(lib_disk_parser.Error):
   """Module level exception."""
@@ -33,6 +40,9 @@ class Hpssacli(object):
     self.hpssacli_path = HPSSACLI_PATH
 
   def GetControllerInformation(self):
+    if not lib_tools.GetToolRegistry().FindExecutable([self.hpssacli_path]):
+      raise HpssacliExecutionError(
+          'Could not find hpssacli executable at: %s' % self.hpssacli_path)
     try:
       command = ('%s controller all show detail' % self.hpssacli_path)
       result = self.runner.Run(command)
@@ -75,3 +85,7 @@ class Hpssacli(object):
       disk_list = lib_disk_parser.HpParseDiskList(result.output)
       all_disks += disk_list
     return all_disks
+
+
+lib_disk_backends.RegisterDiskBackend(
+    'hpssacli', Hpssacli, pci_ids=HPSSACLI_PCI_IDS)
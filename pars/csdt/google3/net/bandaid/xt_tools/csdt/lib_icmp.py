@@ -0,0 +1,504 @@
+"""Console Status Display Tool ICMP echo library.
+
+Targets are probed with ICMP echo requests sent from this process, instead
+of running ping for each of them. Requests to all targets are sent at once
+and their replies are received from a single poll, so a refresh takes as
+long as the slowest target rather than the sum of all timeouts.
+
+Unprivileged ICMP datagram sockets are used if net.ipv4.ping_group_range
+allows them, and raw sockets otherwise, which requires running as root.
+
+Host names of targets are resolved in background threads and their addresses
+are kept for a while, so a slow resolver delays a refresh by at most
+RESOLVE_TIMEOUT.
+"""
+
+import collections
+import errno
+import logging
+import os
+import select
+import socket
+import struct
+import threading
+import time
+
+# ICMP message types, see RFC 792 and RFC 4443.
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+# Not defined by the socket module of all Python versions.
+IPPROTO_ICMPV6 = 58
+
+# Number of echo requests sent to each target per probe, their interval and
+# how long to wait for replies after the last one, as with
+# 'ping -c 2 -i 0.3 -W 2'.
+PROBE_COUNT = 2
+PROBE_INTERVAL = 0.3
+PROBE_TIMEOUT = 2.0
+
+# Seconds to wait for targets to be resolved, and for which their addresses
+# are kept. Targets which couldn't be resolved are tried again sooner.
+RESOLVE_TIMEOUT = 1.0
+RESOLVE_INTERVAL = 300
+RESOLVE_RETRY_INTERVAL = 60
+
+# Number of echo requests per target kept to compute latency trends.
+WINDOW_SIZE = 30
+
+# Payload of echo requests, of the size sent by ping.
+ECHO_PAYLOAD = '\0' * 56
+
+# Type, code, checksum, identifier and sequence number.
+_ICMP_ECHO = struct.Struct('!BBHHH')
+
+# Address families, ICMP protocols and echo types by IP version.
+_IP_VERSIONS = {
+    4: (socket.AF_INET, socket.IPPROTO_ICMP, ICMP_ECHO_REQUEST,
+        ICMP_ECHO_REPLY),
+    6: (socket.AF_INET6, IPPROTO_ICMPV6, ICMPV6_ECHO_REQUEST,
+        ICMPV6_ECHO_REPLY),
+}
+
+
+class Error(Exception):
+  pass
+
+
+def GetChecksum(data):
+  """Compute the Internet checksum of data, see RFC 1071 (int)."""
+  if len(data) % 2:
+    data += '\0'
+  checksum = sum(struct.unpack('!%dH' % (len(data) / 2), data))
+  checksum = (checksum >> 16) + (checksum & 0xffff)
+  checksum += checksum >> 16
+  return ~checksum & 0xffff
+
+
+def BuildEchoRequest(ip_version, identifier, sequence, payload=ECHO_PAYLOAD):
+  """Build an ICMP or ICMPv6 echo request.
+
+  The checksum of ICMPv6 messages is computed by the kernel, as it covers the
+  IPv6 pseudo-header.
+
+  Args:
+    ip_version: IP version, 4 or 6 (int).
+    identifier: Echo identifier (int).
+    sequence: Echo sequence number (int).
+    payload: Echo payload (str).
+
+  Returns:
+    The echo request (str).
+  """
+  unused_family, unused_protocol, request_type, unused_reply_type = (
+      _IP_VERSIONS[ip_version])
+  message = _ICMP_ECHO.pack(request_type, 0, 0, identifier, sequence) + payload
+  if ip_version == 4:
+    message = _ICMP_ECHO.pack(
+        request_type, 0, GetChecksum(message), identifier,
+        sequence) + payload
+  return message
+
+
+def ParseEchoReply(ip_version, data, has_ip_header=False):
+  """Parse an ICMP or ICMPv6 echo reply.
+
+  Args:
+    ip_version: IP version, 4 or 6 (int).
+    data: Received packet (str).
+    has_ip_header: Whether the packet starts with an IPv4 header, as received
+        from IPv4 raw sockets (bool).
+
+  Returns:
+    Tuple of the identifier and sequence number of the reply (int), or None
+    if the packet isn't an echo reply.
+  """
+  if has_ip_header and data:
+    data = data[(ord(data[0]) & 0x0f) * 4:]
+  if len(data) < _ICMP_ECHO.size:
+    return None
+  message_type, code, unused_checksum, identifier, sequence = (
+      _ICMP_ECHO.unpack_from(data))
+  if message_type != _IP_VERSIONS[ip_version][3] or code != 0:
+    return None
+  return identifier, sequence
+
+
+def _PackAddress(family, address):
+  """Pack an address returned by the socket module, without its scope."""
+  return socket.inet_pton(family, address.partition('%')[0])
+
+
+def GetWindowStatistics(window):
+  """Compute latency statistics of a window of echo requests.
+
+  Args:
+    window: Round-trip times of echo requests in seconds, None for those
+        which haven't been replied to (iterable of float).
+
+  Returns:
+    Dictionary of statistics, which are None if they can't be computed:
+      {
+          'probes': Number of echo requests in the window (int).
+          'loss': Fraction of echo requests without a reply (float).
+          'avg_rtt': Average round-trip time in seconds (float).
+          'jitter': Average difference between successive round-trip times
+              in seconds, see RFC 3550 (float).
+      }
+  """
+  window = list(window)
+  rtts = [rtt for rtt in window if rtt is not None]
+  statistics = {
+      'probes': len(window),
+      'loss': None,
+      'avg_rtt': None,
+      'jitter': None,
+  }
+  if window:
+    statistics['loss'] = 1 - len(rtts) / float(len(window))
+  if rtts:
+    statistics['avg_rtt'] = sum(rtts) / len(rtts)
+  if len(rtts) > 1:
+    statistics['jitter'] = sum(
+        abs(rtt - previous_rtt)
+        for previous_rtt, rtt in zip(rtts, rtts[1:])) / (len(rtts) - 1)
+  return statistics
+
+
+class IcmpProber(object):
+  """Probe targets with ICMP echo requests and keep latency trends.
+
+  Sockets are opened on first use and kept open between probes. Round-trip
+  times of the last WINDOW_SIZE echo requests to each target are kept, so
+  latency, jitter and loss can be followed across refreshes.
+
+  Attributes:
+    use_sockets: Whether ICMP sockets are used (bool). Callers are expected
+        to run ping instead when it's cleared, e.g. with sample fixtures.
+  """
+
+  def __init__(self, use_sockets=True, window_size=WINDOW_SIZE):
+    """Constructs an IcmpProber object.
+
+    Args:
+      use_sockets: Whether to use ICMP sockets, cleared when running with
+          sample fixtures (bool).
+      window_size: Number of echo requests per target to keep (int).
+    """
+    self.use_sockets = use_sockets
+    self.window_size = window_size
+    self.windows = {}
+    self.sockets = {}
+    self.identifier = os.getpid() & 0xffff
+    self.sequence = 0
+    self.lock = threading.Lock()
+    # Resolved addresses and the time they were resolved at, and threads
+    # resolving targets, by (target, interface, ip_version).
+    self.resolved_addresses = {}
+    self.resolving_threads = {}
+    self.resolve_lock = threading.Lock()
+
+  def _GetSocket(self, ip_version):
+    """Get the socket used for an IP version, opening it if needed.
+
+    Args:
+      ip_version: IP version, 4 or 6 (int).
+
+    Returns:
+      Tuple of the socket and whether it's a raw socket (bool).
+
+    Raises:
+      Error: If neither a datagram nor a raw ICMP socket can be opened.
+    """
+    if ip_version not in self.sockets:
+      family, protocol, unused_request_type, unused_reply_type = (
+          _IP_VERSIONS[ip_version])
+      try:
+        icmp_socket = socket.socket(family, socket.SOCK_DGRAM, protocol)
+        is_raw = False
+      except socket.error as e:
+        if e.errno not in [errno.EACCES, errno.EPERM, errno.EPROTONOSUPPORT]:
+          raise Error('Unable to open ICMP socket: %s' % e)
+        try:
+          icmp_socket = socket.socket(family, socket.SOCK_RAW, protocol)
+          is_raw = True
+        except socket.error as e:
+          raise Error('Unable to open ICMP socket, not running as root and '
+                      'not allowed by net.ipv4.ping_group_range: %s' % e)
+      icmp_socket.setblocking(False)
+      self.sockets[ip_version] = (icmp_socket, is_raw)
+    return self.sockets[ip_version]
+
+  @staticmethod
+  def _ResolveTarget(target, interface, ip_version):
+    """Resolve a target to a socket address.
+
+    Args:
+      target: Host name or address of the target (str).
+      interface: Interface to reach link-local IPv6 targets through (str),
+          or None.
+      ip_version: IP version, 4 or 6 (int).
+
+    Returns:
+      Socket address of the target (tuple), or None if it can't be resolved.
+    """
+    family = _IP_VERSIONS[ip_version][0]
+    host = target
+    if ip_version == 6 and interface and target.lower().startswith('fe80:'):
+      host = '%s%%%s' % (target, interface)
+    try:
+      return socket.getaddrinfo(host, None, family)[0][4]
+    except socket.error as e:
+      logging.error('Unable to resolve %s: %s', target, e)
+      return None
+
+  def _ResolveInBackground(self, target_key, resolved_timestamp):
+    """Resolve a target and keep its address, run in a thread."""
+    address = self._ResolveTarget(*target_key)
+    with self.resolve_lock:
+      self.resolved_addresses[target_key] = (address, resolved_timestamp)
+      del self.resolving_threads[target_key]
+
+  def _ResolveTargets(self, targets, timeout=RESOLVE_TIMEOUT):
+    """Resolve targets, reusing addresses which were resolved recently.
+
+    Targets are resolved in threads which are waited for up to timeout. A
+    target which takes longer keeps its previous address, if any, and gets the
+    new one once its thread finishes.
+
+    Args:
+      targets: List of (target, interface, ip_version) tuples.
+      timeout: Seconds to wait for targets to be resolved (float).
+
+    Returns:
+      List of socket addresses of the targets (tuple), None for those which
+      can't be resolved.
+    """
+    now = time.time()
+    threads = []
+    with self.resolve_lock:
+      for target_key in set(targets):
+        address, resolved_timestamp = self.resolved_addresses.get(
+            target_key, (None, None))
+        if resolved_timestamp is not None:
+          interval = RESOLVE_INTERVAL if address else RESOLVE_RETRY_INTERVAL
+          if now - resolved_timestamp < interval:
+            continue
+        thread = self.resolving_threads.get(target_key)
+        if thread is None:
+          thread = threading.Thread(
+              target=self._ResolveInBackground, args=(target_key, now))
+          # Resolving mustn't prevent exiting.
+          thread.daemon = True
+          self.resolving_threads[target_key] = thread
+          thread.start()
+        threads.append(thread)
+
+    deadline = now + timeout
+    for thread in threads:
+      thread.join(max(0, deadline - time.time()))
+
+    with self.resolve_lock:
+      # Targets which aren't probed anymore are dropped.
+      self.resolved_addresses = dict(
+          (target_key, self.resolved_addresses[target_key])
+          for target_key in targets if target_key in self.resolved_addresses)
+      addresses = []
+      for target_key in targets:
+        if target_key in self.resolving_threads:
+          logging.debug('Still resolving %s.', target_key[0])
+        addresses.append(
+            self.resolved_addresses.get(target_key, (None, None))[0])
+      return addresses
+
+  def _Send(self, ip_version, address):
+    """Send an echo request.
+
+    Args:
+      ip_version: IP version, 4 or 6 (int).
+      address: Socket address of the target (tuple).
+
+    Returns:
+      Sequence number of the request (int), or None if it couldn't be sent,
+      e.g. because there is no route to the target.
+    """
+    icmp_socket, unused_is_raw = self._GetSocket(ip_version)
+    self.sequence = (self.sequence + 1) & 0xffff
+    # Datagram sockets replace the identifier with their own.
+    message = BuildEchoRequest(ip_version, self.identifier, self.sequence)
+    try:
+      icmp_socket.sendto(message, address)
+    except socket.error as e:
+      logging.debug('Unable to send echo request to %s: %s', address[0], e)
+      return None
+    return self.sequence
+
+  def _Receive(self, ip_version):
+    """Receive all pending echo replies on the socket of an IP version.
+
+    Args:
+      ip_version: IP version, 4 or 6 (int).
+
+    Returns:
+      List of tuples of the packed source address and the sequence number of
+      each echo reply.
+    """
+    family = _IP_VERSIONS[ip_version][0]
+    icmp_socket, is_raw = self._GetSocket(ip_version)
+    replies = []
+    while True:
+      try:
+        data, address = icmp_socket.recvfrom(4096)
+      except socket.error as e:
+        if e.errno not in [errno.EAGAIN, errno.EWOULDBLOCK]:
+          logging.debug('Unable to receive echo reply: %s', e)
+        return replies
+      reply = ParseEchoReply(
+          ip_version, data, has_ip_header=is_raw and ip_version == 4)
+      if reply is None:
+        continue
+      identifier, sequence = reply
+      # Raw sockets receive the replies to all processes.
+      if is_raw and identifier != self.identifier:
+        continue
+      replies.append((_PackAddress(family, address[0]), sequence))
+
+  def Probe(self, targets, count=PROBE_COUNT, interval=PROBE_INTERVAL,
+            timeout=PROBE_TIMEOUT):
+    """Probe several targets at the same time.
+
+    Args:
+      targets: List of (target, interface, ip_version) tuples.
+      count: Number of echo requests to send to each target (int).
+      interval: Seconds between echo requests to the same target (float).
+      timeout: Seconds to wait for replies after the last echo requests
+          (float).
+
+    Raises:
+      Error: If an ICMP socket can't be opened.
+      ValueError: If an unsupported IP version is requested.
+
+    Returns:
+      List of dictionaries, one for each target:
+        {
+            'target': Target as requested (str).
+            'address': Resolved address, None if it can't be resolved within
+                RESOLVE_TIMEOUT (str).
+            'sent': Number of echo requests sent (int).
+            'received': Number of echo replies received (int).
+            'rtt': Average round-trip time of this probe in seconds, None if
+                there was no reply (float).
+            ...: Statistics over the window of the target, see
+                GetWindowStatistics().
+        }
+    """
+    targets = [tuple(target_key) for target_key in targets]
+    for unused_target, unused_interface, ip_version in targets:
+      if ip_version not in _IP_VERSIONS:
+        raise ValueError('Unsupported IP version.')
+
+    # Targets are resolved without holding the lock, as that may be slow.
+    addresses = self._ResolveTargets(targets)
+    with self.lock:
+      return self._Probe(targets, addresses, count, interval, timeout)
+
+  def _Probe(self, targets, addresses, count, interval, timeout):
+    """Probe several resolved targets, see Probe()."""
+    results = []
+    poller = select.poll()
+    polled_ip_versions = {}
+    for (target, unused_interface, ip_version), address in zip(
+        targets, addresses):
+      results.append({
+          'target': target,
+          'address': address[0] if address else None,
+          'sent': 0,
+          'received': 0,
+          'rtts': [],
+      })
+      if address:
+        icmp_socket, unused_is_raw = self._GetSocket(ip_version)
+        if icmp_socket.fileno() not in polled_ip_versions:
+          poller.register(icmp_socket, select.POLLIN)
+          polled_ip_versions[icmp_socket.fileno()] = ip_version
+
+    # Echo requests waiting for a reply, by IP version and sequence number.
+    pending = {}
+    start = time.time()
+    deadline = start + (count - 1) * interval + timeout
+    # There is nothing to wait for if no target could be resolved.
+    sent_count = 0 if any(addresses) else count
+    while True:
+      now = time.time()
+      if sent_count < count and now >= start + sent_count * interval:
+        for index, (unused_target, unused_interface, ip_version) in enumerate(
+            targets):
+          address = addresses[index]
+          if not address:
+            continue
+          results[index]['sent'] += 1
+          # Taken before sending, as sendto() itself takes part of the RTT.
+          sent = time.time()
+          sequence = self._Send(ip_version, address)
+          if sequence is not None:
+            family = _IP_VERSIONS[ip_version][0]
+            pending[(ip_version, sequence)] = (
+                index, _PackAddress(family, address[0]), sent)
+        sent_count += 1
+        continue
+
+      if (sent_count == count and not pending) or now >= deadline:
+        break
+      if sent_count < count:
+        wake_up = min(deadline, start + sent_count * interval)
+      else:
+        wake_up = deadline
+      for fd, unused_event in poller.poll(max(0, (wake_up - now) * 1000)):
+        ip_version = polled_ip_versions[fd]
+        received = time.time()
+        for packed_address, sequence in self._Receive(ip_version):
+          request = pending.get((ip_version, sequence))
+          # Ignore late replies to earlier probes and replies from elsewhere.
+          if request is None or request[1] != packed_address:
+            continue
+          index, unused_packed_address, sent = pending.pop(
+              (ip_version, sequence))
+          results[index]['received'] += 1
+          results[index]['rtts'].append(received - sent)
+
+    windows = {}
+    for result in results:
+      rtts = result.pop('rtts')
+      result['rtt'] = sum(rtts) / len(rtts) if rtts else None
+      window = self.windows.get(result['target'])
+      if window is None:
+        window = collections.deque(maxlen=self.window_size)
+      window.extend(rtts)
+      window.extend([None] * (result['sent'] - len(rtts)))
+      windows[result['target']] = window
+      result.update(GetWindowStatistics(window))
+    # Targets which aren't probed anymore, i.e. an old gateway, are dropped.
+    self.windows = windows
+    return results
+
+
+_icmp_prober = None
+_icmp_prober_lock = threading.Lock()
+
+
+def GetIcmpProber():
+  """Get the IcmpProber instance shared by all tiles."""
+  global _icmp_prober
+  with _icmp_prober_lock:
+    if _icmp_prober is None:
+      _icmp_prober = IcmpProber()
+    return _icmp_prober
+
+
+def SetIcmpProber(icmp_prober):
+  """Replace the IcmpProber instance shared by all tiles."""
+  global _icmp_prober
+  with _icmp_prober_lock:
+    _icmp_prober = icmp_prober
@@ -1,12 +1,36 @@
 """Console Status Display Tool network interface library."""
 
-import collections
-import glob
 import logging
 import os
 import re
+import time
 
-from google3.net.bandaid.xt_tools.csdt import lib_commands
+
+# Locations of network interface details, which may point to a fake root for
+# testing.
+BANDAID_IMAGE_PATH = '/.bandaid-image'
+PROC_NET_BONDING_PATH = '/proc/net/bonding'
+PROC_NET_DEV_PATH = '/proc/net/dev'
+SYS_CLASS_NET_PATH = '/sys/class/net'
+
+# Prefix of the links from a bonding master to its slaves in sysfs.
+SYSFS_LOWER_PREFIX = 'lower_'
+
+# Slaves whose link failed within this many seconds are flagged as flapping.
+BONDING_FLAP_WINDOW = 600
+
+# Interfaces whose statistics are collected.
+RE_STATISTICS_INTERFACE = re.compile(r'^(?:bond|eth)\d+$')
+
+# Counters in the columns of /proc/net/dev, named after the corresponding
+# files in /sys/class/net/*/statistics. Some columns sum up several of those,
+# i.e. rx_frame_errors also counts length, overrun and CRC errors.
+PROC_NET_DEV_COUNTERS = [
+    'rx_bytes', 'rx_packets', 'rx_errors', 'rx_dropped', 'rx_fifo_errors',
+    'rx_frame_errors', 'rx_compressed', 'multicast',
+    'tx_bytes', 'tx_packets', 'tx_errors', 'tx_dropped', 'tx_fifo_errors',
+    'collisions', 'tx_carrier_errors', 'tx_compressed',
+]
 
 
 class Error(Exception):
@@ -27,15 +51,12 @@ class BondingModuleHasMultipleMastersError(Error):
 
 def CheckIfInProdimage():
   """Check if we're running in the prodimage, vs the install environment."""
-  return os.path.isfile('/.bandaid-image')
+  return os.path.isfile(BANDAID_IMAGE_PATH)
 
 
-def GetBondingMasterFromMachine(command_runner):
+def GetBondingMasterFromMachine():
   """Get the active bonding master interface on a given machine.
 
-  Args:
-    command_runner: lib_commands.CommandRunner instance.
-
   Returns:
     Active bonding master interface (str). Examples:
       - "eth0" (GLAG in the prodimage)
@@ -48,14 +69,10 @@ def GetBondingMasterFromMachine(command_runner):
         active masters.
   """
   try:
-    command = 'ls -1 /proc/net/bonding'
-    result = command_runner.Run(command)
-    bonding_masters = result.output.strip().split()
-    if result.exit_code:
-      raise BondingModuleNotLoadedError(
-          'Unsupported machine state: bonding module not loaded')
-  except lib_commands.Error as e:
-    logging.exception(e)
+    bonding_masters = sorted(os.listdir(PROC_NET_BONDING_PATH))
+  except OSError:
+    raise BondingModuleNotLoadedError(
+        'Unsupported machine state: bonding module not loaded')
 
   if not bonding_masters:
     raise BondingModuleNotConfiguredError(
@@ -74,57 +91,29 @@ def GetBondingMasterFromMachine(command_runner):
   return bonding_masters[0]
 
 
-def GetBondingStateFromMachine(
-    command_runner, line_separator='\n', block_separator='\n\n',
+def ParseBondingState(
+    bonding_data, line_separator='\n', block_separator='\n\n',
     key_value_separator=': '):
-  """Get the current bonding state on a machine.
+  """Parse the bonding state from the content of /proc/net/bonding/<master>.
 
   Args:
-    command_runner: lib_commands.CommandRunner instance.
+    bonding_data: Content of /proc/net/bonding/<master> (str).
     line_separator: Line separator used in /proc/net/bonding (str).
     block_separator: Block separator used in /proc/net/bonding (str).
     key_value_separator: Key value separator used in /proc/net/bonding (str).
 
   Returns:
-    Dictionary containing the current bonding state. Example:
-      {
-          'mode': 'IEEE 802.3ad Dynamic link aggregation',
-          'master': 'eth0',
-          'slaves': {
-              'eth1': {
-                  'link_speed_mbps': 1000,
-                  ...
-              },
-              'eth2': {
-                  'link_speed_mbps': 1000,
-                  ...
-              },
-              ...
-          },
-          'active_members': ['eth1', 'eth2'],
-          'active_capacity_mbps': 2000,
-          ...
-      }
+    Dictionary containing the bonding state, see
+    GetBondingStateFromMachine(), without the master. Active members and
+    capacity are only present if they are reported by the bonding driver.
 
   Raises:
     ValueError: Unsupported value in /proc/net/bonding.
-      This should not happen and would indicate an unsupported format, typically
-      caused by a new kernel version. Please file a bug.
   """
-  bonding_master = GetBondingMasterFromMachine(command_runner=command_runner)
-
   bonding_state = {}
-  bonding_state['master'] = bonding_master
   bonding_state['slaves'] = {}
 
-  try:
-    with open(os.path.join('/proc/net/bonding', bonding_master)) as fh:
-      bonding_data = fh.read().strip()
-  except IOError:
-    logging.error('Unable to read bonding configuration.')
-    return bonding_state
-
-  for block in bonding_data.split(block_separator):
+  for block in bonding_data.strip().split(block_separator):
     block_header, unused_sep, block_data = block.partition(line_separator)
     block_header = block_header.strip()
 
@@ -194,6 +183,153 @@ def GetBondingStateFromMachine(
           slave_state['aggregator_id'] = int(value)
       bonding_state['slaves'][slave] = slave_state
 
+  return bonding_state
+
+
+def _ReadSysfsAttribute(path):
+  """Read an attribute of a network interface from sysfs.
+
+  Args:
+    path: Path of the attribute (str).
+
+  Returns:
+    Value of the attribute (str), or None if it can't be read. Some
+    attributes can't be read in some states, i.e. the speed of a down link.
+  """
+  try:
+    with open(path) as fh:
+      return fh.read().strip()
+  except (IOError, OSError):
+    return None
+
+
+def GetBondingSlavesFromSysfs(bonding_master):
+  """Get the state of the slaves of a bonding master from sysfs.
+
+  Slaves are found through the lower_* links of the master, and their state
+  is read from the attributes of each slave.
+
+  Args:
+    bonding_master: Name of the bonding master (str).
+
+  Returns:
+    Dictionary mapping slave names to their state, using the same keys as
+    GetBondingStateFromMachine() for the attributes which could be read, or
+    None if the bonding master isn't present in sysfs.
+  """
+  try:
+    entries = os.listdir(os.path.join(SYS_CLASS_NET_PATH, bonding_master))
+  except OSError:
+    return None
+
+  slaves = {}
+  for entry in entries:
+    if not entry.startswith(SYSFS_LOWER_PREFIX):
+      continue
+    slave = entry[len(SYSFS_LOWER_PREFIX):]
+    slave_path = os.path.join(SYS_CLASS_NET_PATH, slave)
+    slave_state = {}
+
+    value = _ReadSysfsAttribute(
+        os.path.join(slave_path, 'bonding_slave', 'mii_status'))
+    if value:
+      slave_state['mii_status'] = value.lower()
+    value = _ReadSysfsAttribute(
+        os.path.join(slave_path, 'bonding_slave', 'link_failure_count'))
+    if value and value.isdigit():
+      slave_state['link_flaps'] = int(value)
+    # Only present in 802.3ad mode.
+    value = _ReadSysfsAttribute(
+        os.path.join(slave_path, 'bonding_slave', 'ad_aggregator_id'))
+    if value and value.isdigit():
+      slave_state['aggregator_id'] = int(value)
+
+    value = _ReadSysfsAttribute(os.path.join(slave_path, 'speed'))
+    if value and value.lstrip('-').isdigit():
+      # Down interfaces report -1 (SPEED_UNKNOWN), or bogus speeds depending
+      # on the driver, see ParseBondingState().
+      link_speed_mbps = int(value)
+      if link_speed_mbps < 0 or link_speed_mbps in [65535, 4294967295]:
+        link_speed_mbps = 0
+      slave_state['link_speed_mbps'] = link_speed_mbps
+    value = _ReadSysfsAttribute(os.path.join(slave_path, 'duplex'))
+    if value:
+      slave_state['duplex'] = value.lower()
+
+    slaves[slave] = slave_state
+  return slaves
+
+
+def GetBondingStateFromMachine(
+    line_separator='\n', block_separator='\n\n', key_value_separator=': '):
+  """Get the current bonding state on a machine.
+
+  The LACP partner details are parsed from /proc/net/bonding, which is the
+  only place reporting them. Slave membership and link state are taken from
+  sysfs when available, since it is updated by the bonding driver directly.
+
+  Args:
+    line_separator: Line separator used in /proc/net/bonding (str).
+    block_separator: Block separator used in /proc/net/bonding (str).
+    key_value_separator: Key value separator used in /proc/net/bonding (str).
+
+  Returns:
+    Dictionary containing the current bonding state. Example:
+      {
+          'mode': 'IEEE 802.3ad Dynamic link aggregation',
+          'master': 'eth0',
+          'slaves': {
+              'eth1': {
+                  'link_speed_mbps': 1000,
+                  ...
+              },
+              'eth2': {
+                  'link_speed_mbps': 1000,
+                  ...
+              },
+              ...
+          },
+          'active_members': ['eth1', 'eth2'],
+          'active_capacity_mbps': 2000,
+          ...
+      }
+
+  Raises:
+    ValueError: Unsupported value in /proc/net/bonding.
+      This should not happen and would indicate an unsupported format, typically
+      caused by a new kernel version. Please file a bug.
+  """
+  bonding_master = GetBondingMasterFromMachine()
+
+  try:
+    with open(os.path.join(PROC_NET_BONDING_PATH, bonding_master)) as fh:
+      bonding_data = fh.read()
+  except IOError:
+    logging.error('Unable to read bonding configuration.')
+    bonding_data = ''
+
+  bonding_state = ParseBondingState(
+      bonding_data, line_separator=line_separator,
+      block_separator=block_separator,
+      key_value_separator=key_value_separator)
+  bonding_state['master'] = bonding_master
+
+  mii_status = _ReadSysfsAttribute(os.path.join(
+      SYS_CLASS_NET_PATH, bonding_master, 'bonding', 'mii_status'))
+  if mii_status:
+    bonding_state['mii_status'] = mii_status.lower()
+
+  # GLAG in the prodimage doesn't link its slaves in sysfs, in which case
+  # only /proc/net/bonding is used.
+  sysfs_slaves = GetBondingSlavesFromSysfs(bonding_master)
+  if sysfs_slaves:
+    slaves = {}
+    for slave, sysfs_slave_state in sysfs_slaves.iteritems():
+      slave_state = bonding_state['slaves'].get(slave, {})
+      slave_state.update(sysfs_slave_state)
+      slaves[slave] = slave_state
+    bonding_state['slaves'] = slaves
+
   # Upstream /proc/net/bonding/* (non-GLAG as found on the installer)
   # does not report active members. Derive using slave aggregator id.
   if bonding_state.get('active_members') is None:
@@ -220,14 +356,114 @@ def GetBondingStateFromMachine(
   return bonding_state
 
 
-def GetInterfaceStatisticsFromMachine(command_runner):
-  """Parse /sys/class/net/*/statistics and return interface statistics.
+class BondingStateCollector(object):
+  """Collect the bonding state and track link failures of its slaves.
+
+  Link failure counters are compared between successive collections, i.e.
+  between two refreshes of the tile owning the collector, so that slaves
+  whose link went down and came back up in between are flagged as flapping
+  even though they look healthy at the time of the refresh.
+  """
+
+  def __init__(self, flap_window=BONDING_FLAP_WINDOW):
+    self.flap_window = flap_window
+    self.link_failures = {}
+    self.recent_failures = {}
+
+  def Collect(self):
+    """Get the bonding state and compare link failures to the last one.
+
+    Returns:
+      Bonding state, see GetBondingStateFromMachine(). Slaves reporting their
+      link failure count have the following additional keys:
+        'link_flaps_delta': Link failures since the last collection, missing
+            on the first one and for new slaves (int).
+        'recent_link_flaps': Link failures seen within the flap window (int).
+        'flapping': Whether the link failed within the flap window (bool).
+
+    Raises:
+      Error: If the bonding state can't be determined, see
+          GetBondingMasterFromMachine().
+      ValueError: Unsupported value in /proc/net/bonding.
+    """
+    timestamp = time.time()
+    bonding_state = GetBondingStateFromMachine()
+
+    link_failures = {}
+    recent_failures = {}
+    for slave, slave_state in bonding_state['slaves'].iteritems():
+      link_flaps = slave_state.get('link_flaps')
+      if link_flaps is None:
+        continue
+      link_failures[slave] = link_flaps
+      failures = [
+          (failure_timestamp, count)
+          for failure_timestamp, count in self.recent_failures.get(slave, [])
+          if timestamp - failure_timestamp < self.flap_window]
+
+      previous_link_flaps = self.link_failures.get(slave)
+      if previous_link_flaps is not None:
+        # The counter starts from zero again when a slave is re-enslaved.
+        if link_flaps >= previous_link_flaps:
+          link_flaps_delta = link_flaps - previous_link_flaps
+        else:
+          link_flaps_delta = link_flaps
+        slave_state['link_flaps_delta'] = link_flaps_delta
+        if link_flaps_delta:
+          failures.append((timestamp, link_flaps_delta))
+
+      if failures:
+        recent_failures[slave] = failures
+      slave_state['recent_link_flaps'] = sum(
+          count for unused_timestamp, count in failures)
+      slave_state['flapping'] = bool(failures)
+
+    self.link_failures = link_failures
+    self.recent_failures = recent_failures
+    return bonding_state
+
+
+def ParseProcNetDev(content, interface_pattern=None):
+  """Parse interface statistics from the content of /proc/net/dev.
 
   Args:
-    command_runner: lib_commands.CommandRunner instance.
+    content: Content of /proc/net/dev (str).
+    interface_pattern: Compiled regular expression matching names of
+        interfaces to parse, or None to parse all of them.
+
+  Returns:
+    Dictionary mapping interface names to dictionaries of their counters, see
+    PROC_NET_DEV_COUNTERS.
+
+  Raises:
+    ValueError: Unsupported line in /proc/net/dev.
+  """
+  interface_stats = {}
+  # The first two lines are column headers.
+  for line in content.splitlines()[2:]:
+    interface, separator, counters = line.partition(':')
+    if not separator:
+      raise ValueError('Missing interface name: %r' % line)
+    interface = interface.strip()
+    if interface_pattern and not interface_pattern.match(interface):
+      continue
+    counters = counters.split()
+    if len(counters) != len(PROC_NET_DEV_COUNTERS):
+      raise ValueError('Unsupported number of counters: %r' % line)
+    interface_stats[interface] = dict(
+        zip(PROC_NET_DEV_COUNTERS, [int(value) for value in counters]))
+  return interface_stats
+
+
+def GetInterfaceStatisticsFromMachine():
+  """Read /proc/net/dev and return interface statistics.
+
+  All interfaces are read at once, so the cost doesn't grow with the number
+  of interfaces and their counters the way reading each counter from
+  /sys/class/net/*/statistics would.
 
   Returns:
-    Dictionary containing statistics for all interfaces:
+    Dictionary containing statistics for bonding and Ethernet interfaces:
       {
           'eth0': {'rx_bytes': 123, 'tx_bytes': 123, ...},
           'eth1': {'rx_bytes': 123, 'tx_bytes': 123, ...},
@@ -236,25 +472,64 @@ def GetInterfaceStatisticsFromMachine(command_runner):
       }
 
   Raises:
-    ValueError: Unsupported value in /sys/class/net/*/statistics.
+    Error: If /proc/net/dev can't be read.
+    ValueError: Unsupported value in /proc/net/dev.
       This should not happen and would indicate an unsupported format,
       typically caused by a new kernel version. Please file a bug.
   """
-  statistics_files = glob.glob('/sys/class/net/*/statistics')
-  command = r'grep -Hrx "[0-9]\+" %s' % ' '.join(statistics_files)
-  result = command_runner.Run(command)
-  interface_data = result.output.strip()
-  interface_stats = collections.defaultdict(dict)
-  for match in re.finditer(
-      r'^/sys/class/net/(?P<interface>(?:bond|eth)\d+)/statistics/'
-      r'(?P<key>.+):(?P<value>\d+)$', interface_data, re.MULTILINE):
-    interface = match.group('interface')
-
-    # b/33128065  prodimage has a bond0 device present even when bonding is not
-    # enabled; when it is enabled it is actually eth0.
-    if CheckIfInProdimage() and interface == 'bond0':
-      continue
-    key = match.group('key')
-    value = match.group('value')
-    interface_stats[interface][key] = int(value)
+  try:
+    with open(PROC_NET_DEV_PATH) as fh:
+      content = fh.read()
+  except IOError as e:
+    raise Error('Unable to read interface statistics: %s' % e)
+
+  interface_stats = ParseProcNetDev(
+      content, interface_pattern=RE_STATISTICS_INTERFACE)
+  # b/33128065  prodimage has a bond0 device present even when bonding is not
+  # enabled; when it is enabled it is actually eth0.
+  if CheckIfInProdimage():
+    interface_stats.pop('bond0', None)
   return interface_stats
+
+
+class InterfaceStatisticsSampler(object):
+  """Sample interface statistics and compute rates of their counters.
+
+  Rates are computed between successive samples, i.e. they are averaged over
+  the interval between two refreshes of the tile owning the sampler.
+  """
+
+  def __init__(self):
+    self.statistics = None
+    self.timestamp = None
+
+  def Sample(self):
+    """Read interface statistics and compute rates since the last sample.
+
+    Raises:
+      Error: If interface statistics can't be read.
+
+    Returns:
+      A tuple of the statistics, see GetInterfaceStatisticsFromMachine(), and
+      a dictionary with the same structure holding rates of the counters, in
+      units per second (float). Rates are missing on the first sample, for
+      new interfaces and for counters which have been reset.
+    """
+    timestamp = time.time()
+    statistics = GetInterfaceStatisticsFromMachine()
+    rates = {}
+    if self.statistics is not None and timestamp > self.timestamp:
+      seconds = timestamp - self.timestamp
+      for interface, counters in statistics.iteritems():
+        previous_counters = self.statistics.get(interface)
+        if previous_counters is None:
+          continue
+        interface_rates = {}
+        for key, value in counters.iteritems():
+          previous_value = previous_counters.get(key)
+          if previous_value is not None and value >= previous_value:
+            interface_rates[key] = (value - previous_value) / seconds
+        rates[interface] = interface_rates
+    self.statistics = statistics
+    self.timestamp = timestamp
+    return statistics, rates
@@ -0,0 +1,315 @@
+"""Console Status Display Tool persistent ipmitool session library."""
+
+import errno
+import fcntl
+import logging
+import os
+import select
+import signal
+import stat
+import subprocess
+import threading
+import time
+
+from google3.net.bandaid.xt_tools.csdt import lib_commands
+from google3.net.bandaid.xt_tools.csdt import lib_stats
+
+PATH_IPMITOOL = '/usr/bin/ipmitool'
+
+# Local copy of the BMC's SDR repository, so that ipmitool doesn't have to
+# read it from the BMC every time the session is (re)started. It's kept in a
+# directory only writable by the owner, since the sensors tile trusts it.
+SDR_CACHE_DIRECTORY = '/var/cache/csdt'
+SDR_CACHE_PATH = os.path.join(SDR_CACHE_DIRECTORY, 'sdr_cache')
+# The SDR repository only changes with BMC firmware or hardware changes.
+SDR_CACHE_MAX_AGE = 24 * 60 * 60
+
+# Prompt printed by `ipmitool shell` once it's ready to accept a command.
+SHELL_PROMPT = 'ipmitool> '
+
+# Default number of seconds a single command is allowed to take.
+DEFAULT_COMMAND_TIMEOUT = 30
+
+
+class Error(Exception):
+  pass
+
+
+class SessionError(Error):
+  """Error occurred while communicating with the ipmitool shell."""
+  pass
+
+
+class Timeout(Error):
+  """ipmitool shell didn't complete a command in time."""
+  pass
+
+
+class IpmiSession(object):
+  """Long-lived `ipmitool shell` session used to run ipmitool commands.
+
+  Starting ipmitool opens the BMC interface and reads the SDR repository each
+  time, which is the most expensive part of reading sensors. A single session
+  is kept running instead and fed commands over a pipe. The session is
+  restarted automatically if it exits or fails to respond in time.
+
+  Attributes:
+    commands: Number of commands run in the session (int).
+    restarts: Number of times the session had to be started (int).
+  """
+
+  def __init__(self, ipmitool_path=PATH_IPMITOOL,
+               sdr_cache_path=SDR_CACHE_PATH, command_runner=None):
+    """Constructs an IpmiSession object.
+
+    Args:
+      ipmitool_path: Path to the ipmitool binary (str).
+      sdr_cache_path: Path to the local SDR repository dump or None to always
+          read it from the BMC (str).
+      command_runner: Instance of lib_commands.CommandRunner().
+    """
+    self.ipmitool_path = ipmitool_path
+    self.sdr_cache_path = sdr_cache_path
+    self.runner = command_runner or lib_commands.CommandRunner()
+    self.commands = 0
+    self.restarts = 0
+    self._process = None
+    self._lock = threading.Lock()
+
+  def _CheckSdrCacheDirectory(self):
+    """Create the directory of the SDR repository dump if needed.
+
+    Returns:
+      Whether the directory is owned by this user and not accessible to any
+      other, so that nobody else can replace the dump (bool).
+    """
+    directory = os.path.dirname(self.sdr_cache_path)
+    try:
+      os.mkdir(directory, 0o700)
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        logging.warning('Unable to create SDR cache directory: %s', e)
+        return False
+    try:
+      directory_stat = os.lstat(directory)
+    except OSError as e:
+      logging.warning('Unable to check SDR cache directory: %s', e)
+      return False
+    if (not stat.S_ISDIR(directory_stat.st_mode) or
+        directory_stat.st_uid != os.geteuid() or
+        directory_stat.st_mode & 0o077):
+      logging.warning('Not using SDR cache directory %s: not a directory '
+                      'private to this user.', directory)
+      return False
+    return True
+
+  def _IsSdrCacheRecent(self):
+    """Check whether a recent SDR repository dump exists and can be trusted.
+
+    Returns:
+      Whether the dump is a regular file owned by this user, not writable by
+      others and younger than SDR_CACHE_MAX_AGE (bool).
+    """
+    try:
+      fd = os.open(self.sdr_cache_path, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        logging.warning('Not using SDR cache %s: %s', self.sdr_cache_path, e)
+      return False
+    try:
+      cache_stat = os.fstat(fd)
+    finally:
+      os.close(fd)
+    if (not stat.S_ISREG(cache_stat.st_mode) or
+        cache_stat.st_uid != os.geteuid() or cache_stat.st_mode & 0o022):
+      logging.warning('Not using SDR cache %s: not a regular file private to '
+                      'this user.', self.sdr_cache_path)
+      return False
+    return time.time() - cache_stat.st_mtime < SDR_CACHE_MAX_AGE
+
+  def _EnsureSdrCache(self):
+    """Dump the SDR repository to a local file unless a recent dump exists.
+
+    Returns:
+      Path to the SDR repository dump (str) or None if it's unavailable.
+    """
+    if not self.sdr_cache_path or not self._CheckSdrCacheDirectory():
+      return None
+    if self._IsSdrCacheRecent():
+      return self.sdr_cache_path
+
+    # Remove stale or untrusted dumps, without following symlinks.
+    try:
+      os.unlink(self.sdr_cache_path)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        logging.warning('Unable to remove SDR cache: %s', e)
+        return None
+
+    command = '%s sdr dump %s' % (self.ipmitool_path, self.sdr_cache_path)
+    try:
+      result = self.runner.Run(command)
+    except lib_commands.Error:
+      logging.warning('Timed out dumping the SDR repository.')
+      return None
+    if result.exit_code:
+      logging.warning('Unable to dump the SDR repository:\n%s', result.output)
+      return None
+    if not self._IsSdrCacheRecent():
+      return None
+    logging.info('Dumped the SDR repository to %s.', self.sdr_cache_path)
+    return self.sdr_cache_path
+
+  def _Start(self, timeout):
+    """Start the ipmitool shell and wait for its first prompt.
+
+    Args:
+      timeout: Maximum time to wait for the shell to start (float, seconds).
+
+    Raises:
+      SessionError: If the shell couldn't be started.
+      Timeout: If the shell didn't show a prompt in time.
+    """
+    if not os.access(self.ipmitool_path, os.X_OK):
+      raise SessionError('Missing ipmitool binary: %s' % self.ipmitool_path)
+
+    args = [self.ipmitool_path]
+    sdr_cache_path = self._EnsureSdrCache()
+    if sdr_cache_path:
+      args.extend(['-S', sdr_cache_path])
+    args.append('shell')
+
+    logging.info('Starting ipmitool session: %s', ' '.join(args))
+    try:
+      # Run the session in its own process group, so that it can be killed
+      # along with any children and doesn't receive signals sent to CSDT.
+      self._process = lib_commands.PopenInNewSession(
+          args=args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+          stderr=subprocess.STDOUT, close_fds=True)
+    except OSError as error:
+      raise SessionError('Unable to start ipmitool shell: %s' % error)
+    self.restarts += 1
+
+    stdout_fd = self._process.stdout.fileno()
+    flags = fcntl.fcntl(stdout_fd, fcntl.F_GETFL)
+    fcntl.fcntl(stdout_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    self._ReadUntilPrompt(timeout=timeout)
+
+  def _Stop(self):
+    """Kill the ipmitool shell, if running."""
+    if not self._process:
+      return
+    logging.debug('Stopping ipmitool session (PID %d).', self._process.pid)
+    try:
+      os.killpg(self._process.pid, signal.SIGKILL)
+    except OSError as error:
+      if error.errno != errno.ESRCH:
+        raise
+    self._process.wait()
+    self._process.stdin.close()
+    self._process.stdout.close()
+    self._process = None
+
+  def _ReadUntilPrompt(self, timeout):
+    """Read the shell output up to the next prompt.
+
+    Args:
+      timeout: Maximum time to wait for the prompt (float, seconds).
+
+    Raises:
+      SessionError: If the shell exited.
+      Timeout: If the prompt wasn't shown in time.
+
+    Returns:
+      Output preceding the prompt (str).
+    """
+    stdout_fd = self._process.stdout.fileno()
+    deadline = time.time() + timeout
+    chunks = []
+    while 1:
+      seconds_left = deadline - time.time()
+      if seconds_left <= 0:
+        raise Timeout('ipmitool shell did not respond in %s seconds.' % timeout)
+      readable_fds, _, _ = select.select([stdout_fd], [], [], seconds_left)
+      if not readable_fds:
+        continue
+      chunk = os.read(stdout_fd, 65536)
+      if not chunk:
+        raise SessionError('ipmitool shell exited unexpectedly.')
+      chunks.append(chunk)
+      output = ''.join(chunks)
+      if output.endswith(SHELL_PROMPT):
+        return output[:-len(SHELL_PROMPT)]
+
+  def Run(self, command, timeout=DEFAULT_COMMAND_TIMEOUT):
+    """Run an ipmitool command in the session, starting it if necessary.
+
+    Args:
+      command: ipmitool command without the binary path, e.g. 'sdr elist'
+          (str).
+      timeout: Maximum time the command is allowed to take (float, seconds).
+
+    Raises:
+      SessionError: If the command couldn't be run in the session.
+      Timeout: If the command didn't complete in time. The session is killed
+          and will be restarted by the next call.
+
+    Returns:
+      Output of the command (str).
+    """
+    collector_statistics = lib_stats.GetCollectorStatistics()
+    statistics_command = '%s shell: %s' % (self.ipmitool_path, command)
+    start_timestamp = time.time()
+    with self._lock:
+      # A session which has exited since the last command is restarted once.
+      for attempt in range(2):
+        try:
+          if not self._process or self._process.poll() is not None:
+            self._Stop()
+            self._Start(timeout=timeout)
+          self._process.stdin.write(command + '\n')
+          self._process.stdin.flush()
+          output = self._ReadUntilPrompt(timeout=timeout)
+          break
+        except Timeout:
+          logging.warning('ipmitool session timed out running: %s', command)
+          self._Stop()
+          collector_statistics.RecordCommand(
+              statistics_command, seconds=time.time() - start_timestamp,
+              timed_out=True)
+          raise
+        except (IOError, OSError, SessionError) as error:
+          logging.warning('ipmitool session failed running %s: %s',
+                          command, error)
+          self._Stop()
+          if attempt:
+            raise SessionError(error)
+      self.commands += 1
+    collector_statistics.RecordCommand(
+        statistics_command, seconds=time.time() - start_timestamp,
+        output_bytes=len(output))
+
+    # Shells using readline echo the command back when not run on a terminal.
+    first_line, _, remaining_output = output.partition('\n')
+    if first_line.strip() == command:
+      output = remaining_output
+    return output
+
+  def Close(self):
+    """Terminate the session."""
+    with self._lock:
+      self._Stop()
+
+
+_ipmi_session = None
+_ipmi_session_lock = threading.Lock()
+
+
+def GetIpmiSession():
+  """Get the IpmiSession instance shared by all IPMI consumers."""
+  global _ipmi_session
+  with _ipmi_session_lock:
+    if _ipmi_session is None:
+      _ipmi_session = IpmiSession()
+    return _ipmi_session
@@ -1,9 +1,14 @@
 """Console Status Display Tool megacli library."""
 
+import errno
 import logging
+import os
+import threading
 
 from google3.net.bandaid.xt_tools.csdt import lib_commands
+from google3.net.bandaid.xt_tools.csdt import lib_disk_backends
 from google3.net.bandaid.xt_tools.csdt import lib_disk_parser
+from google3.net.bandaid.xt_tools.csdt import lib_tools
 
 
 MEGACLI_LEGACY_PATHS = [
@@ -19,6 +24,33 @@ SMARTCTL_PATHS = [
     '/usr/sbin/smartctl',
 ]
 
+# PCI vendor and device IDs of PERC controllers supported by MegaCLI: H710
+# Mini, H730 Mini, H330 Mini, 6/i, H310 Mini and H700.
+MEGACLI_PCI_IDS = [
+    (lib_disk_backends.PCI_VENDOR_LSI, 0x005b),
+    (lib_disk_backends.PCI_VENDOR_LSI, 0x005d),
+    (lib_disk_backends.PCI_VENDOR_LSI, 0x005f),
+    (lib_disk_backends.PCI_VENDOR_LSI, 0x0060),
+    (lib_disk_backends.PCI_VENDOR_LSI, 0x0073),
+    (lib_disk_backends.PCI_VENDOR_LSI, 0x0079),
+]
+
+# Log file MegaCLI leaves in its working directory.
+MEGASAS_LOG_PATH = 'MegaSAS.log'
+
+# Names of PERC models as shown by lspci, keyed by their PCI vendor, device,
+# subsystem vendor and subsystem device IDs. Other RAID controllers are named
+# after their IDs.
+PERC_MODELS = {
+    (0x1000, 0x0060, 0x1028, 0x1f0a): 'PERC 6/E Adapter RAID Controller',
+    (0x1000, 0x0060, 0x1028, 0x1f0b): 'PERC 6/i Adapter RAID Controller',
+    (0x1000, 0x0060, 0x1028, 0x1f0c): 'PERC 6/i Integrated RAID Controller',
+    (0x1000, 0x005d, 0x1028, 0x1f47): 'PERC H730P Mini',
+}
+
+# Maximum number of smartctl commands querying the controller at once.
+MAX_PARALLEL_SMARTCTL = 4
+
 
 class Error(lib_disk_parser.Error):
   """Module level exception."""
@@ -45,6 +77,63 @@ class MegaCLIExecutionError(Error):
   pass
 
 
+class SerialNumberCache(object):
+  """Cache serial numbers of disks read with smartctl.
+
+  Serial numbers are keyed by the adapter, enclosure, slot, inquiry string and
+  number of sectors reported by MegaCLI, so a disk is only queried again when a
+  different disk is inserted into its slot. All methods are thread-safe.
+  """
+
+  def __init__(self):
+    self._serial_numbers = {}
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def GetKey(disk):
+    """Get the cache key of a disk parsed from MegaCLI output (tuple)."""
+    return (disk['adapter'], disk['enclosure'], disk['slot'], disk['inquiry'],
+            disk['sectors'])
+
+  def Get(self, disk):
+    """Get the cached serial number of a disk, or None if it isn't cached."""
+    with self._lock:
+      return self._serial_numbers.get(SerialNumberCache.GetKey(disk))
+
+  def Update(self, disks, serial_numbers):
+    """Replace cached serial numbers with those of the disks present.
+
+    Args:
+      disks: All disks parsed from MegaCLI output (list of dict).
+      serial_numbers: Serial numbers of the disks, None if unknown (list).
+    """
+    with self._lock:
+      self._serial_numbers = dict(
+          (SerialNumberCache.GetKey(disk), serial_number)
+          for disk, serial_number in zip(disks, serial_numbers)
+          if serial_number)
+
+
+_serial_number_cache = None
+_serial_number_cache_lock = threading.Lock()
+
+
+def GetSerialNumberCache():
+  """Get the SerialNumberCache instance shared by all MegaCLI instances."""
+  global _serial_number_cache
+  with _serial_number_cache_lock:
+    if _serial_number_cache is None:
+      _serial_number_cache = SerialNumberCache()
+    return _serial_number_cache
+
+
+def SetSerialNumberCache(serial_number_cache):
+  """Replace the shared SerialNumberCache instance, i.e. in tests."""
+  global _serial_number_cache
+  with _serial_number_cache_lock:
+    _serial_number_cache = serial_number_cache
+
+
 class MegaCLI(object):
   """MegaCLI interface for accessing the Dell MegaCLI binary.
 
@@ -61,9 +150,6 @@ class MegaCLI(object):
     self.megacli_path = None
     self.megacli_version = None
     self.smartctl_path = None
-    self._known_megacli_64_path = None
-    self._known_legacy_megacli_path = None
-    self._known_smartctl_path = None
     self.megacli_legacy_path = MEGACLI_LEGACY_PATHS
     self.megacli_64_path = MEGACLI64_PATHS
     self.smartctl_paths = SMARTCTL_PATHS
@@ -72,6 +158,9 @@ class MegaCLI(object):
     """Gets list of dictionaries containing disk information.
 
     Each dictionary will contain the following keys:
+      - adapter: the number of the adapter the disk is attached to (int).
+      - enclosure: the ID of the enclosure the disk is in (int, or None if the
+        disk isn't in an enclosure).
       - slot: the number of the disk slot in which this disk is in (int).
       - scsi_lun: SCSI LUN of a physical disk. If multiple disks are part of a
         RAID group, they will all have the same SCSI LUN (int if MegaCLI64 is
@@ -94,7 +183,7 @@ class MegaCLI(object):
 
 
     The order of the dictionaries is based on the output of MegaCLI. The output
-    is ordered by slot number.
+    is ordered by adapter, enclosure and slot number.
 
     Raises:
       MegaCLIExecutionError: If an error occurs while executing MegaCLI.
@@ -107,20 +196,98 @@ class MegaCLI(object):
       if not self.megacli_path:
         self.megacli_path = self.GetMegaCLIPath()
       command = '%s -PDList -aALL' % self.megacli_path
-      result = self.runner.Run(command)
-      disk_list = lib_disk_parser.MegaCliParseDiskList(result.output)
+      disk_list = list(lib_disk_parser.MegaCliIterDiskList(
+          self.runner.RunStreaming(command)))
       if not disk_list:
         raise lib_disk_parser.MegaCLIOutputParseError(
             'No disk information found.')
       self._DeleteMegasasLog()
-      for disk in disk_list:
-        disk['serial_number'] = self.GetDiskSerialNumberFromSmartctl(
-            disk['slot'])
+      self._AddDiskSerialNumbers(disk_list)
       return disk_list
     except lib_commands.Error as e:
       logging.exception(e)
       raise MegaCLIExecutionError(e)
 
+  def _AddDiskSerialNumbers(self, disk_list):
+    """Add serial numbers to disks, querying only disks which aren't cached.
+
+    Args:
+      disk_list: Disks parsed from MegaCLI output (list of dict). The
+          'serial_number' key of each disk is set to its serial number (str)
+          or None if not available.
+    """
+    serial_number_cache = GetSerialNumberCache()
+    uncached_disks = []
+    for disk in disk_list:
+      disk['serial_number'] = serial_number_cache.Get(disk)
+      # smartctl is only pointed at the first adapter's bus.
+      if not disk['serial_number'] and disk['adapter'] == 0:
+        uncached_disks.append(disk)
+
+    if uncached_disks:
+      logging.debug('Querying serial numbers of %d disks.', len(uncached_disks))
+      serial_numbers = self.GetDiskSerialNumbersFromSmartctl(
+          [disk['slot'] for disk in uncached_disks])
+      for disk, serial_number in zip(uncached_disks, serial_numbers):
+        disk['serial_number'] = serial_number
+    serial_number_cache.Update(
+        disk_list, [disk['serial_number'] for disk in disk_list])
+
+  def _GetSmartctlCommand(self, slot):
+    """Get the command reading S.M.A.R.T. details of a disk (str)."""
+    return '%s /dev/bus/0 -d megaraid,%s -i' % (self.smartctl_path, str(slot))
+
+  def GetDiskSerialNumbersFromSmartctl(self, slots):
+    """Get serial numbers of several disks from S.M.A.R.T. at once.
+
+    At most MAX_PARALLEL_SMARTCTL smartctl commands are run at the same time.
+
+    Args:
+      slots: physical disk slot numbers (list of int).
+
+    Returns:
+      Disk serial numbers in the order of slots (list of str or None if not
+      available).
+    """
+    if not self.smartctl_path:
+      try:
+        self.smartctl_path = self.GetSmartctlPath()
+      except FindSmartctlError:
+        return [None] * len(slots)
+
+    pending_commands = []
+    serial_numbers = []
+    for slot in slots:
+      # Wait for the oldest command to make room for the next one.
+      if len(pending_commands) >= MAX_PARALLEL_SMARTCTL:
+        serial_numbers.append(
+            self._WaitForSerialNumber(*pending_commands.pop(0)))
+      command = self._GetSmartctlCommand(slot)
+      logging.debug(command)
+      pending_commands.append((slot, self.runner.Start(command)))
+    for slot, pending_command in pending_commands:
+      serial_numbers.append(self._WaitForSerialNumber(slot, pending_command))
+    return serial_numbers
+
+  def _WaitForSerialNumber(self, slot, pending_command):
+    """Wait for a smartctl command started by GetDiskSerialNumbersFromSmartctl.
+
+    Args:
+      slot: physical disk slot number (int).
+      pending_command: The started smartctl command, see
+          lib_commands.AsyncCommandRunner.Start().
+
+    Returns:
+      Disk serial number (str) or None if not available.
+    """
+    self.runner.Wait([pending_command])
+    try:
+      result = pending_command.GetResult()
+    except lib_commands.Error:
+      logging.warning('Error getting serial number of a disk in slot %d.', slot)
+      return None
+    return self._ParseSerialNumber(slot, result)
+
   def GetDiskSerialNumberFromSmartctl(self, slot):
     """Get disk serial number from S.M.A.R.T.
 
@@ -139,15 +306,26 @@ class MegaCLI(object):
         self.smartctl_path = self.GetSmartctlPath()
       except FindSmartctlError:
         return None
-    command = '%s /dev/bus/0 -d megaraid,%s -i' % (
-        self.smartctl_path, str(slot))
+    command = self._GetSmartctlCommand(slot)
     try:
       logging.debug(command)
       result = self.runner.Run(command)
     except lib_commands.Error:
       logging.warning('Error getting serial number of a disk in slot %d.', slot)
       return None
+    return self._ParseSerialNumber(slot, result)
+
+  def _ParseSerialNumber(self, slot, result):
+    """Parse the serial number of a disk from smartctl output.
+
+    Args:
+      slot: physical disk slot number (int).
+      result: Result of the smartctl command
+          (lib_commands.CommandRunner.Result).
 
+    Returns:
+      Disk serial number (str) or None if not available.
+    """
     for line in result.output.splitlines():
       fields = line.split(':')
       if fields[0].strip().lower() == 'serial number':
@@ -156,6 +334,39 @@ class MegaCLI(object):
     return None
 
   def GetPercModels(self):
+    """Gets the Perc Model(s) on the machine.
+
+    RAID controllers are read from sysfs, falling back to lspci if sysfs isn't
+    available.
+
+    Raises:
+        lib_commands.Error: Error while executing LSPCI.
+        lib_disk_parser.ParsingError: Error while parsing MegaCLI output.
+
+    Returns:
+        List of strings describing the Perc Models of the current machine,
+        empty if there are no RAID controllers.
+    """
+    try:
+      pci_devices = lib_tools.GetToolRegistry().GetPciDevices()
+    except lib_tools.Error as e:
+      logging.warning('%s, using lspci instead.', e)
+      return self._GetPercModelsFromLspci()
+
+    perc_models = []
+    for pci_device in pci_devices:
+      if pci_device.class_code != lib_tools.PCI_CLASS_RAID_CONTROLLER:
+        continue
+      perc_model = PERC_MODELS.get(
+          pci_device.GetIds(),
+          'RAID controller %04x:%04x (subsystem %04x:%04x)' %
+          pci_device.GetIds())
+      logging.debug('Perc Model found: %s', perc_model)
+      perc_models.append(perc_model)
+
+    return perc_models
+
+  def _GetPercModelsFromLspci(self):
     """Gets the Perc Model(s) on the machine by running lspci.
 
     Raises:
@@ -246,17 +457,10 @@ class MegaCLI(object):
       String: path to Legacy MegaCLI binary.
 
     """
-    if self._known_legacy_megacli_path:
-      logging.debug('We have a known good legacy MegaCLI path: %s',
-                    self._known_legacy_megacli_path)
-      return self._known_legacy_megacli_path
-
-    for path in self.megacli_legacy_path:
-      if self._CheckFileExists(path):
-        logging.debug('Using Legacy MegaCLI found at %s', path)
-        self._known_legacy_megacli_path = path
-        return path
-      logging.warning('Legacy MegaCLI not found at %s', path)
+    path = lib_tools.GetToolRegistry().FindExecutable(self.megacli_legacy_path)
+    if path:
+      logging.debug('Using Legacy MegaCLI found at %s', path)
+      return path
 
     error_message = 'Could not find any legacy MegaCLI executable: %s' % (
         self.megacli_legacy_path)
@@ -276,17 +480,10 @@ class MegaCLI(object):
       String: path to MegaCLI64 binary.
 
     """
-    if self._known_megacli_64_path:
-      logging.debug('We have a known good MegaCLI 64 path: %s',
-                    self._known_megacli_64_path)
-      return self._known_megacli_64_path
-
-    for path in self.megacli_64_path:
-      if self._CheckFileExists(path):
-        logging.debug('Using MegaCLI64 found at %s', path)
-        self._known_megacli_64_path = path
-        return path
-      logging.warning('MegaCLI 64 not found at %s', path)
+    path = lib_tools.GetToolRegistry().FindExecutable(self.megacli_64_path)
+    if path:
+      logging.debug('Using MegaCLI64 found at %s', path)
+      return path
 
     error_message = 'Could not find any MegaCLI64 executables at: %s' % (
         self.megacli_64_path)
@@ -302,34 +499,20 @@ class MegaCLI(object):
     Returns:
       Path to the smartctl binary (str).
     """
-    if self._known_smartctl_path:
-      logging.debug('We have a known good smartctl path: %s',
-                    self._known_smartctl_path)
-      return self._known_smartctl_path
-
-    for path in self.smartctl_paths:
-      if self._CheckFileExists(path):
-        logging.debug('Using smartctl found at %s', path)
-        self._known_smartctl_path = path
-        return path
-      logging.debug('smartctl not found at %s', path)
+    path = lib_tools.GetToolRegistry().FindExecutable(self.smartctl_paths)
+    if path:
+      logging.debug('Using smartctl found at %s', path)
+      return path
     raise FindSmartctlError(
         'Could not find any smartctl executables at: %s' % self.smartctl_paths)
 
-  def _CheckFileExists(self, path):
+  def _DeleteMegasasLog(self):
     try:
-      command = 'test -e %s' % path
-      result = self.runner.Run(command)
-      if result.exit_code == 0:
-        return True
-    except lib_commands.Error:
-      pass
-    return False
+      os.remove(MEGASAS_LOG_PATH)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        logging.warning('Unable to delete %s: %s', MEGASAS_LOG_PATH, e)
 
-  def _DeleteMegasasLog(self):
-    if self._CheckFileExists('MegaSAS.log'):
-      command = 'rm MegaSAS.log'
-      try:
-        self.runner.Run(command)
-      except lib_commands.Error:
-        pass
+
+lib_disk_backends.RegisterDiskBackend(
+    'MegaCLI', MegaCLI, pci_ids=MEGACLI_PCI_IDS)
@@ -0,0 +1,446 @@
+"""Console Status Display Tool rtnetlink library.
+
+Routes, addresses and links are read from the kernel over an rtnetlink
+socket instead of forking `ip route get` and parsing its output. Changes of
+links, addresses and routes can also be subscribed to, so that tiles showing
+network configuration are refreshed as soon as it changes.
+"""
+
+import errno
+import itertools
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+NETLINK_ROUTE = 0
+
+# Message types, see linux/netlink.h and linux/rtnetlink.h.
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+
+# Message flags.
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ROOT = 0x100
+NLM_F_MATCH = 0x200
+NLM_F_DUMP = NLM_F_ROOT | NLM_F_MATCH
+
+# Route, address and link attributes.
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PREFSRC = 7
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFLA_IFNAME = 3
+
+# Scope of global addresses.
+RT_SCOPE_UNIVERSE = 0
+
+# Multicast groups announcing changes of links, addresses and routes, as the
+# bitmask bound to by legacy group membership.
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+RTMGRP_NETWORK_CONFIGURATION = (
+    RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE |
+    RTMGRP_IPV6_IFADDR | RTMGRP_IPV6_ROUTE)
+
+# Message types announcing changes of network configuration.
+NETWORK_CHANGE_MESSAGE_TYPES = frozenset([
+    RTM_NEWLINK, RTM_DELLINK, RTM_NEWADDR, RTM_DELADDR, RTM_NEWROUTE,
+    RTM_DELROUTE])
+
+# Destinations routes are looked up for, as with `ip route get`.
+ROUTE_DESTINATIONS = {
+    4: '8.8.8.8',
+    6: '2001:4860:4860::8888',
+}
+
+_ADDRESS_FAMILIES = {
+    4: socket.AF_INET,
+    6: socket.AF_INET6,
+}
+
+# Header and message structures, in native byte order.
+_NLMSGHDR = struct.Struct('=LHHLL')
+_NLMSGERR = struct.Struct('=i')
+_RTATTR = struct.Struct('=HH')
+_RTMSG = struct.Struct('=BBBBBBBBI')
+_IFADDRMSG = struct.Struct('=BBBBI')
+_IFINFOMSG = struct.Struct('=BxHiII')
+_ATTRIBUTE_INT = struct.Struct('=I')
+
+_RECEIVE_BUFFER_SIZE = 65536
+
+# Seconds to wait for the kernel to reply to a request.
+REQUEST_TIMEOUT = 2.0
+
+
+class Error(Exception):
+  pass
+
+
+def _Align(length):
+  """Round a length up to the 4 byte alignment of netlink messages (int)."""
+  return (length + 3) & ~3
+
+
+def _PackAttribute(attribute_type, value):
+  """Pack a route attribute (str)."""
+  attribute = _RTATTR.pack(_RTATTR.size + len(value), attribute_type) + value
+  return attribute + '\0' * (_Align(len(attribute)) - len(attribute))
+
+
+def _ParseAttributes(data, offset):
+  """Parse route attributes following a message's fixed size part.
+
+  Args:
+    data: The message payload (str).
+    offset: Offset of the first attribute (int).
+
+  Returns:
+    Dictionary mapping attribute types to their values (str).
+  """
+  attributes = {}
+  while offset + _RTATTR.size <= len(data):
+    length, attribute_type = _RTATTR.unpack_from(data, offset)
+    if length < _RTATTR.size:
+      break
+    attributes[attribute_type] = data[offset + _RTATTR.size:offset + length]
+    offset += _Align(length)
+  return attributes
+
+
+def _ParseMessages(data):
+  """Split data received from a netlink socket into messages.
+
+  Errors are returned like other messages, as they may reply to an earlier
+  request, see _GetErrorCode().
+
+  Args:
+    data: Data received from the socket (str).
+
+  Returns:
+    List of (message type, flags, sequence number, payload) tuples.
+  """
+  messages = []
+  offset = 0
+  while offset + _NLMSGHDR.size <= len(data):
+    length, message_type, flags, sequence, _ = _NLMSGHDR.unpack_from(
+        data, offset)
+    if length < _NLMSGHDR.size:
+      break
+    payload = data[offset + _NLMSGHDR.size:offset + length]
+    messages.append((message_type, flags, sequence, payload))
+    offset += _Align(length)
+  return messages
+
+
+def _GetErrorCode(payload):
+  """Get the negated errno of an NLMSG_ERROR message, 0 for an ack (int)."""
+  if len(payload) < _NLMSGERR.size:
+    raise Error('Truncated netlink error message.')
+  error_code, = _NLMSGERR.unpack_from(payload)
+  return error_code
+
+
+class RtnetlinkClient(object):
+  """Send requests to the kernel over an rtnetlink socket.
+
+  The socket is opened once and reused for all requests. All methods are
+  thread-safe.
+  """
+
+  def __init__(self):
+    try:
+      self._socket = socket.socket(
+          socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+      self._socket.bind((0, 0))
+    except (AttributeError, socket.error) as error:
+      raise Error('Unable to open an rtnetlink socket: %s' % error)
+    self._sequence = itertools.count(1)
+    self._lock = threading.Lock()
+
+  def Close(self):
+    self._socket.close()
+
+  def _Request(self, message_type, flags, payload):
+    """Send a request and receive all messages replying to it.
+
+    Args:
+      message_type: Type of the request, one of RTM_GET* (int).
+      flags: Flags of the request in addition to NLM_F_REQUEST (int).
+      payload: The request's payload (str).
+
+    Raises:
+      Error: If the request fails or isn't replied to within REQUEST_TIMEOUT.
+
+    Returns:
+      List of payloads of the reply messages (list of str).
+    """
+    with self._lock:
+      deadline = time.time() + REQUEST_TIMEOUT
+      sequence = next(self._sequence)
+      request = _NLMSGHDR.pack(
+          _NLMSGHDR.size + len(payload), message_type, NLM_F_REQUEST | flags,
+          sequence, 0) + payload
+      try:
+        self._socket.send(request)
+        payloads = []
+        while 1:
+          # Replies to other requests could keep coming, so the timeout is
+          # for the whole request rather than each receive.
+          timeout = deadline - time.time()
+          if timeout <= 0:
+            raise Error('Netlink request timed out.')
+          self._socket.settimeout(timeout)
+          messages = _ParseMessages(self._socket.recv(_RECEIVE_BUFFER_SIZE))
+          for reply_type, reply_flags, reply_sequence, reply in messages:
+            # Replies to earlier requests which timed out are skipped.
+            if reply_sequence != sequence:
+              continue
+            if reply_type == NLMSG_DONE:
+              return payloads
+            if reply_type == NLMSG_ERROR:
+              error_code = _GetErrorCode(reply)
+              # An error code of 0 acknowledges a request.
+              if error_code:
+                raise Error(
+                    'Netlink request failed: %s' % os.strerror(-error_code))
+              return payloads
+            payloads.append(reply)
+            if not reply_flags & NLM_F_MULTI:
+              return payloads
+      except socket.timeout:
+        raise Error('Netlink request timed out.')
+      except socket.error as error:
+        raise Error('Netlink request failed: %s' % error)
+
+  def GetRoute(self, destination, ip_version=4):
+    """Get the route the kernel would use to reach a destination.
+
+    Args:
+      destination: IP address of the destination (str).
+      ip_version: IP protocol version (int).
+
+    Raises:
+      Error: If the route can't be looked up, i.e. if there's none.
+
+    Returns:
+      Dictionary with the following keys:
+        - interface_index: Index of the egress interface (int or None).
+        - gateway: IP address of the gateway (str or None).
+        - source: Preferred source address (str or None).
+    """
+    family = _ADDRESS_FAMILIES[ip_version]
+    address = socket.inet_pton(family, destination)
+    payload = _RTMSG.pack(family, len(address) * 8, 0, 0, 0, 0, 0, 0, 0)
+    payload += _PackAttribute(RTA_DST, address)
+    replies = self._Request(RTM_GETROUTE, 0, payload)
+    if not replies:
+      raise Error('No route to %s.' % destination)
+    attributes = _ParseAttributes(replies[0], _RTMSG.size)
+
+    route = {
+        'interface_index': None,
+        'gateway': None,
+        'source': None,
+    }
+    if RTA_OIF in attributes:
+      route['interface_index'], = _ATTRIBUTE_INT.unpack(attributes[RTA_OIF])
+    if RTA_GATEWAY in attributes:
+      route['gateway'] = socket.inet_ntop(family, attributes[RTA_GATEWAY])
+    if RTA_PREFSRC in attributes:
+      route['source'] = socket.inet_ntop(family, attributes[RTA_PREFSRC])
+    return route
+
+  def GetAddresses(self, ip_version=4, interface_index=None):
+    """Get global IP addresses of interfaces.
+
+    Args:
+      ip_version: IP protocol version (int).
+      interface_index: Index of the interface to get addresses of, or None
+          for all interfaces (int).
+
+    Raises:
+      Error: If addresses can't be read.
+
+    Returns:
+      List of (interface index, IP address) tuples, in the order reported by
+      the kernel.
+    """
+    family = _ADDRESS_FAMILIES[ip_version]
+    replies = self._Request(
+        RTM_GETADDR, NLM_F_DUMP, _IFADDRMSG.pack(family, 0, 0, 0, 0))
+    addresses = []
+    for reply in replies:
+      reply_family, _, _, scope, index = _IFADDRMSG.unpack_from(reply)
+      if reply_family != family or scope != RT_SCOPE_UNIVERSE:
+        continue
+      if interface_index is not None and index != interface_index:
+        continue
+      attributes = _ParseAttributes(reply, _IFADDRMSG.size)
+      address = attributes.get(IFA_LOCAL, attributes.get(IFA_ADDRESS))
+      if address:
+        addresses.append((index, socket.inet_ntop(family, address)))
+    return addresses
+
+  def GetInterfaceName(self, interface_index):
+    """Get the name of an interface.
+
+    Args:
+      interface_index: Index of the interface (int).
+
+    Raises:
+      Error: If the interface doesn't exist.
+
+    Returns:
+      Name of the interface (str).
+    """
+    replies = self._Request(
+        RTM_GETLINK, 0,
+        _IFINFOMSG.pack(socket.AF_UNSPEC, 0, interface_index, 0, 0))
+    if not replies:
+      raise Error('No interface with index %d.' % interface_index)
+    attributes = _ParseAttributes(replies[0], _IFINFOMSG.size)
+    if IFLA_IFNAME not in attributes:
+      raise Error('Interface %d has no name.' % interface_index)
+    return attributes[IFLA_IFNAME].rstrip('\0')
+
+  def GetNetworkConfiguration(self, ip_version=4):
+    """Get the network interface configuration for a machine.
+
+    The route to a well known destination is looked up, see
+    lib_common.GetNetworkConfiguration().
+
+    Args:
+      ip_version: IP protocol version (int).
+
+    Raises:
+      Error: If the configuration can't be read.
+
+    Returns:
+      If the destination is reached through a gateway, a tuple of the egress
+      interface name, IP address of the machine and IP address of the
+      gateway (str). Otherwise None.
+    """
+    try:
+      route = self.GetRoute(ROUTE_DESTINATIONS[ip_version], ip_version)
+    except Error as error:
+      # There's simply no route on machines without this IP version.
+      logging.debug('No IPv%d route: %s', ip_version, error)
+      return None
+    if not route['gateway'] or route['interface_index'] is None:
+      return None
+
+    source = route['source']
+    if not source:
+      addresses = self.GetAddresses(
+          ip_version, interface_index=route['interface_index'])
+      if not addresses:
+        return None
+      source = addresses[0][1]
+    return (
+        self.GetInterfaceName(route['interface_index']),
+        source,
+        route['gateway'],
+    )
+
+
+class RtnetlinkMonitor(object):
+  """Receive notifications of link, address and route changes.
+
+  The monitor can be waited for with select(), see fileno().
+  """
+
+  def __init__(self, groups=RTMGRP_NETWORK_CONFIGURATION):
+    """Constructs an RtnetlinkMonitor object.
+
+    Args:
+      groups: Bitmask of RTMGRP_* multicast groups to subscribe to (int).
+
+    Raises:
+      Error: If the groups can't be subscribed to.
+    """
+    try:
+      self._socket = socket.socket(
+          socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+      self._socket.bind((0, groups))
+    except (AttributeError, socket.error) as error:
+      raise Error('Unable to subscribe to rtnetlink groups: %s' % error)
+    self._socket.setblocking(0)
+
+  def fileno(self):
+    return self._socket.fileno()
+
+  def Close(self):
+    self._socket.close()
+
+  def ReadChanges(self):
+    """Read all pending notifications without blocking.
+
+    Returns:
+      True if network configuration has changed since the last call, or if
+      notifications have been lost because too many were pending.
+      False otherwise.
+    """
+    changed = False
+    while 1:
+      try:
+        data = self._socket.recv(_RECEIVE_BUFFER_SIZE)
+      except socket.error as error:
+        if error.args[0] in [errno.EAGAIN, errno.EINTR]:
+          return changed
+        if error.args[0] == errno.ENOBUFS:
+          logging.warning('Lost rtnetlink notifications.')
+          changed = True
+          continue
+        raise
+      for message_type, _, _, _ in _ParseMessages(data):
+        if message_type in NETWORK_CHANGE_MESSAGE_TYPES:
+          changed = True
+
+
+def OpenRtnetlinkMonitor():
+  """Subscribe to changes of network configuration, if possible.
+
+  Returns:
+    RtnetlinkMonitor instance, or None if notifications are unavailable.
+  """
+  try:
+    return RtnetlinkMonitor()
+  except Error as e:
+    logging.warning('Network configuration changes won\'t be noticed: %s', e)
+    return None
+
+
+_rtnetlink_client = None
+_rtnetlink_client_lock = threading.Lock()
+
+
+def GetRtnetlinkClient():
+  """Get the RtnetlinkClient instance shared by all tiles.
+
+  Raises:
+    Error: If the rtnetlink socket can't be opened.
+  """
+  global _rtnetlink_client
+  with _rtnetlink_client_lock:
+    if _rtnetlink_client is None:
+      _rtnetlink_client = RtnetlinkClient()
+    return _rtnetlink_client
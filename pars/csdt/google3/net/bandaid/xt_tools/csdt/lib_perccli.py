@@ -0,0 +1,109 @@
+"""Console Status Display Tool PercCLI and StorCLI library.
+
+PercCLI is Dell's build of Broadcom's StorCLI, the successor of MegaCLI. Both
+can print their output as JSON, which is parsed instead of scraping the text
+output of MegaCLI.
+"""
+
+import logging
+
+from google3.net.bandaid.xt_tools.csdt import lib_commands
+from google3.net.bandaid.xt_tools.csdt import lib_disk_backends
+from google3.net.bandaid.xt_tools.csdt import lib_disk_parser
+from google3.net.bandaid.xt_tools.csdt import lib_tools
+
+
+PERCCLI_PATHS = [
+    '/export/hda3/bandaid/tools/PercCli64',
+    '/opt/MegaRAID/perccli/perccli64',
+    '/opt/MegaRAID/storcli/storcli64',
+]
+
+# PCI vendor and device IDs of MegaRAID controllers supported by PercCLI and
+# StorCLI: SAS2208 (H710), SAS3108 (H730), SAS3008 (H330), SAS3508 (H740P),
+# SAS3516 (H840) and SAS3916 (H755).
+PERCCLI_PCI_IDS = [
+    (lib_disk_backends.PCI_VENDOR_LSI, 0x005b),
+    (lib_disk_backends.PCI_VENDOR_LSI, 0x005d),
+    (lib_disk_backends.PCI_VENDOR_LSI, 0x005f),
+    (lib_disk_backends.PCI_VENDOR_LSI, 0x0014),
+    (lib_disk_backends.PCI_VENDOR_LSI, 0x0016),
+    (lib_disk_backends.PCI_VENDOR_LSI, 0x10e2),
+]
+
+
+class Error(lib_disk_parser.Error):
+  """Module level exception."""
+  pass
+
+
+class FindPercCLIError(Error):
+  """Error occurred while finding PercCLI or StorCLI binary."""
+  pass
+
+
+class PercCLIExecutionError(Error):
+  """Error occurred while executing PercCLI command."""
+  pass
+
+
+class PercCLI(object):
+  """Interface for accessing the Dell PercCLI or Broadcom StorCLI binary."""
+
+  def __init__(self, command_runner):
+    """Constructs a PercCLI object."""
+    self.runner = command_runner
+    self.perccli_paths = PERCCLI_PATHS
+
+  def GetPercCLIPath(self):
+    """Gets the path of the PercCLI or StorCLI binary.
+
+    Raises:
+      FindPercCLIError: If the binary isn't found at any location.
+
+    Returns:
+      Path to the PercCLI or StorCLI binary (str).
+    """
+    path = lib_tools.GetToolRegistry().FindExecutable(self.perccli_paths)
+    if path:
+      logging.debug('Using PercCLI found at %s', path)
+      return path
+    raise FindPercCLIError(
+        'Could not find any PercCLI executables at: %s' % self.perccli_paths)
+
+  def GetDiskInformation(self):
+    """Gets list of dictionaries containing disk information.
+
+    Each dictionary contains the same keys as the ones returned by
+    lib_megacli.MegaCLI.GetDiskInformation(), except for scsi_lun and
+    last_predictive, along with:
+      - adapter: the number of the controller the disk is attached to (int).
+      - enclosure: the ID of the enclosure the disk is in (int, or None if the
+          disk isn't in an enclosure).
+      - serial_number: the disk serial number as reported by PercCLI (str, or
+          None if not available).
+
+    Disks of all controllers are returned, ordered by controller, enclosure
+    and slot number.
+
+    Raises:
+      FindPercCLIError: If PercCLI can't be found.
+      PercCLIExecutionError: If an error occurs while executing PercCLI.
+      lib_disk_parser.PercCLIOutputParseError: If PercCLI output can't be
+          parsed.
+
+    Returns:
+      A list of dictionaries containing disk information (list).
+    """
+    command = '%s /call/eall/sall show all j' % self.GetPercCLIPath()
+    try:
+      result = self.runner.Run(command)
+    except lib_commands.Error as e:
+      logging.exception(e)
+      raise PercCLIExecutionError(e)
+    return lib_disk_parser.PercCliParseDiskList(result.output)
+
+
+lib_disk_backends.RegisterDiskBackend(
+    'PercCLI', PercCLI, pci_ids=PERCCLI_PCI_IDS,
+    priority=lib_disk_backends.PRIORITY_STRUCTURED_OUTPUT)
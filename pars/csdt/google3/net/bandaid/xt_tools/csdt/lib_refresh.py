@@ -0,0 +1,147 @@
+"""Console Status Display Tool tile refresh scheduler library."""
+
+import errno
+import fcntl
+import logging
+import os
+import Queue
+import threading
+import time
+
+# Maximum number of tiles being refreshed at the same time.
+DEFAULT_MAX_WORKERS = 4
+
+
+class RefreshScheduler(object):
+  """Refresh content of tiles in a bounded pool of worker threads.
+
+  Tile content is collected in the background, so that a tile running slow
+  commands doesn't delay any other tile. Completed refreshes are returned by
+  GetCompletedRefreshes(), which is expected to be called from the thread
+  owning the screen, since curses isn't thread-safe. That thread can wait for
+  completed refreshes by polling the file descriptor returned by fileno().
+  """
+
+  class Result(object):
+    """The result of a tile refresh.
+
+    Attributes:
+      tile: Tile which has been refreshed (tile.InformationTile).
+      content: Tile content to be displayed (str).
+      duration: Time it took to collect the content (float, seconds).
+    """
+
+    def __init__(self, tile, content, duration):
+      self.tile = tile
+      self.content = content
+      self.duration = duration
+
+  def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+    """Constructs a RefreshScheduler object.
+
+    Args:
+      max_workers: Maximum number of tiles refreshed at the same time (int).
+    """
+    self._requests = Queue.Queue()
+    self._results = Queue.Queue()
+    # Tiles which have been submitted, but whose results haven't been collected
+    # yet. Only accessed by the thread owning the scheduler.
+    self._pending_tiles = []
+
+    # Self-pipe used to wake up the thread owning the scheduler whenever a
+    # refresh completes.
+    self._notify_read_fd, self._notify_write_fd = os.pipe()
+    for fd in [self._notify_read_fd, self._notify_write_fd]:
+      flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+      fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    for worker_number in range(max_workers):
+      worker = threading.Thread(
+          target=self._RunWorker, name='csdt-refresh-%d' % worker_number)
+      worker.daemon = True
+      worker.start()
+
+  def _RunWorker(self):
+    """Refresh tiles submitted to the scheduler until the process exits."""
+    while 1:
+      tile = self._requests.get()
+      start_timestamp = time.time()
+      try:
+        content = tile.GetContent()
+      # Exception type being caught here is intentionally broad to keep the
+      # worker alive and write error messages to a log file instead.
+      except Exception:  # pylint: disable=broad-except
+        logging.exception('Failed to refresh tile: \'%s\':', tile.GetTileName())
+        content = 'No data to display'
+      duration = time.time() - start_timestamp
+      logging.debug('Refreshed \'%s\' tile in %.3f seconds.',
+                    tile.GetTileName(), duration)
+      self._results.put(
+          RefreshScheduler.Result(
+              tile=tile, content=content, duration=duration))
+      self._Notify()
+
+  def _Notify(self):
+    """Wake up the thread waiting for completed refreshes."""
+    try:
+      os.write(self._notify_write_fd, 'x')
+    except OSError as error:
+      # A full pipe already guarantees a wake up.
+      if error.errno != errno.EAGAIN:
+        raise
+
+  def fileno(self):
+    """Get a file descriptor which becomes readable when a refresh completes."""
+    return self._notify_read_fd
+
+  def Submit(self, tile):
+    """Request the content of a tile to be refreshed in the background.
+
+    Args:
+      tile: Tile to refresh (tile.InformationTile).
+
+    Returns:
+      True if the refresh was scheduled.
+      False if the tile is already being refreshed.
+    """
+    if self.IsPending(tile):
+      return False
+    self._pending_tiles.append(tile)
+    self._requests.put(tile)
+    return True
+
+  def IsPending(self, tile):
+    """Check if a tile is currently being refreshed."""
+    return tile in self._pending_tiles
+
+  def GetPendingTiles(self):
+    """Get a list of tiles currently being refreshed."""
+    return list(self._pending_tiles)
+
+  def GetCompletedRefreshes(self):
+    """Get results of refreshes completed since the last call.
+
+    Returns:
+      List of RefreshScheduler.Result instances.
+    """
+    # Drain notifications before collecting results, so that a refresh
+    # completing in the meantime still wakes up the next poll.
+    try:
+      while os.read(self._notify_read_fd, 4096):
+        pass
+    except OSError as error:
+      if error.errno != errno.EAGAIN:
+        raise
+
+    results = []
+    while 1:
+      try:
+        result = self._results.get_nowait()
+      except Queue.Empty:
+        break
+      # Results may also be published without having been requested, see
+      # lib_daemon.RemoteRefreshScheduler.
+      if result.tile in self._pending_tiles:
+        self._pending_tiles.remove(result.tile)
+      results.append(result)
+    return results
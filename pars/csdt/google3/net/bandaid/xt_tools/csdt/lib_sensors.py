@@ -3,10 +3,16 @@
 import collections
 import logging
 import re
+import threading
+import time
 
+from google3.net.bandaid.xt_tools.csdt import lib_ipmi
 from google3.net.bandaid.xt_tools.csdt import lib_status
 
-PATH_IPMITOOL = '/usr/bin/ipmitool'
+PATH_IPMITOOL = lib_ipmi.PATH_IPMITOOL
+
+# Number of seconds a sample of IPMI sensors remains valid.
+SENSOR_SAMPLE_TTL = 30
 
 
 def ParseTextSensorValue(sensor_value):
@@ -264,7 +270,119 @@ def ParseSensors(ipmitool_output):
   return sensors_grouped
 
 
-def GetSensors(command_runner):
+def GetSensors(command_runner, ipmi_session=None):
+  """Read and parse IPMI sensors.
+
+  Args:
+    command_runner: Instance of lib_commands.CommandRunner().
+    ipmi_session: Instance of lib_ipmi.IpmiSession() to read sensors through.
+        If not supplied or failing, a new ipmitool process is started instead.
+
+  Returns:
+    A dictionary with grouped IPMI sensors.
+  """
+  if ipmi_session:
+    try:
+      return ParseSensors(ipmitool_output=ipmi_session.Run('sdr elist'))
+    except lib_ipmi.Error:
+      logging.warning('Unable to read sensors using the ipmitool session.')
   command = '%s sdr elist' % PATH_IPMITOOL
   result = command_runner.Run(command)
   return ParseSensors(ipmitool_output=result.output)
+
+
+class SensorSampler(object):
+  """Share a single sample of IPMI sensors between all its consumers.
+
+  Running `ipmitool sdr elist` can take several seconds on a slow BMC, so
+  tiles showing sensor values use the same parsed sample for as long as it
+  remains valid. Concurrent callers wait for a sample already being taken
+  instead of running ipmitool again.
+
+  Attributes:
+    ttl: Number of seconds a sample remains valid (int).
+    generation: Number of samples taken so far (int).
+    sample_timestamp: Time the current sample was taken at (float).
+  """
+
+  def __init__(self, ttl=SENSOR_SAMPLE_TTL, use_ipmi_session=True):
+    """Constructs a SensorSampler object.
+
+    Args:
+      ttl: Number of seconds a sample remains valid (int).
+      use_ipmi_session: Whether to read sensors through the shared ipmitool
+          session rather than the command runner passed to GetSensors() (bool).
+    """
+    self.ttl = ttl
+    self.use_ipmi_session = use_ipmi_session
+    self.generation = 0
+    self.sample_timestamp = 0
+    self._sensors = None
+    self._sampling = False
+    self._condition = threading.Condition()
+
+  def Invalidate(self):
+    """Force a new sample to be taken on the next GetSensors() call."""
+    with self._condition:
+      self.sample_timestamp = 0
+
+  def _IsSampleValid(self):
+    return (self._sensors is not None and
+            time.time() - self.sample_timestamp < self.ttl)
+
+  def GetSensors(self, command_runner):
+    """Get grouped IPMI sensors, taking a new sample if required.
+
+    Args:
+      command_runner: Instance of lib_commands.CommandRunner().
+
+    Returns:
+      A dictionary with grouped IPMI sensors as returned by ParseSensors().
+      It is shared by all callers and must not be modified.
+    """
+    with self._condition:
+      while self._sampling:
+        self._condition.wait()
+      if self._IsSampleValid():
+        logging.debug('Using IPMI sensor sample #%d.', self.generation)
+        return self._sensors
+      self._sampling = True
+
+    sensors = None
+    ipmi_session = None
+    if self.use_ipmi_session:
+      ipmi_session = lib_ipmi.GetIpmiSession()
+    try:
+      sensors = GetSensors(
+          command_runner=command_runner, ipmi_session=ipmi_session)
+    finally:
+      with self._condition:
+        self._sampling = False
+        # Callers which waited for a failed sample will take one themselves.
+        if sensors is not None:
+          self._sensors = sensors
+          self.sample_timestamp = time.time()
+          self.generation += 1
+          logging.debug('Took IPMI sensor sample #%d.', self.generation)
+        self._condition.notify_all()
+    return sensors
+
+
+_sensor_sampler = None
+_sensor_sampler_lock = threading.Lock()
+
+
+def GetSensorSampler():
+  """Get the SensorSampler instance shared by all tiles."""
+  global _sensor_sampler
+  with _sensor_sampler_lock:
+    if _sensor_sampler is None:
+      _sensor_sampler = SensorSampler()
+    return _sensor_sampler
+
+
+def SetSensorSampler(sensor_sampler):
+  """Replace the SensorSampler instance shared by all tiles, i.e. in tests."""
+  global _sensor_sampler
+  with _sensor_sampler_lock:
+    _sensor_sampler = sensor_sampler
@@ -0,0 +1,301 @@
+"""Console Status Display Tool collector statistics library."""
+
+import bisect
+import contextlib
+import copy
+import threading
+import time
+
+# Upper bounds of command latency histogram buckets, in seconds. Latencies
+# above the last bound are counted in an additional overflow bucket.
+LATENCY_BUCKETS = [
+    0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60]
+
+# Name under which commands run outside of any tile refresh are recorded.
+NO_TILE = '(no tile)'
+
+# Name of the tile being refreshed by the current thread, if any.
+_thread_state = threading.local()
+
+
+def GetCurrentTileName():
+  """Get the name of the tile being refreshed by the current thread (str)."""
+  return getattr(_thread_state, 'tile_name', None) or NO_TILE
+
+
+def _FormatMilliseconds(seconds):
+  """Format a duration in milliseconds, or '-' if it's unknown (str)."""
+  if seconds is None:
+    return '-'
+  return '%d' % round(seconds * 1000)
+
+
+class CommandStatistics(object):
+  """Statistics of a single command run by a tile.
+
+  Attributes:
+    runs: Number of times the command has been run (int).
+    timeouts: Number of runs which have timed out (int).
+    output_bytes: Bytes of output captured from all runs (int).
+    total_seconds: Time taken by all runs (float).
+    max_seconds: Time taken by the slowest run (float).
+    histogram: Number of runs per LATENCY_BUCKETS bucket (list of int).
+  """
+
+  def __init__(self):
+    self.runs = 0
+    self.timeouts = 0
+    self.output_bytes = 0
+    self.total_seconds = 0.0
+    self.max_seconds = 0.0
+    self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+  def Record(self, seconds, output_bytes, timed_out):
+    """Record a run of the command."""
+    self.runs += 1
+    self.output_bytes += output_bytes
+    if timed_out:
+      self.timeouts += 1
+    self.total_seconds += seconds
+    self.max_seconds = max(self.max_seconds, seconds)
+    self.histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+  def GetPercentile(self, percentile):
+    """Estimate a latency percentile from the histogram.
+
+    Args:
+      percentile: Percentile to get, between 0 and 100 (float).
+
+    Returns:
+      Upper bound of the bucket the percentile falls into, or the slowest
+      run if it's in the overflow bucket (float, seconds). None if the
+      command hasn't been run.
+    """
+    if not self.runs:
+      return None
+    rank = percentile / 100.0 * self.runs
+    runs = 0
+    for bucket, bucket_runs in enumerate(self.histogram):
+      runs += bucket_runs
+      if runs >= rank and bucket_runs:
+        if bucket < len(LATENCY_BUCKETS):
+          return min(LATENCY_BUCKETS[bucket], self.max_seconds)
+        break
+    return self.max_seconds
+
+
+class TileStatistics(object):
+  """Statistics of refreshes of a single tile.
+
+  Attributes:
+    refreshes: Number of completed refreshes (int).
+    total_seconds: Wall time taken by all refreshes (float).
+    last_seconds: Wall time taken by the last refresh, if any (float).
+    max_seconds: Wall time taken by the slowest refresh, if any (float).
+    forks: Number of processes started (int).
+    commands: Dictionary mapping commands to their CommandStatistics.
+  """
+
+  def __init__(self):
+    self.refreshes = 0
+    self.total_seconds = 0.0
+    self.last_seconds = None
+    self.max_seconds = None
+    self.forks = 0
+    self.commands = {}
+
+  def GetTimeouts(self):
+    """Get the number of commands which have timed out (int)."""
+    return sum(
+        command_statistics.timeouts
+        for command_statistics in self.commands.itervalues())
+
+  def GetOutputBytes(self):
+    """Get the bytes of output captured from all commands (int)."""
+    return sum(
+        command_statistics.output_bytes
+        for command_statistics in self.commands.itervalues())
+
+  def GetSlowestCommand(self):
+    """Get the command which took the most time in total.
+
+    Returns:
+      Tuple of the command (str) and its CommandStatistics, or None if no
+      commands have been run.
+    """
+    if not self.commands:
+      return None
+    return max(self.commands.iteritems(),
+               key=lambda command: command[1].total_seconds)
+
+
+class CollectorStatistics(object):
+  """Statistics of tile refreshes and the commands run by them.
+
+  Commands are attributed to the tile being refreshed by the thread running
+  them, see MeasureTileRefresh(). All methods are thread-safe.
+  """
+
+  def __init__(self):
+    self.start_timestamp = time.time()
+    self._tiles = {}
+    self._lock = threading.Lock()
+
+  def _GetTileStatistics(self, tile_name):
+    """Get statistics of a tile, creating them if necessary."""
+    if tile_name not in self._tiles:
+      self._tiles[tile_name] = TileStatistics()
+    return self._tiles[tile_name]
+
+  def RecordRefresh(self, tile_name, seconds):
+    """Record a completed refresh of a tile.
+
+    Args:
+      tile_name: Name of the refreshed tile (str).
+      seconds: Wall time taken by the refresh (float).
+    """
+    with self._lock:
+      tile_statistics = self._GetTileStatistics(tile_name)
+      tile_statistics.refreshes += 1
+      tile_statistics.total_seconds += seconds
+      tile_statistics.last_seconds = seconds
+      tile_statistics.max_seconds = max(
+          tile_statistics.max_seconds or 0, seconds)
+
+  def RecordFork(self, tile_name=None):
+    """Record a process being started.
+
+    Args:
+      tile_name: Name of the tile starting the process or None for the tile
+          being refreshed by the current thread (str).
+    """
+    tile_name = tile_name or GetCurrentTileName()
+    with self._lock:
+      self._GetTileStatistics(tile_name).forks += 1
+
+  def RecordCommand(self, command, seconds, output_bytes=0, timed_out=False,
+                    tile_name=None):
+    """Record a completed command.
+
+    Args:
+      command: The command which has been run (str).
+      seconds: Time the command took (float).
+      output_bytes: Bytes of output captured from the command (int).
+      timed_out: Whether the command has timed out (bool).
+      tile_name: Name of the tile running the command or None for the tile
+          being refreshed by the current thread (str).
+    """
+    tile_name = tile_name or GetCurrentTileName()
+    with self._lock:
+      commands = self._GetTileStatistics(tile_name).commands
+      if command not in commands:
+        commands[command] = CommandStatistics()
+      commands[command].Record(
+          seconds=seconds, output_bytes=output_bytes, timed_out=timed_out)
+
+  def GetTiles(self):
+    """Get a consistent copy of statistics of all tiles.
+
+    Returns:
+      Dictionary mapping tile names to their TileStatistics.
+    """
+    with self._lock:
+      return copy.deepcopy(self._tiles)
+
+  def FormatSummary(self):
+    """Format one line of statistics per tile, slowest tiles first.
+
+    Returns:
+      Lines of at most 78 characters (list of str).
+    """
+    lines = ['%-26s %9s %7s %7s %6s %8s %8s' % (
+        'Tile', 'Refreshes', 'Last ms', 'Max ms', 'Forks', 'Timeouts',
+        'Output')]
+    tiles = self.GetTiles()
+    for tile_name in sorted(
+        tiles, key=lambda tile_name: -(tiles[tile_name].max_seconds or 0)):
+      tile_statistics = tiles[tile_name]
+      lines.append('%-26s %9d %7s %7s %6d %8d %7dK' % (
+          tile_name[:26],
+          tile_statistics.refreshes,
+          _FormatMilliseconds(tile_statistics.last_seconds),
+          _FormatMilliseconds(tile_statistics.max_seconds),
+          tile_statistics.forks,
+          tile_statistics.GetTimeouts(),
+          tile_statistics.GetOutputBytes() / 1024))
+      slowest_command = tile_statistics.GetSlowestCommand()
+      if slowest_command:
+        command, command_statistics = slowest_command
+        details = ' p99 %sms x%d' % (
+            _FormatMilliseconds(command_statistics.GetPercentile(99)),
+            command_statistics.runs)
+        lines.append('  %s%s' % (command[:76 - len(details)], details))
+    return lines
+
+  def Format(self):
+    """Format statistics of all tiles and all their commands.
+
+    Returns:
+      Human-readable statistics (str).
+    """
+    lines = [
+        'CSDT collector statistics, %d seconds since start.' % (
+            time.time() - self.start_timestamp),
+        '']
+    lines.extend(self.FormatSummary())
+    lines.append('')
+    lines.append('Command latency histogram buckets (ms): %s' % ' '.join(
+        _FormatMilliseconds(bound) for bound in LATENCY_BUCKETS))
+
+    tiles = self.GetTiles()
+    for tile_name in sorted(tiles):
+      for command, command_statistics in sorted(
+          tiles[tile_name].commands.iteritems()):
+        lines.append('')
+        lines.append('%s: %s' % (tile_name, command))
+        lines.append(
+            '  runs %d, timeouts %d, output %d bytes, p50 %s ms, p99 %s ms, '
+            'max %s ms' % (
+                command_statistics.runs,
+                command_statistics.timeouts,
+                command_statistics.output_bytes,
+                _FormatMilliseconds(command_statistics.GetPercentile(50)),
+                _FormatMilliseconds(command_statistics.GetPercentile(99)),
+                _FormatMilliseconds(command_statistics.max_seconds)))
+        lines.append('  histogram %s' % ' '.join(
+            str(runs) for runs in command_statistics.histogram))
+    return '\n'.join(lines) + '\n'
+
+
+_collector_statistics = None
+_collector_statistics_lock = threading.Lock()
+
+
+def GetCollectorStatistics():
+  """Get the CollectorStatistics instance shared by all collectors."""
+  global _collector_statistics
+  with _collector_statistics_lock:
+    if _collector_statistics is None:
+      _collector_statistics = CollectorStatistics()
+    return _collector_statistics
+
+
+@contextlib.contextmanager
+def MeasureTileRefresh(tile_name):
+  """Measure a tile refresh and attribute commands run meanwhile to the tile.
+
+  Args:
+    tile_name: Name of the tile being refreshed (str).
+
+  Yields:
+    None
+  """
+  previous_tile_name = getattr(_thread_state, 'tile_name', None)
+  _thread_state.tile_name = tile_name
+  start_timestamp = time.time()
+  try:
+    yield
+  finally:
+    _thread_state.tile_name = previous_tile_name
+    GetCollectorStatistics().RecordRefresh(
+        tile_name, time.time() - start_timestamp)
@@ -0,0 +1,197 @@
+"""Console Status Display Tool hardware tool discovery library.
+
+Locations of hardware tools and PCI devices present don't change while CSDT
+is running, so they are discovered once per process instead of forking
+`test -e` and `lspci` on every refresh. Everything discovered is forgotten
+when PCI devices are added or removed, or when a refresh is forced. Tools
+which aren't found are looked for again after a while, in case they get
+installed.
+"""
+
+import logging
+import os
+import threading
+import time
+
+# Location of PCI devices, which may point to a fake root for testing.
+SYS_BUS_PCI_DEVICES_PATH = '/sys/bus/pci/devices'
+
+# PCI class codes of storage controllers, without the programming interface.
+PCI_CLASS_RAID_CONTROLLER = 0x0104
+PCI_CLASS_SAS_CONTROLLER = 0x0107
+
+# Number of seconds after which tools which weren't found are looked for
+# again, i.e. if they have been installed since.
+MISSING_EXECUTABLE_RETRY_INTERVAL = 60
+
+
+class Error(Exception):
+  pass
+
+
+class PciDevice(object):
+  """A PCI device read from sysfs.
+
+  Attributes:
+    address: Address of the device, i.e. 0000:02:00.0 (str).
+    class_code: Class code of the device, without the programming interface
+        (int).
+    vendor_id: Vendor ID (int).
+    device_id: Device ID (int).
+    subsystem_vendor_id: Subsystem vendor ID (int).
+    subsystem_device_id: Subsystem device ID (int).
+  """
+
+  def __init__(self, address, class_code, vendor_id, device_id,
+               subsystem_vendor_id, subsystem_device_id):
+    self.address = address
+    self.class_code = class_code
+    self.vendor_id = vendor_id
+    self.device_id = device_id
+    self.subsystem_vendor_id = subsystem_vendor_id
+    self.subsystem_device_id = subsystem_device_id
+
+  def GetIds(self):
+    """Get vendor, device, subsystem vendor and subsystem device IDs (tuple)."""
+    return (self.vendor_id, self.device_id, self.subsystem_vendor_id,
+            self.subsystem_device_id)
+
+
+def _ReadPciAttribute(address, attribute):
+  """Read a hexadecimal attribute of a PCI device from sysfs (int)."""
+  path = os.path.join(SYS_BUS_PCI_DEVICES_PATH, address, attribute)
+  with open(path) as attribute_file:
+    return int(attribute_file.read().strip(), 16)
+
+
+def ReadPciDevices(addresses):
+  """Read PCI devices from sysfs.
+
+  Args:
+    addresses: Addresses of the devices to read (list of str).
+
+  Raises:
+    Error: If devices can't be read.
+
+  Returns:
+    List of PciDevice instances.
+  """
+  pci_devices = []
+  for address in addresses:
+    try:
+      pci_devices.append(PciDevice(
+          address=address,
+          class_code=_ReadPciAttribute(address, 'class') >> 8,
+          vendor_id=_ReadPciAttribute(address, 'vendor'),
+          device_id=_ReadPciAttribute(address, 'device'),
+          subsystem_vendor_id=_ReadPciAttribute(address, 'subsystem_vendor'),
+          subsystem_device_id=_ReadPciAttribute(address, 'subsystem_device')))
+    except (IOError, ValueError) as error:
+      raise Error('Unable to read PCI device %s: %s' % (address, error))
+  return pci_devices
+
+
+class ToolRegistry(object):
+  """Remember hardware tool locations and PCI devices for the process lifetime.
+
+  All methods are thread-safe.
+  """
+
+  def __init__(self):
+    # Tool locations and the time they were looked for, by candidate paths.
+    self._executables = {}
+    self._pci_addresses = None
+    self._pci_devices = None
+    self._lock = threading.Lock()
+
+  def Invalidate(self):
+    """Forget everything discovered so far."""
+    with self._lock:
+      self._executables = {}
+      self._pci_addresses = None
+      self._pci_devices = None
+
+  def _CheckPciHotplug(self):
+    """Forget everything discovered if PCI devices were added or removed.
+
+    Must be called with the lock held.
+
+    Raises:
+      Error: If PCI devices can't be listed.
+    """
+    try:
+      pci_addresses = sorted(os.listdir(SYS_BUS_PCI_DEVICES_PATH))
+    except OSError as error:
+      raise Error('Unable to list PCI devices: %s' % error)
+    if pci_addresses != self._pci_addresses:
+      if self._pci_addresses is not None:
+        logging.info('PCI devices have changed, discovering tools again.')
+      self._executables = {}
+      self._pci_addresses = pci_addresses
+      self._pci_devices = None
+
+  def FindExecutable(self, paths):
+    """Find the first of several possible locations of a tool.
+
+    Args:
+      paths: Possible locations of the tool, in order of preference (list of
+          str).
+
+    Returns:
+      Path of the tool (str) or None if it isn't at any of the locations.
+    """
+    paths = tuple(paths)
+    with self._lock:
+      try:
+        self._CheckPciHotplug()
+      except Error:
+        # Tools can still be found without sysfs, just never rediscovered.
+        pass
+      timestamp = time.time()
+      executable, discovery_timestamp = self._executables.get(
+          paths, (None, None))
+      if discovery_timestamp is None or (
+          executable is None and
+          timestamp - discovery_timestamp >= MISSING_EXECUTABLE_RETRY_INTERVAL):
+        executable = None
+        for path in paths:
+          if os.access(path, os.X_OK):
+            executable = path
+            break
+        self._executables[paths] = (executable, timestamp)
+      return executable
+
+  def GetPciDevices(self):
+    """Get all PCI devices present.
+
+    Raises:
+      Error: If PCI devices can't be read from sysfs.
+
+    Returns:
+      List of PciDevice instances.
+    """
+    with self._lock:
+      self._CheckPciHotplug()
+      if self._pci_devices is None:
+        self._pci_devices = ReadPciDevices(self._pci_addresses)
+      return list(self._pci_devices)
+
+
+_tool_registry = None
+_tool_registry_lock = threading.Lock()
+
+
+def GetToolRegistry():
+  """Get the ToolRegistry instance shared by all tiles."""
+  global _tool_registry
+  with _tool_registry_lock:
+    if _tool_registry is None:
+      _tool_registry = ToolRegistry()
+    return _tool_registry
+
+
+def SetToolRegistry(tool_registry):
+  """Replace the ToolRegistry instance shared by all tiles, i.e. in tests."""
+  global _tool_registry
+  with _tool_registry_lock:
+    _tool_registry = tool_registry
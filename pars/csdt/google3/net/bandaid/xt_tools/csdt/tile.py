@@ -1,17 +1,134 @@
 """Console Status Display Tool tile base class."""
 
 import logging
+import math
+import threading
 import time
 
 from google3.net.bandaid.xt_tools.csdt import lib_colors
 from google3.net.bandaid.xt_tools.csdt import lib_commands
 from google3.net.bandaid.xt_tools.csdt import lib_common
+from google3.net.bandaid.xt_tools.csdt import lib_stats
+
+
+# Tiles which have found a degraded component are refreshed at least this
+# often (seconds), so that a replaced part is shown as healthy promptly.
+DEGRADED_REFRESH_INTERVAL = 30
+
+# Tiles are refreshed at least this often (seconds) while a technician is at
+# the console, see lib_common.IsUserActive().
+ACTIVE_REFRESH_INTERVAL = 60
+
+# Refreshes taking at least this long (seconds) are expensive. Expensive tiles
+# whose state hasn't changed are refreshed less often, doubling their refresh
+# interval after every unchanged refresh up to MAX_REFRESH_BACKOFF times.
+EXPENSIVE_REFRESH_SECONDS = 1.0
+MAX_REFRESH_BACKOFF = 2
+
+# Hardware tools may run for at most this many seconds of every minute, unless
+# a refresh is forced.
+HARDWARE_TOOL_BUDGET_SECONDS = 15
+HARDWARE_TOOL_BUDGET_WINDOW = 60
+
+# Tiles showing network configuration are refreshed when links, addresses or
+# routes change, but at most this often (seconds), so that a flapping link
+# doesn't keep them refreshing.
+NETWORK_CHANGE_REFRESH_INTERVAL = 5
 
 
 class Error(Exception):
   pass
 
 
+class HardwareToolBudget(object):
+  """Limit the time spent running hardware tools within a sliding window.
+
+  The budget is checked before refreshes are scheduled and charged once they
+  complete, so tiles refreshed at the same time may overrun it. All methods
+  are thread-safe.
+  """
+
+  def __init__(self, budget_seconds=HARDWARE_TOOL_BUDGET_SECONDS,
+               window_seconds=HARDWARE_TOOL_BUDGET_WINDOW):
+    """Constructs a HardwareToolBudget object.
+
+    Args:
+      budget_seconds: Time hardware tools may run for within the window
+          (float).
+      window_seconds: Length of the sliding window (float).
+    """
+    self.budget_seconds = budget_seconds
+    self.window_seconds = window_seconds
+    # List of (completion timestamp, seconds) tuples, oldest first.
+    self._charges = []
+    self._lock = threading.Lock()
+
+  def _ExpireCharges(self, now):
+    """Forget charges which have left the window."""
+    while self._charges and self._charges[0][0] <= now - self.window_seconds:
+      self._charges.pop(0)
+
+  def Charge(self, seconds):
+    """Record time spent running hardware tools.
+
+    Args:
+      seconds: Time taken by a refresh of a tile (float).
+    """
+    with self._lock:
+      self._charges.append((time.time(), seconds))
+
+  def GetSecondsUntilAvailable(self):
+    """Get the number of seconds until the budget allows another refresh."""
+    now = time.time()
+    with self._lock:
+      self._ExpireCharges(now)
+      spent_seconds = sum(seconds for _, seconds in self._charges)
+      # Time until enough of the oldest charges leave the window.
+      available_timestamp = now
+      for timestamp, seconds in self._charges:
+        if spent_seconds < self.budget_seconds:
+          break
+        spent_seconds -= seconds
+        available_timestamp = timestamp + self.window_seconds
+      return max(0, available_timestamp - now)
+
+
+_hardware_tool_budget = None
+_hardware_tool_budget_lock = threading.Lock()
+
+
+def GetHardwareToolBudget():
+  """Get the HardwareToolBudget instance shared by all tiles."""
+  global _hardware_tool_budget
+  with _hardware_tool_budget_lock:
+    if _hardware_tool_budget is None:
+      _hardware_tool_budget = HardwareToolBudget()
+    return _hardware_tool_budget
+
+
+def HandleNetworkChanges(network_monitor, information_tiles):
+  """Refresh tiles showing network configuration once it has changed.
+
+  Args:
+    network_monitor: Instance of lib_netlink.RtnetlinkMonitor().
+    information_tiles: Tiles which may be refreshed (list of
+        InformationTile).
+
+  Returns:
+    True if network configuration has changed.
+    False otherwise.
+  """
+  if not network_monitor.ReadChanges():
+    return False
+  logging.info('Network configuration has changed.')
+  lib_common.GetHostSnapshot().Invalidate()
+  for information_tile in information_tiles:
+    if information_tile.UsesNetworkConfiguration():
+      information_tile.RequestEarlyRefresh(
+          min_interval=NETWORK_CHANGE_REFRESH_INTERVAL)
+  return True
+
+
 class InformationTile(object):
   """Base class for information tiles displayed by CSDT."""
 
@@ -30,9 +147,18 @@ class InformationTile(object):
     self.tile_name = self.GetTileName()
     self.refresh_timestamp = 0
     self.refresh_interval = 300
+    # Time at which the tile is refreshed ahead of its schedule, if any, see
+    # RequestEarlyRefresh().
+    self.early_refresh_timestamp = None
+    # Data collected by the last refresh, or None if it has failed.
+    self.tile_data = None
+    # Number of consecutive expensive refreshes which haven't changed the
+    # tile's state, see GetAdaptiveRefreshInterval().
+    self.refresh_backoff = 0
 
-    # Set up variables useful to multiple tiles.
-    self.runner = lib_commands.CommandRunner()
+    # Set up variables useful to multiple tiles. A tile is only refreshed by
+    # one thread at a time, so it can use a runner with its own event loop.
+    self.runner = lib_commands.AsyncCommandRunner()
 
     self.hostname = None
     self.service_tag = None
@@ -47,15 +173,20 @@ class InformationTile(object):
     self.ipv6_gateway = None
 
   def RefreshCommonTileData(self):
-    """Refresh common tile data used by several tiles."""
-    self.hostname = lib_common.GetHostname(command_runner=self.runner)
-    self.service_tag = lib_common.GetServiceTag()
-    self.hardware_model = lib_common.GetHardwareModel()
+    """Refresh common tile data used by several tiles.
 
-    ipv4_configuration = lib_common.GetNetworkConfiguration(
-        command_runner=self.runner, ip_version=4)
-    ipv6_configuration = lib_common.GetNetworkConfiguration(
-        command_runner=self.runner, ip_version=6)
+    The data is served from a snapshot shared by all tiles, so that commands
+    collecting it aren't run again by every tile being refreshed.
+    """
+    host_snapshot = lib_common.GetHostSnapshot()
+    host_snapshot.Refresh()
+
+    self.hostname = host_snapshot.hostname
+    self.service_tag = host_snapshot.service_tag
+    self.hardware_model = host_snapshot.hardware_model
+
+    ipv4_configuration = host_snapshot.ipv4_configuration
+    ipv6_configuration = host_snapshot.ipv6_configuration
 
     if ipv4_configuration:
       self.ipv4_interface = ipv4_configuration[0]
@@ -80,10 +211,34 @@ class InformationTile(object):
     """Return True if tile name should be displayed on the tile's first line."""
     return True
 
+  @staticmethod
+  def IsCheapToRefresh():
+    """Return True if tile may be refreshed during CSDT's initial delay."""
+    return False
+
+  @staticmethod
+  def UsesHardwareTools():
+    """Return True if tile refreshes are charged to the hardware tool budget."""
+    return False
+
+  @staticmethod
+  def UsesNetworkConfiguration():
+    """Return True if tile is refreshed when network configuration changes."""
+    return False
+
   def GetSecondsUntilRefresh(self):
     """Get the number of seconds until next data refresh."""
     seconds_to_refresh = int(
-        self.refresh_interval - (time.time() - self.refresh_timestamp))
+        self.GetAdaptiveRefreshInterval() -
+        (time.time() - self.refresh_timestamp))
+    if self.early_refresh_timestamp is not None:
+      seconds_to_refresh = min(
+          seconds_to_refresh,
+          int(math.ceil(self.early_refresh_timestamp - time.time())))
+    if self.UsesHardwareTools():
+      seconds_to_refresh = max(
+          seconds_to_refresh,
+          int(math.ceil(GetHardwareToolBudget().GetSecondsUntilAvailable())))
     if seconds_to_refresh > 0:
       return seconds_to_refresh
     return 0
@@ -92,8 +247,39 @@ class InformationTile(object):
     """Get the minimum number of seconds between data refreshes."""
     return self.refresh_interval
 
+  def GetAdaptiveRefreshInterval(self):
+    """Get the refresh interval adapted to the tile's state and cost.
+
+    Tiles showing a degraded component, and all tiles while a technician is
+    pressing keys, are refreshed more often. Expensive tiles whose state
+    hasn't changed recently are refreshed less often.
+
+    Returns:
+      Number of seconds between data refreshes (int).
+    """
+    refresh_interval = self.GetRefreshInterval()
+    if self.tile_data is not None and self.IsDegraded(self.tile_data):
+      return min(refresh_interval, DEGRADED_REFRESH_INTERVAL)
+    if lib_common.IsUserActive():
+      return min(refresh_interval, ACTIVE_REFRESH_INTERVAL)
+    return refresh_interval * 2 ** self.refresh_backoff
+
+  def RequestEarlyRefresh(self, min_interval=0):
+    """Refresh the tile ahead of its schedule.
+
+    Args:
+      min_interval: Minimum number of seconds since the last refresh (float).
+    """
+    early_refresh_timestamp = max(
+        time.time(), self.refresh_timestamp + min_interval)
+    if self.early_refresh_timestamp is not None:
+      early_refresh_timestamp = min(
+          early_refresh_timestamp, self.early_refresh_timestamp)
+    self.early_refresh_timestamp = early_refresh_timestamp
+
   def UpdateRefreshTimestamp(self):
     self.refresh_timestamp = time.time()
+    self.early_refresh_timestamp = None
     logging.debug('Updated refresh_timestamp with \'%s\'', self.GetTileName())
 
   def IsRefreshRequired(self):
@@ -101,10 +287,49 @@ class InformationTile(object):
     return self.GetSecondsUntilRefresh() == 0
 
   def GetContent(self):
+    """Refresh common tile data and return tile content to be displayed.
+
+    Time taken and commands run are recorded in the tile's statistics, see
+    lib_stats.
+    """
+    previous_tile_data = self.tile_data
+    start_timestamp = time.time()
+    with lib_stats.MeasureTileRefresh(self.GetTileName()):
+      content = self._GetContent()
+    self._UpdateRefreshCost(
+        previous_tile_data, seconds=time.time() - start_timestamp)
+    return content
+
+  def _UpdateRefreshCost(self, previous_tile_data, seconds):
+    """Charge the hardware tool budget and adjust the refresh backoff.
+
+    Args:
+      previous_tile_data: Data collected by the previous refresh, or None if
+          it has failed.
+      seconds: Time taken by the refresh (float).
+    """
+    if self.UsesHardwareTools():
+      GetHardwareToolBudget().Charge(seconds)
+
+    if (seconds < EXPENSIVE_REFRESH_SECONDS or
+        self.tile_data is None or previous_tile_data is None or
+        self.IsDegraded(self.tile_data) or
+        self.GetTileState(self.tile_data) !=
+        self.GetTileState(previous_tile_data)):
+      self.refresh_backoff = 0
+    elif self.refresh_backoff < MAX_REFRESH_BACKOFF:
+      self.refresh_backoff += 1
+      logging.debug('Backing off refreshes of unchanged \'%s\' tile to every '
+                    '%d seconds.', self.GetTileName(),
+                    self.GetAdaptiveRefreshInterval())
+
+  def _GetContent(self):
     """Refresh common tile data and return tile content to be displayed."""
     self.RefreshCommonTileData()
+    self.tile_data = None
     try:
-      return self.GetTileContent(tile_data=self.GetTileData())
+      self.tile_data = self.GetTileData()
+      return self.GetTileContent(tile_data=self.tile_data)
     # This is to allow tiles to show custom errors when it is beneficial for
     # the CSDT user to see them.
     except Error as exception:
@@ -128,3 +353,15 @@ class InformationTile(object):
   def GetTileContent(self, tile_data):
     """Return the tile's content to be displayed."""
     raise NotImplementedError
+
+  def IsDegraded(self, unused_tile_data):
+    """Return True if tile data shows a degraded component."""
+    return False
+
+  def GetTileState(self, tile_data):
+    """Return the part of tile data whose changes reset the refresh backoff."""
+    return tile_data
+
+  def GetTileMetrics(self, tile_data):
+    """Return metrics exported from tile data (list of lib_export.Sample)."""
+    return []
@@ -3,6 +3,8 @@
 import logging
 
 from google3.net.bandaid.xt_tools.csdt import lib_commands
+from google3.net.bandaid.xt_tools.csdt import lib_export
+from google3.net.bandaid.xt_tools.csdt import lib_icmp
 from google3.net.bandaid.xt_tools.csdt import lib_status
 from google3.net.bandaid.xt_tools.csdt import tile
 
@@ -14,24 +16,87 @@ class ConnectivityStatusTile(tile.InformationTile):
   def GetTileName():
     return 'Network connectivity'
 
-  def PingTarget(self, target, interface=None, ip_version=4):
-    if ip_version == 4:
-      command = 'ping -c2 -i 0.3 %s' % target
-    elif ip_version == 6 and interface:
-      command = 'ping6 -c2 -i 0.3 -I%s %s' % (interface, target)
-    else:
-      raise ValueError('Unsupported IP version.')
+  @staticmethod
+  def UsesNetworkConfiguration():
+    return True
+
+  @staticmethod
+  def FormatMilliseconds(seconds):
+    """Return a duration in milliseconds, i.e. '0.4ms' or '12ms'."""
+    if seconds is None:
+      return '-'
+    milliseconds = seconds * 1000
+    if milliseconds < 9.95:
+      return '%.1fms' % milliseconds
+    return '%.0fms' % milliseconds
+
+  def ProbeTargets(self, targets):
+    """Probe several targets at the same time with ICMP sockets.
 
-    try:
-      result = self.runner.Run(command, timeout=5)
-      if result.exit_code == 0:
-        return lib_status.OK
+    Args:
+      targets: List of (target, interface, ip_version) tuples.
+
+    Raises:
+      lib_icmp.Error: If an ICMP socket can't be opened.
+      ValueError: If an unsupported IP version is requested.
+
+    Returns:
+      List of dictionaries with a lib_status status and latency statistics,
+      one for each target.
+    """
+    tile_data = []
+    for result in lib_icmp.GetIcmpProber().Probe(targets):
+      if result['address'] is None:
+        status = lib_status.UNKNOWN
+      elif result['received']:
+        status = lib_status.OK
       else:
-        return lib_status.ERROR
-    except lib_commands.Error as e:
-      logging.error('Unable to test connectivity to: %s', target)
-      logging.exception(e)
-      return lib_status.UNKNOWN
+        status = lib_status.ERROR
+      tile_data.append({
+          'target': result['target'],
+          'status': status,
+          'rtt': result['avg_rtt'],
+          'jitter': result['jitter'],
+          'loss': result['loss'],
+      })
+    return tile_data
+
+  def PingTargets(self, targets):
+    """Ping several targets at the same time by running ping.
+
+    Args:
+      targets: List of (target, interface, ip_version) tuples.
+
+    Raises:
+      ValueError: If an unsupported IP version is requested.
+
+    Returns:
+      List of lib_status statuses, one for each target.
+    """
+    pending_pings = []
+    for target, interface, ip_version in targets:
+      if ip_version == 4:
+        command = 'ping -c2 -i 0.3 %s' % target
+      elif ip_version == 6 and interface:
+        command = 'ping6 -c2 -i 0.3 -I%s %s' % (interface, target)
+      else:
+        raise ValueError('Unsupported IP version.')
+      pending_pings.append(self.runner.Start(command, timeout=5))
+    self.runner.Wait(pending_pings)
+
+    statuses = []
+    for (target, _, _), pending_ping in zip(targets, pending_pings):
+      try:
+        result = pending_ping.GetResult()
+        if result.exit_code == 0:
+          statuses.append(lib_status.OK)
+        else:
+          statuses.append(lib_status.ERROR)
+      except lib_commands.Error as e:
+        logging.error('Unable to test connectivity to: %s', target)
+        logging.exception(e)
+        statuses.append(lib_status.UNKNOWN)
+    return statuses
 
   def GetRefreshInterval(self):
     """"Get the minimum number of seconds between data refreshes."""
@@ -42,60 +107,96 @@ class ConnectivityStatusTile(tile.InformationTile):
 
     # This is an IPv4 machine, test IPv4 connectivity.
     if self.ipv4_address:
-      tile_data.append({
-          'target': self.ipv4_gateway,
-          'status': self.PingTarget(
-              target=self.ipv4_gateway,
-              ip_version=4),
-      })
-      tile_data.append({
-          'target': '8.8.8.8',
-          'status': self.PingTarget(
-              target='8.8.8.8',
-              ip_version=4),
-      })
-      tile_data.append({
-          'target': '8.8.4.4',
-          'status': self.PingTarget(
-              target='8.8.4.4',
-              ip_version=4),
-      })
+      targets = [
+          (self.ipv4_gateway, None, 4),
+          ('8.8.8.8', None, 4),
+          ('8.8.4.4', None, 4),
+      ]
     # This is an IPv6-only machine, test IPv6 connectivity.
     elif self.ipv6_address:
-      tile_data.append({
-          'target': self.ipv6_gateway,
-          'status': self.PingTarget(
-              target=self.ipv6_gateway,
-              interface=self.ipv6_interface,
-              ip_version=6),
-      })
-      tile_data.append({
-          'target': 'ipv6.google.com',
-          'status': self.PingTarget(
-              target='ipv6.google.com',
-              interface=self.ipv6_interface,
-              ip_version=6),
-      })
+      targets = [
+          (self.ipv6_gateway, self.ipv6_interface, 6),
+          ('ipv6.google.com', self.ipv6_interface, 6),
+      ]
     # This is something less useful: a machine with no network configuration.
     else:
       logging.error('This machine doesn\'t have usable network configuration.')
+      targets = []
 
+    icmp_prober = lib_icmp.GetIcmpProber()
+    if icmp_prober.use_sockets:
+      try:
+        return self.ProbeTargets(targets)
+      except lib_icmp.Error as e:
+        logging.warning('Falling back to running ping: %s', e)
+        icmp_prober.use_sockets = False
+
+    for (target, _, _), status in zip(targets, self.PingTargets(targets)):
+      tile_data.append({
+          'target': target,
+          'status': status,
+      })
     return tile_data
 
   def GetTileContent(self, tile_data):
     output = []
-    row_format = (
-        '%(target)-30s '
-        '%(status)7s'
-    )
+    # Latency statistics over recent refreshes are only known when probing
+    # with ICMP sockets.
+    show_latency = any('rtt' in target for target in tile_data)
+    if show_latency:
+      row_format = (
+          '%(target)-16s '
+          '%(rtt)-6s '
+          '%(jitter)-6s '
+          '%(loss)-4s '
+          '%(status)s'
+      )
+      output.append(row_format % {
+          'target': 'Target',
+          'rtt': 'RTT',
+          'jitter': 'Jitter',
+          'loss': 'Loss',
+          'status': 'Status',
+      })
+    else:
+      row_format = (
+          '%(target)-30s '
+          '%(status)7s'
+      )
     if tile_data:
       for connectivity_test in tile_data:
         fields = {
             'target': connectivity_test['target'],
             'status': connectivity_test['status'].format(c=self.color_codes),
         }
+        if show_latency:
+          loss = connectivity_test.get('loss')
+          fields['rtt'] = self.FormatMilliseconds(connectivity_test.get('rtt'))
+          fields['jitter'] = self.FormatMilliseconds(
+              connectivity_test.get('jitter'))
+          fields['loss'] = '-' if loss is None else '%.0f%%' % (loss * 100)
         output.append(row_format % fields)
     else:
       output.append('This machine\'s network is not configured.')
 
     return '\n'.join(output)
+
+  def GetTileMetrics(self, tile_data):
+    samples = []
+    for target in tile_data:
+      # Targets which couldn't be tested aren't known to be up or down.
+      if target['status'] == lib_status.UNKNOWN:
+        continue
+      labels = {'target': target['target']}
+      samples.append(lib_export.Sample(
+          'csdt_connectivity_up', target['status'] == lib_status.OK, labels))
+      if target.get('rtt') is not None:
+        samples.append(lib_export.Sample(
+            'csdt_connectivity_rtt_seconds', target['rtt'], labels))
+      if target.get('jitter') is not None:
+        samples.append(lib_export.Sample(
+            'csdt_connectivity_jitter_seconds', target['jitter'], labels))
+      if target.get('loss') is not None:
+        samples.append(lib_export.Sample(
+            'csdt_connectivity_loss_ratio', target['loss'], labels))
+    return samples
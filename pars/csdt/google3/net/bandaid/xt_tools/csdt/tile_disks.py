@@ -1,8 +1,11 @@
 """Console Status Display Tool disk status tile."""
 
-from google3.net.bandaid.xt_tools.csdt import lib_disk_parser
+from google3.net.bandaid.xt_tools.csdt import lib_disk_backends
+from google3.net.bandaid.xt_tools.csdt import lib_export
+# Disk backends register themselves when imported.
 from google3.net.bandaid.xt_tools.csdt import lib_hpssacli
 from google3.net.bandaid.xt_tools.csdt import lib_megacli
+from google3.net.bandaid.xt_tools.csdt import lib_perccli
 from google3.net.bandaid.xt_tools.csdt import lib_status
 from google3.net.bandaid.xt_tools.csdt import tile
 
@@ -10,10 +13,18 @@ from google3.net.bandaid.xt_tools.csdt import tile
 class DiskStatusTile(tile.InformationTile):
   """Disk status information tile."""
 
+  def __init__(self, *args, **kwargs):
+    super(DiskStatusTile, self).__init__(*args, **kwargs)
+    self.disk_backend_selector = lib_disk_backends.DiskBackendSelector()
+
   @staticmethod
   def GetTileName():
     return 'Disk status'
 
+  @staticmethod
+  def UsesHardwareTools():
+    return True
+
   def GetSlotStatus(self, slot_data):
     if slot_data['predictive_failure'] > 0:
       return lib_status.ERROR
@@ -35,27 +46,42 @@ class DiskStatusTile(tile.InformationTile):
 
     return lib_status.UNKNOWN
 
+  def GetSlotKey(self, slot_data):
+    """Get the adapter, enclosure and slot number of a disk, for sorting."""
+    enclosure = slot_data.get('enclosure')
+    return (slot_data.get('adapter') or 0,
+            -1 if enclosure is None else enclosure, slot_data['slot'])
+
+  def GetSlotLabel(self, slot_data):
+    """Get the slot number, prefixed with the enclosure and adapter.
+
+    Disks are labelled like their PercCLI drive path, i.e. 'c1/e32/s3'. The
+    enclosure is left out if the disk isn't in one and the adapter if it's the
+    first, so disks of a controller without enclosures are labelled with only
+    their slot number.
+    """
+    label = ['s%d' % slot_data['slot']]
+    if slot_data.get('enclosure') is not None:
+      label.insert(0, 'e%d' % slot_data['enclosure'])
+    if slot_data.get('adapter'):
+      label.insert(0, 'c%d' % slot_data['adapter'])
+    if len(label) == 1:
+      return slot_data['slot']
+    return '/'.join(label)
+
   def GetTileData(self):
     tile_data = {
         'slots_all': [],
         'slots_failed': [],
     }
-    for disk_library in [lib_megacli.MegaCLI, lib_hpssacli.Hpssacli]:
-      try:
-        disk_library_instance = disk_library(command_runner=self.runner)
-        disk_slots = disk_library_instance.GetDiskInformation()
-        if disk_slots:
-          break
-      except lib_disk_parser.Error:
-        disk_slots = []
-
-    for disk_slot in disk_slots:
-      tile_data['slots_all'].append(disk_slot['slot'])
-      if self.GetSlotStatus(disk_slot) != lib_status.OK:
-        tile_data['slots_failed'].append(disk_slot['slot'])
+    disk_slots = self.disk_backend_selector.GetDiskInformation(
+        command_runner=self.runner)
 
-    tile_data['slots_all'].sort()
-    tile_data['slots_failed'].sort()
+    for disk_slot in sorted(disk_slots, key=self.GetSlotKey):
+      slot_label = self.GetSlotLabel(disk_slot)
+      tile_data['slots_all'].append(slot_label)
+      if self.GetSlotStatus(disk_slot) != lib_status.OK:
+        tile_data['slots_failed'].append(slot_label)
     return tile_data
 
   def GetTileContent(self, tile_data):
@@ -78,3 +104,13 @@ class DiskStatusTile(tile.InformationTile):
     else:
       output.append('{c.green}All disks are healthy{c.reset}')
     return '\n'.join(output).format(c=self.color_codes)
+
+  def IsDegraded(self, tile_data):
+    return bool(tile_data['slots_failed'])
+
+  def GetTileMetrics(self, tile_data):
+    return [
+        lib_export.Sample(
+            'csdt_disk_failed', slot in tile_data['slots_failed'],
+            {'slot': slot})
+        for slot in tile_data['slots_all']]
@@ -1,5 +1,6 @@
 """Console Status Display Tool fan status tile."""
 
+from google3.net.bandaid.xt_tools.csdt import lib_export
 from google3.net.bandaid.xt_tools.csdt import lib_sensors
 from google3.net.bandaid.xt_tools.csdt import tile
 
@@ -11,18 +12,25 @@ class FanStatusTile(tile.InformationTile):
   def GetTileName():
     return 'Fan status'
 
+  @staticmethod
+  def UsesHardwareTools():
+    return True
+
   def GetTileData(self):
     tile_data = {
         'all_fans': [],
         'failed_fans': [],
+        'fan_speeds': {},
     }
-    sensors = lib_sensors.GetSensors(command_runner=self.runner)
+    sensors = lib_sensors.GetSensorSampler().GetSensors(
+        command_runner=self.runner)
     fans = sensors.get('sensor-fan-map', {})
 
     for sensor_name, sensor_value in fans.iteritems():
       # Physical fans are labelled starting with 1.
       fan_id = int(sensor_name.replace('sensor-fan', '')) + 1
       tile_data['all_fans'].append(fan_id)
+      tile_data['fan_speeds'][fan_id] = sensor_value
       # Positive fan sensor values mean fans are operational.
       if sensor_value <= 0:
         tile_data['failed_fans'].append(fan_id)
@@ -52,3 +60,22 @@ class FanStatusTile(tile.InformationTile):
       output.append('{c.green}All fans are healthy{c.reset}')
 
     return '\n'.join(output).format(c=self.color_codes)
+
+  def IsDegraded(self, tile_data):
+    return bool(tile_data['failed_fans'])
+
+  def GetTileState(self, tile_data):
+    # Fan speeds change all the time without any change of the fans' state.
+    return (tile_data['all_fans'], tile_data['failed_fans'])
+
+  def GetTileMetrics(self, tile_data):
+    samples = []
+    for fan_id in tile_data['all_fans']:
+      labels = {'fan': fan_id}
+      samples.append(lib_export.Sample(
+          'csdt_fan_failed', fan_id in tile_data['failed_fans'], labels))
+      fan_speed = tile_data['fan_speeds'].get(fan_id)
+      if isinstance(fan_speed, (int, float)):
+        samples.append(lib_export.Sample(
+            'csdt_fan_speed', fan_speed, labels))
+    return samples
@@ -1,6 +1,7 @@
 """Console Status Display Tool top status bar (host identification) tile."""
 
 from google3.net.bandaid.xt_tools.csdt import lib_common
+from google3.net.bandaid.xt_tools.csdt import lib_export
 from google3.net.bandaid.xt_tools.csdt import tile
 
 
@@ -11,9 +12,17 @@ class IdentificationTile(tile.InformationTile):
   def GetTileName():
     return 'Top status bar'
 
+  @staticmethod
+  def UsesNetworkConfiguration():
+    return True
+
   def DisplayTileName(self):
     return False
 
+  @staticmethod
+  def IsCheapToRefresh():
+    return True
+
   def GetRefreshInterval(self):
     return 60
 
@@ -94,3 +103,11 @@ class IdentificationTile(tile.InformationTile):
       output.append(''.join(current_row).rstrip())
 
     return '\n'.join(output)
+
+  def GetTileMetrics(self, tile_data):
+    return [lib_export.Sample('csdt_machine_info', 1, {
+        'hostname': tile_data['hostname'] or '',
+        'service_tag': tile_data['service_tag'] or '',
+        'hardware_model': tile_data['hardware_model'] or '',
+        'ip_address': tile_data['ip_address'],
+    })]
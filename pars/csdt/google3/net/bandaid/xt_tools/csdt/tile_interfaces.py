@@ -4,6 +4,7 @@ import logging
 import re
 
 from google3.net.bandaid.xt_tools.csdt import lib_ethtool
+from google3.net.bandaid.xt_tools.csdt import lib_export
 from google3.net.bandaid.xt_tools.csdt import lib_interfaces
 from google3.net.bandaid.xt_tools.csdt import tile
 
@@ -11,10 +12,18 @@ from google3.net.bandaid.xt_tools.csdt import tile
 RE_NETWORK_INTERFACE_PATTERN = re.compile(
     r'^(?P<prefix>bond|eth)(?P<index>[0-9]+)$')
 
+# Counters of packets which have been lost, summed up in the traffic table.
+LOST_PACKET_COUNTERS = ['rx_errors', 'rx_dropped', 'tx_errors', 'tx_dropped']
+
 
 class InterfaceStatusTile(tile.InformationTile):
   """Network interfaces information tile."""
 
+  def __init__(self, *args, **kwargs):
+    super(InterfaceStatusTile, self).__init__(*args, **kwargs)
+    self.statistics_sampler = lib_interfaces.InterfaceStatisticsSampler()
+    self.bonding_collector = lib_interfaces.BondingStateCollector()
+
   @staticmethod
   def FormatNetworkBandwidth(bandwidth_mbps):
     """Return network interface speed in Mbps or Gbps or '-' if down."""
@@ -25,24 +34,40 @@ class InterfaceStatusTile(tile.InformationTile):
     else:
       return '%dGbps' % (bandwidth_mbps / 1000)
 
+  @staticmethod
+  def FormatRate(rate, unit):
+    """Return a rate with an SI prefix, i.e. '940Mbps' or '8.1kpps'."""
+    prefix = ''
+    for prefix in ['', 'k', 'M', 'G']:
+      if rate < 999.5:
+        break
+      rate /= 1000.0
+    if rate < 9.95 and prefix:
+      return '%.1f%s%s' % (rate, prefix, unit)
+    return '%.0f%s%s' % (rate, prefix, unit)
+
   @staticmethod
   def GetTileName():
     return 'Network interface status'
 
+  @staticmethod
+  def UsesNetworkConfiguration():
+    return True
+
   def GetTileData(self):
     tile_data = {}
 
     interface_statistics = {}
+    interface_rates = {}
     try:
-      interface_statistics = lib_interfaces.GetInterfaceStatisticsFromMachine(
-          command_runner=self.runner)
+      interface_statistics, interface_rates = (
+          self.statistics_sampler.Sample())
     except lib_interfaces.Error:
       logging.exception('Unable to get interface statistics on this machine.')
 
     bonding_state = {}
     try:
-      bonding_state = lib_interfaces.GetBondingStateFromMachine(
-          command_runner=self.runner)
+      bonding_state = self.bonding_collector.Collect()
     except lib_interfaces.Error:
       logging.exception('Unable to get bonding state on this machine.')
 
@@ -53,6 +78,7 @@ class InterfaceStatusTile(tile.InformationTile):
           command_runner=self.runner, device=interface)
 
     tile_data['interface_statistics'] = interface_statistics
+    tile_data['interface_rates'] = interface_rates
     tile_data['bonding_state'] = bonding_state
     tile_data['ethtool_details'] = ethtool_details
     return tile_data
@@ -61,7 +87,7 @@ class InterfaceStatusTile(tile.InformationTile):
     ethtool_details = tile_data.get('ethtool_details')
     bonding_state = tile_data.get('bonding_state')
     bonding_master = bonding_state.get('master')
-    bonding_slaves = bonding_state.get('slaves')
+    bonding_slaves = bonding_state.get('slaves', {})
 
     output = []
     general_info_format = '%-20s: %-21s'
@@ -112,6 +138,8 @@ class InterfaceStatusTile(tile.InformationTile):
     # Add header to the interface table.
     output.append(row_format % fields)
 
+    # Physical interfaces shown in the table, with their port labels.
+    displayed_interfaces = []
     for interface in sorted(tile_data['interface_statistics'].iterkeys()):
       fields = {}
       match = RE_NETWORK_INTERFACE_PATTERN.match(interface)
@@ -126,12 +154,26 @@ class InterfaceStatusTile(tile.InformationTile):
       fields['interface_name'] = str(interface_index)
       fields['interface_speed'] = self.FormatNetworkBandwidth(
           ethtool_details[interface].get('speed', 0))
+      # Bonding slaves whose link failed since recent refreshes may look
+      # healthy right now, so they are flagged in addition to their state.
+      recent_link_flaps = bonding_slaves.get(interface, {}).get(
+          'recent_link_flaps')
       if fields['interface_speed'] in ['1Gbps', '10Gbps', '40Gbps']:
-        fields['interface_status'] = '{c.green}UP{c.reset}'.format(
-            c=self.color_codes)
+        if recent_link_flaps:
+          fields['interface_status'] = (
+              '{c.yellow}UP, flapping (%dx){c.reset}'.format(
+                  c=self.color_codes) % recent_link_flaps)
+        else:
+          fields['interface_status'] = '{c.green}UP{c.reset}'.format(
+              c=self.color_codes)
       elif fields['interface_speed'] == '-':
-        fields['interface_status'] = '{c.red}DOWN{c.reset}'.format(
-            c=self.color_codes)
+        if recent_link_flaps:
+          fields['interface_status'] = (
+              '{c.red}DOWN, flapping (%dx){c.reset}'.format(
+                  c=self.color_codes) % recent_link_flaps)
+        else:
+          fields['interface_status'] = '{c.red}DOWN{c.reset}'.format(
+              c=self.color_codes)
       else:
         fields['interface_status'] = '{c.red}Incorrect speed{c.reset}'.format(
             c=self.color_codes)
@@ -156,5 +198,94 @@ class InterfaceStatusTile(tile.InformationTile):
         fields['bonding_key'] = '-'
 
       output.append(row_format % fields)
+      displayed_interfaces.append((fields['interface_name'], interface))
 
+    output.extend(self._GetTrafficTable(
+        tile_data.get('interface_rates', {}), displayed_interfaces))
     return '\n'.join([line.rstrip() for line in output])
+
+  def _GetTrafficTable(self, interface_rates, displayed_interfaces):
+    """Get lines of a table of traffic rates since the last refresh.
+
+    Args:
+      interface_rates: Rates of interface counters, see
+          lib_interfaces.InterfaceStatisticsSampler.Sample().
+      displayed_interfaces: Port labels and names of interfaces to include
+          (list of tuples).
+
+    Returns:
+      Lines of the table, or an empty list if no rates are known yet (list).
+    """
+    row_format = '%(port)-4s %(rx)-15s %(tx)-15s %(lost)s'
+    output = []
+    for port, interface in displayed_interfaces:
+      rates = interface_rates.get(interface)
+      if not rates:
+        continue
+      lost_rate = sum(rates.get(key, 0) for key in LOST_PACKET_COUNTERS)
+      lost = self.FormatRate(lost_rate, '')
+      if lost_rate:
+        lost = '{c.red}%s{c.reset}'.format(c=self.color_codes) % lost
+      output.append(row_format % {
+          'port': port,
+          'rx': '%s %s' % (
+              self.FormatRate(rates.get('rx_bytes', 0) * 8, 'bps'),
+              self.FormatRate(rates.get('rx_packets', 0), 'pps')),
+          'tx': '%s %s' % (
+              self.FormatRate(rates.get('tx_bytes', 0) * 8, 'bps'),
+              self.FormatRate(rates.get('tx_packets', 0), 'pps')),
+          'lost': lost,
+      })
+    if not output:
+      return []
+    header = row_format % {
+        'port': 'Port', 'rx': 'RX', 'tx': 'TX', 'lost': 'Lost/s'}
+    return ['', header] + output
+
+  def GetTileMetrics(self, tile_data):
+    samples = []
+    for interface, details in sorted(tile_data['ethtool_details'].iteritems()):
+      labels = {'interface': interface}
+      if 'link_state' in details:
+        samples.append(lib_export.Sample(
+            'csdt_network_link_up', details['link_state'], labels))
+      if 'speed' in details:
+        samples.append(lib_export.Sample(
+            'csdt_network_link_speed_mbps', details['speed'], labels))
+      if details.get('carrier_changes') is not None:
+        samples.append(lib_export.Sample(
+            'csdt_network_carrier_changes_total', details['carrier_changes'],
+            labels))
+      # Optics details are only present if they have been collected.
+      if 'rx_power_dbm' in details:
+        samples.append(lib_export.Sample(
+            'csdt_network_optics_rx_power_dbm', details['rx_power_dbm'],
+            labels))
+      if 'laser_tx_power_dbm' in details:
+        samples.append(lib_export.Sample(
+            'csdt_network_optics_tx_power_dbm', details['laser_tx_power_dbm'],
+            labels))
+
+    bonding_state = tile_data['bonding_state']
+    bonding_master = bonding_state.get('master')
+    if bonding_master:
+      samples.append(lib_export.Sample(
+          'csdt_bonding_active_capacity_mbps',
+          bonding_state.get('active_capacity_mbps', 0),
+          {'master': bonding_master}))
+      active_members = bonding_state.get('active_members', [])
+      for interface, slave_state in sorted(
+          bonding_state.get('slaves', {}).iteritems()):
+        labels = {'master': bonding_master, 'interface': interface}
+        samples.append(lib_export.Sample(
+            'csdt_bonding_member_active', interface in active_members,
+            labels))
+        if 'link_flaps' in slave_state:
+          samples.append(lib_export.Sample(
+              'csdt_bonding_member_link_failures_total',
+              slave_state['link_flaps'], labels))
+        if 'flapping' in slave_state:
+          samples.append(lib_export.Sample(
+              'csdt_bonding_member_flapping', slave_state['flapping'],
+              labels))
+    return samples
@@ -2,11 +2,15 @@
 
 import re
 
+from google3.net.bandaid.xt_tools.csdt import lib_export
 from google3.net.bandaid.xt_tools.csdt import tile
 
 
 RE_MEMTOTAL = re.compile(r'^MemTotal:\s+(\d+)\s+kB$')
 
+# Location of memory details, which may point to a fake root for testing.
+PROC_MEMINFO_PATH = '/proc/meminfo'
+
 
 class MemoryStatusTile(tile.InformationTile):
   """RAM status information tile."""
@@ -15,9 +19,13 @@ class MemoryStatusTile(tile.InformationTile):
   def GetTileName():
     return 'Memory status'
 
+  @staticmethod
+  def IsCheapToRefresh():
+    return True
+
   def GetTileData(self):
     tile_data = {}
-    with open('/proc/meminfo', 'r') as file_handle:
+    with open(PROC_MEMINFO_PATH, 'r') as file_handle:
       for line in file_handle:
         match = RE_MEMTOTAL.match(line.strip())
         if match:
@@ -31,3 +39,9 @@ class MemoryStatusTile(tile.InformationTile):
       return 'Detected: %d GB' % int(memory_total / 1024 / 1024)
     else:
       raise tile.Error('Unable to get the total amount of memory detected.')
+
+  def GetTileMetrics(self, tile_data):
+    if 'meminfo_memtotal' not in tile_data:
+      return []
+    return [lib_export.Sample(
+        'csdt_memory_total_bytes', tile_data['meminfo_memtotal'] * 1024)]
@@ -2,6 +2,7 @@
 
 import re
 
+from google3.net.bandaid.xt_tools.csdt import lib_export
 from google3.net.bandaid.xt_tools.csdt import lib_sensors
 from google3.net.bandaid.xt_tools.csdt import lib_status
 from google3.net.bandaid.xt_tools.csdt import tile
@@ -21,12 +22,17 @@ class PsuStatusTile(tile.InformationTile):
   def GetTileName():
     return 'Power supply status'
 
+  @staticmethod
+  def UsesHardwareTools():
+    return True
+
   def GetTileData(self):
     tile_data = {
         'all_psus': set(),
         'failed_psus': set(),
     }
-    sensors = lib_sensors.GetSensors(command_runner=self.runner)
+    sensors = lib_sensors.GetSensorSampler().GetSensors(
+        command_runner=self.runner)
     for sensor_map in SENSOR_MAPS:
       current_map_sensors = sensors.get(sensor_map, {})
 
@@ -66,3 +72,12 @@ class PsuStatusTile(tile.InformationTile):
       output.append('{c.green}Both power supplies are healthy{c.reset}')
 
     return '\n'.join(output).format(c=self.color_codes)
+
+  def IsDegraded(self, tile_data):
+    return bool(tile_data['failed_psus'])
+
+  def GetTileMetrics(self, tile_data):
+    return [
+        lib_export.Sample(
+            'csdt_psu_failed', psu in tile_data['failed_psus'], {'psu': psu})
+        for psu in tile_data['all_psus']]